@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for sql_compare over a deterministic synthetic workload.
+
+Every workload is a pair of queries (the second a reordered/edited variant of
+the first) in a realistic or extreme shape: wide SELECT lists, thousands of
+WHERE AND terms, long JOIN chains, deep subquery nesting, giant IN lists and
+long string literals. Each public stage is timed separately and the results
+are written as JSON, so runs on different commits can be compared.
+
+Examples:
+  python benchmarks/bench_sql_compare.py --output bench_results.json
+  python benchmarks/bench_sql_compare.py --scale 0.1 --only wide_select,join_chain
+  python benchmarks/bench_sql_compare.py --output new.json --baseline old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import sql_compare  # noqa: E402
+
+RESULTS_VERSION = 1
+STAGES = ('normalize_sql', 'tokenize', 'canonicalize_common', 'build_difference_summary', 'generate_report')
+
+
+# =============================
+# Workload generator
+# =============================
+
+def _ident(rnd: random.Random, prefix: str = 'c') -> str:
+    return f'{prefix}{rnd.randrange(1_000_000)}'
+
+
+def _shuffled(rnd: random.Random, items: list) -> list:
+    items = list(items)
+    rnd.shuffle(items)
+    return items
+
+
+def wide_select(rnd: random.Random, n: int) -> tuple:
+    """SELECT list of n columns (with a few expressions and aliases); the variant reorders it."""
+    cols = [f'{_ident(rnd)}' if i % 7 else f'COALESCE(t.{_ident(rnd)}, 0) AS a{i}' for i in range(n)]
+    a = f"SELECT {', '.join(cols)} FROM big_table t WHERE t.id > 10"
+    b = f"select {', '.join(_shuffled(rnd, cols))} from big_table t where t.id > 10"
+    return a, b
+
+
+def and_terms(rnd: random.Random, n: int) -> tuple:
+    """WHERE clause of n AND terms; the variant reorders them and edits one."""
+    terms = [f"t.{_ident(rnd)} {rnd.choice(['=', '<>', '>=', '<'])} {rnd.randrange(1000)}" for _ in range(n)]
+    other = _shuffled(rnd, terms)
+    other[len(other) // 2] = "t.flag = 'Y'"
+    return (f"SELECT id FROM t WHERE {' AND '.join(terms)} ORDER BY id",
+            f"SELECT id FROM t WHERE {' AND '.join(other)} ORDER BY id")
+
+
+def join_chain(rnd: random.Random, n: int) -> tuple:
+    """n-way INNER JOIN chain; the variant reorders the joins."""
+    joins = [f'JOIN t{i} ON t{i}.k = t0.k{i}' for i in range(1, n + 1)]
+    return (f"SELECT t0.id FROM t0 {' '.join(joins)} WHERE t0.id = 1",
+            f"SELECT t0.id FROM t0 {' '.join(_shuffled(rnd, joins))} WHERE t0.id = 1")
+
+
+def nested_subqueries(rnd: random.Random, n: int) -> tuple:
+    """Subqueries nested n levels deep; the variant changes the innermost predicate."""
+    def build(leaf: str) -> str:
+        sql = f'SELECT a, b FROM base WHERE {leaf}'
+        for level in range(n):
+            sql = f'SELECT a, b FROM ({sql}) s{level} WHERE s{level}.a > {level}'
+        return sql
+    return build('x = 1'), build('x = 2')
+
+
+def in_list(rnd: random.Random, n: int) -> tuple:
+    """IN list of n literals; the variant drops one value."""
+    values = [str(rnd.randrange(10_000_000)) for _ in range(n)]
+    return (f"SELECT * FROM t WHERE id IN ({', '.join(values)})",
+            f"SELECT * FROM t WHERE id IN ({', '.join(values[:-1])})")
+
+
+def long_literal(rnd: random.Random, n: int) -> tuple:
+    """A string literal of n characters (with '' escapes, spaces and comment markers)."""
+    alphabet = "abcdefgh ij  -- /* ''"
+    body = ''.join(rnd.choice(alphabet) for _ in range(n)).replace("'''", "''")
+    if body.count("'") % 2:
+        body += "'"
+    return (f"INSERT INTO blobs (v) VALUES ('{body}');",
+            f"insert into blobs (v) values ('{body}x')")
+
+
+def realistic(rnd: random.Random, n: int) -> tuple:
+    """n report-style queries with comments, joins, filters and grouping, as one script per side."""
+    def query(i: int, variant: bool) -> str:
+        cols = [f'o.{_ident(rnd)}', f'c.{_ident(rnd)}', f'SUM(l.{_ident(rnd)}) AS total{i}']
+        conds = [f"o.status = 'OPEN'", f'o.region_id = {i % 50}', f"c.name LIKE 'A%'"]
+        if variant:
+            cols, conds = cols[::-1], conds[::-1]
+        return (f'-- report {i}\n'
+                f"SELECT {', '.join(cols)}\n  FROM orders o\n  JOIN customers c ON c.id = o.customer_id\n"
+                f'  LEFT JOIN lines l ON l.order_id = o.id /* detail */\n'
+                f"WHERE {' AND '.join(conds)}\nGROUP BY 1, 2\nORDER BY 3 DESC")
+    seed = rnd.random()
+    a = ';\n'.join(query(i, False) for i in range(n))
+    rnd.seed(seed)
+    b = ';\n'.join(query(i, True) for i in range(n))
+    return a, b
+
+
+# name -> (generator, size at scale 1.0)
+WORKLOADS = {
+    'realistic': (realistic, 200),
+    'wide_select': (wide_select, 10_000),
+    'and_terms': (and_terms, 5_000),
+    'join_chain': (join_chain, 200),
+    'nested_subqueries': (nested_subqueries, 500),
+    'in_list': (in_list, 50_000),
+    'long_literal': (long_literal, 1_000_000),
+}
+
+
+def generate(name: str, scale: float = 1.0, seed: int = 0) -> tuple:
+    """Return the (sql_a, sql_b) pair of workload name; the same arguments always give the same text."""
+    fn, size = WORKLOADS[name]
+    return fn(random.Random(f'{name}/{seed}'), max(1, int(size * scale)))
+
+
+# =============================
+# Timing
+# =============================
+
+def _timed(fn, repeat: int, slow_s: float) -> list:
+    """Run fn up to repeat times; stop repeating once a single run took longer than slow_s."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        if times[-1] > slow_s:
+            break
+    return times
+
+
+def bench_workload(name: str, *, scale: float = 1.0, repeat: int = 3, seed: int = 0,
+                   stages=STAGES, slow_s: float = 10.0) -> list:
+    """Time the given stages on one workload; returns one record per stage."""
+    a, b = generate(name, scale, seed)
+    flags = dict(enable_join_reorder=True, allow_full_outer=False, allow_left=False)
+    norm_a, norm_b = sql_compare.normalize_sql(a), sql_compare.normalize_sql(b)
+    tokens_a, tokens_b = sql_compare.tokenize(norm_a), sql_compare.tokenize(norm_b)
+    can_a, can_b = (sql_compare.canonicalize_common(norm_a, **flags),
+                    sql_compare.canonicalize_common(norm_b, **flags))
+    report_dir = tempfile.TemporaryDirectory()
+    report_path = os.path.join(report_dir.name, 'report.html')
+
+    def report():
+        result = sql_compare.compare_sql(a, b, **flags)
+        sql_compare.generate_report(result, 'both', 'html', report_path, False)
+
+    runners = {
+        'normalize_sql': lambda: (sql_compare.normalize_sql(a), sql_compare.normalize_sql(b)),
+        'tokenize': lambda: (sql_compare.tokenize(norm_a), sql_compare.tokenize(norm_b)),
+        'canonicalize_common': lambda: (sql_compare.canonicalize_common(norm_a, **flags),
+                                        sql_compare.canonicalize_common(norm_b, **flags)),
+        'build_difference_summary': lambda: sql_compare.build_difference_summary(
+            norm_a, norm_b, can_a, can_b, tokens_a, tokens_b, **flags),
+        'generate_report': report,
+    }
+    records = []
+    for stage in stages:
+        times = sorted(_timed(runners[stage], repeat, slow_s))
+        records.append({
+            'workload': name, 'stage': stage, 'chars': len(a) + len(b),
+            'tokens': len(tokens_a) + len(tokens_b), 'runs': len(times),
+            'best_s': round(times[0], 6), 'median_s': round(times[len(times) // 2], 6),
+        })
+    report_dir.cleanup()
+    return records
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names, *, scale: float = 1.0, repeat: int = 3, seed: int = 0, stages=STAGES, slow_s: float = 10.0) -> dict:
+    """Benchmark the named workloads with the in-process memo off; returns the results document."""
+    sql_compare.configure_memo(enabled=False)
+    try:
+        results = [rec for name in names
+                   for rec in bench_workload(name, scale=scale, repeat=repeat, seed=seed, stages=stages, slow_s=slow_s)]
+    finally:
+        sql_compare.configure_memo(enabled=True)
+    return {
+        'version': RESULTS_VERSION, 'commit': _git_commit(),
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'scale': scale, 'repeat': repeat, 'seed': seed, 'results': results,
+    }
+
+
+def compare_to_baseline(doc: dict, baseline: dict) -> list:
+    """Return (workload, stage, old_s, new_s, ratio) for every record present in both documents."""
+    old = {(r['workload'], r['stage']): r['best_s'] for r in baseline['results']}
+    rows = []
+    for r in doc['results']:
+        before = old.get((r['workload'], r['stage']))
+        if before is not None:
+            rows.append((r['workload'], r['stage'], before, r['best_s'], r['best_s'] / before if before else None))
+    return rows
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Benchmark sql_compare stages on synthetic workloads.')
+    p.add_argument('--only', help=f"Comma-separated workloads (default: all of {', '.join(WORKLOADS)})")
+    p.add_argument('--scale', type=float, default=1.0, help='Multiply every workload size (default: 1.0)')
+    p.add_argument('--stages', help=f"Comma-separated stages (default: all of {', '.join(STAGES)})")
+    p.add_argument('--repeat', type=int, default=3, help='Runs per stage; best and median are recorded (default: 3)')
+    p.add_argument('--slow', type=float, default=10.0, help='Do not repeat a stage whose run took longer than this many seconds (default: 10)')
+    p.add_argument('--seed', type=int, default=0, help='Generator seed (default: 0)')
+    p.add_argument('--output', help='Write the results as JSON to this file')
+    p.add_argument('--baseline', help='Print the change against an earlier --output file')
+    args = p.parse_args(argv)
+
+    names = args.only.split(',') if args.only else list(WORKLOADS)
+    stages = args.stages.split(',') if args.stages else list(STAGES)
+    unknown = [n for n in names if n not in WORKLOADS] + [s for s in stages if s not in STAGES]
+    if unknown:
+        p.error(f"unknown workload(s) or stage(s): {', '.join(unknown)}")
+    doc = run(names, scale=args.scale, repeat=args.repeat, seed=args.seed, stages=stages, slow_s=args.slow)
+
+    for r in doc['results']:
+        print(f"{r['workload']:<18} {r['stage']:<26} {r['best_s'] * 1000:10.2f} ms  ({r['chars']} chars)")
+    if args.output:
+        Path(args.output).write_text(json.dumps(doc, indent=2) + '\n', encoding='utf-8')
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        print('\n-- Against baseline (new / old) --')
+        for workload, stage, before, after, ratio in compare_to_baseline(doc, baseline):
+            change = f'{ratio:6.2f}x' if ratio is not None else '   n/a'
+            print(f'{workload:<18} {stage:<26} {before * 1000:10.2f} -> {after * 1000:10.2f} ms  {change}')
+
+
+if __name__ == '__main__':
+    main()
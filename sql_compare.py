@@ -19,74 +19,414 @@ CLI Examples:
   python sql_compare.py file1.sql file2.sql --mode both --report diff.html --report-format html
   python sql_compare.py --strings "select b,a from t" "SELECT a,b FROM t" --ignore-whitespace
   type queries.txt | python sql_compare.py --stdin --mode canonical --allow-full-outer-reorder --allow-left-reorder
+  python sql_compare.py --batch sql/old sql/new --jobs 4 --fail-fast
+  python sql_compare.py --fingerprint a.sql b.sql c.sql
+  python sql_compare.py --cluster sql/variants queries.jsonl --jobs 0
+  python sql_compare.py --script old_migration.sql new_migration.sql --go --jobs 4
+  python sql_compare.py --script --align old_migration.sql new_migration.sql
+  python sql_compare.py --jsonl --jobs 4 < pairs.jsonl > results.jsonl
+  python sql_compare.py --serve 127.0.0.1:8765 --cache-dir .sqlcompare-cache
+  python sql_compare.py --daemon a.sql b.sql --check
 """
 
-import argparse
-import difflib
-import html as html_mod
+# Startup cost matters for one-shot CLI calls: the GUI stack (tkinter), the
+# diff/report machinery (difflib, html), argparse, sqlite3 and process pools
+# are imported where they are first needed, and module-level patterns compile
+# on first use.
+import bisect
+import functools
+import hashlib
+import json
 import os
+import queue
 import re
 import itertools
 import sys
+import time
+from array import array
+import threading
+from collections import OrderedDict, deque, namedtuple
 from pathlib import Path
 
+
+class _LazyRegex:
+    """
+    Stand-in for a module-level compiled pattern: re.compile() runs on first
+    attribute access, which also rebinds the module global to the real
+    pattern, so later lookups go straight to it.
+    """
+    __slots__ = ('name', 'args', 'compiled')
+
+    def __init__(self, name: str, pattern: str, flags: int = 0):
+        self.name = name
+        self.args = (pattern, flags)
+        self.compiled = None
+
+    def __getattr__(self, attr):
+        if self.compiled is None:
+            self.compiled = re.compile(*self.args)
+            if globals().get(self.name) is self:
+                globals()[self.name] = self.compiled
+        return getattr(self.compiled, attr)
+
+
 SQL_CLAUSE_TERMINATORS = ['WHERE', 'GROUP BY', 'HAVING', 'ORDER BY', 'LIMIT', 'OFFSET', 'QUALIFY', 'WINDOW', 'UNION', 'INTERSECT', 'EXCEPT']
 from collections import Counter
-WHITESPACE_REGEX = re.compile(r'\s+')
+from collections.abc import Mapping
+WHITESPACE_REGEX = _LazyRegex('WHITESPACE_REGEX', r'\s+')
+
 
+# --- Optional GUI imports, loaded by _load_tk() ---
+tk = filedialog = messagebox = ttk = None
+
+
+def _load_tk() -> bool:
+    """Import the Tk GUI stack into the module globals; False when this Python has no Tk support."""
+    global tk, filedialog, messagebox, ttk
+    if tk is None:
+        try:
+            import tkinter
+            from tkinter import filedialog as fd, messagebox as mb, ttk as themed
+        except Exception:
+            return False
+        tk, filedialog, messagebox, ttk = tkinter, fd, mb, themed
+    return True
 
 
-# --- Optional GUI imports guarded ---
-try:
-    import tkinter as tk
-    from tkinter import filedialog, messagebox, ttk
-    TK_AVAILABLE = True
-except Exception:
-    TK_AVAILABLE = False
 CLAUSE_TERMINATORS = (
     'WHERE', 'GROUP BY', 'HAVING', 'ORDER BY', 'LIMIT', 'OFFSET',
     'QUALIFY', 'WINDOW', 'UNION', 'INTERSECT', 'EXCEPT'
 )
 
 
+# =============================
+# In-process memoization
+# =============================
+
+class MemoCache:
+    """
+    Thread-safe LRU of normalize_sql/tokenize/canonicalize_common results,
+    keyed by function, input text and flags. Bounded both in entries and in
+    (approximate) bytes of keys plus values; max_entries=0 turns it off.
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def _size(sql: str, value) -> int:
+        if isinstance(value, list):
+            return len(sql) + sum(len(t) for t in value) + 8 * len(value)
+        if isinstance(value, array):
+            return len(sql) + value.itemsize * len(value)
+        return len(sql) + len(value)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self._size(key[1], value)
+        with self._lock:
+            if size > self.max_bytes or key in self._data:
+                return
+            self._data[key] = (value, size)
+            self.bytes += size
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._data), 'bytes': self.bytes,
+                    'max_entries': self.max_entries, 'max_bytes': self.max_bytes}
+
+
+_MEMO = MemoCache()
+
+
+def configure_memo(*, max_entries: 'Optional[int]' = None, max_bytes: 'Optional[int]' = None,
+                   enabled: 'Optional[bool]' = None) -> MemoCache:
+    """
+    Resize or switch off the in-process memo (enabled=False drops every entry
+    and stops caching). Counters are reset; returns the new MemoCache.
+    """
+    global _MEMO
+    old = _MEMO
+    if enabled is False:
+        max_entries = 0
+    elif enabled and not old.enabled and max_entries is None:
+        max_entries = 512
+    _MEMO = MemoCache(old.max_entries if max_entries is None else max_entries,
+                      old.max_bytes if max_bytes is None else max_bytes)
+    old.clear()
+    return _MEMO
+
+
+def memo_stats() -> dict:
+    """Hit/miss/eviction counters and current size of the in-process memo."""
+    return _MEMO.stats()
+
+
+def _memoized(fn):
+    """Route fn(sql, **flags) through the in-process memo; lists and arrays come back as copies."""
+    @functools.wraps(fn)
+    def wrapper(sql, **flags):
+        memo = _MEMO
+        if not memo.enabled or type(sql) is not str:
+            return fn(sql, **flags)
+        key = (fn.__name__, sql, tuple(sorted(flags.items())))
+        value = memo.get(key)
+        if value is None:
+            value = fn(sql, **flags)
+            memo.put(key, value)
+        if isinstance(value, list):
+            return list(value)
+        return value[:] if isinstance(value, array) else value
+    return wrapper
+
+
+# =============================
+# Stage profiling
+# =============================
+
+_PROFILER = None
+
+
+class StageProfiler:
+    """
+    Per-stage wall time, call count, characters scanned (total length of the
+    text arguments), list items processed and, with memory=True, tracemalloc
+    peak memory above the stage's starting point. Stage times are inclusive:
+    a stage running inside another counts toward both. Use as a context
+    manager (or start()/stop()); while active, every @_profiled stage in any
+    thread records into it.
+    """
+
+    def __init__(self, *, memory: bool = False):
+        self.memory = memory
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._previous = None
+        self._tracemalloc = None
+        self._started_tracing = False
+
+    def start(self) -> 'StageProfiler':
+        global _PROFILER
+        if self.memory:
+            import tracemalloc
+            self._tracemalloc = tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        self._previous, _PROFILER = _PROFILER, self
+        return self
+
+    def stop(self):
+        global _PROFILER
+        _PROFILER = self._previous
+        if self._started_tracing:
+            self._tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run(self, stage: str, fn, args, kwargs):
+        frames = self._local.__dict__.setdefault('frames', [])
+        tm = self._tracemalloc if self.memory and self._tracemalloc.is_tracing() else None
+        frame = [0, 0]   # traced bytes at entry, highest peak seen by finished children
+        if tm is not None:
+            current, peak = tm.get_traced_memory()
+            if frames:
+                frames[-1][1] = max(frames[-1][1], peak)
+            tm.reset_peak()
+            frame = [current, current]
+        frames.append(frame)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            frames.pop()
+            peak_bytes = 0
+            if tm is not None:
+                top = max(tm.get_traced_memory()[1], frame[1])
+                peak_bytes = top - frame[0]
+                if frames:
+                    frames[-1][1] = max(frames[-1][1], top)
+            chars = sum(len(a) for a in args if isinstance(a, str))
+            items = sum(len(a) for a in args if isinstance(a, list))
+            with self._lock:
+                st = self._stats.setdefault(stage, {'calls': 0, 'wall_s': 0.0, 'chars': 0, 'items': 0, 'peak_bytes': 0})
+                st['calls'] += 1
+                st['wall_s'] += elapsed
+                st['chars'] += chars
+                st['items'] += items
+                st['peak_bytes'] = max(st['peak_bytes'], peak_bytes)
+
+    def stats(self) -> dict:
+        """{stage: {calls, wall_s, chars, items, peak_bytes}}, slowest stage first."""
+        with self._lock:
+            return {k: dict(v) for k, v in sorted(self._stats.items(), key=lambda kv: -kv[1]['wall_s'])}
+
+    def format_table(self) -> str:
+        return format_profile_table(self.stats())
+
+
+def format_profile_table(stats: dict) -> str:
+    """Human-readable table of StageProfiler.stats()."""
+    rows = [f"{'Stage':<26} {'Calls':>7} {'Wall ms':>10} {'Chars':>12} {'Items':>10} {'Peak KiB':>10}"]
+    for stage, st in stats.items():
+        rows.append(f"{stage:<26} {st['calls']:>7} {st['wall_s'] * 1000:>10.2f} {st['chars']:>12} "
+                    f"{st['items']:>10} {st['peak_bytes'] / 1024:>10.1f}")
+    return '\n'.join(rows)
+
+
+def _profiled(stage: str):
+    """Record calls of the decorated function as *stage* while a StageProfiler is active."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = _PROFILER
+            if profiler is None:
+                return fn(*args, **kwargs)
+            return profiler.run(stage, fn, args, kwargs)
+        return wrapper
+    return decorate
+
+
 # =============================
 # Normalization & Utilities
 # =============================
 
 
+# In-memory budget per input. SQL files above it are streamed (see
+# read_sql_file); other inputs (stdin, manifests, .jsonl lists) are refused.
 MAX_FILE_SIZE_MB = 20
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 
-def safe_read_file(path_str: str) -> str:
-    """Read a file safely, enforcing a size limit to prevent DoS."""
+def safe_read_file(path_str: str, max_bytes: 'Optional[int]' = None) -> str:
+    """Read a whole file safely, refusing files above max_bytes (default MAX_FILE_SIZE_BYTES)."""
     p = Path(path_str)
     if not p.exists():
         raise FileNotFoundError(f'File not found: {path_str}')
 
+    limit = MAX_FILE_SIZE_BYTES if max_bytes is None else max_bytes
     size = p.stat().st_size
-    if size > MAX_FILE_SIZE_BYTES:
-        raise ValueError(f'File too large: {path_str} ({size / (1024*1024):.2f} MB). Limit is {MAX_FILE_SIZE_MB} MB.')
+    if size > limit:
+        raise ValueError(f'File too large: {path_str} ({size / (1024*1024):.2f} MB). '
+                         f'Limit is {limit / (1024*1024):g} MB.')
 
     return p.read_text(encoding='utf-8', errors='ignore')
 
-SQL_COMMENT_OR_STRING_REGEX = re.compile(
-    r"""
-    '(?:''|[^'])*(?:'|$)        # Single-quoted strings
-    | "(?:""|[^"])*(?:"|$)      # Double-quoted strings
-    | \[[^\]]*(?:\]|$)          # MS SQL-style [bracketed] identifiers
-    | `[^`]*(?:`|$)             # MySQL-style `backticked` identifiers
-    | /\*.*?(?:\*/|$)           # Block comments (non-nested)
-    | --[^\n\r]*                # Single-line comments
-    """,
-    re.VERBOSE | re.DOTALL
+
+def read_sql_file(path_str: str, budget: 'Optional[int]' = None) -> str:
+    """
+    Read a SQL file for comparison. Files within the memory budget (default
+    MAX_FILE_SIZE_BYTES) are read whole; larger ones are streamed through
+    normalize_sql_file() and come back as PrenormalizedSQL, so neither the raw
+    text nor intermediate copies of it are held in memory.
+    """
+    limit = MAX_FILE_SIZE_BYTES if budget is None else budget
+    p = Path(path_str)
+    if p.exists() and p.stat().st_size > limit:
+        return normalize_sql_file(path_str)
+    return safe_read_file(path_str, max_bytes=limit)
+
+# Shared sub-patterns of the SQL lexer. Quoted regions may be unclosed and then
+# run to the end of the text.
+_SQ_PATTERN = r"'[^']*(?:''[^']*)*(?:'|$)"      # single-quoted string ('' escape)
+_DQ_PATTERN = r'"[^"]*(?:""[^"]*)*(?:"|$)'      # "double-quoted" identifier ("" escape)
+_BRACKET_PATTERN = r'\[[^\]]*(?:\]|$)'          # MS SQL-style [bracketed] identifier
+_BACKTICK_PATTERN = r'`[^`]*(?:`|$)'            # MySQL-style `backticked` identifier
+_NUMBER_PATTERN = r'[0-9]+\.[0-9]+|[0-9]+'
+_WORD_PATTERN = r'[^\W\d][\w$]*'                # identifiers/keywords
+_MULTI_OP_PATTERN = r'<=|>=|<>|!=|:=|->|::'
+
+_QUOTED_SEGMENTS = (
+    rf"(?P<STRING>{_SQ_PATTERN})"
+    rf"|(?P<QIDENT>{_DQ_PATTERN}|{_BRACKET_PATTERN}|{_BACKTICK_PATTERN})"
 )
 
+# Segment level: comments, quoted regions and the plain text between them.
+SQL_SEGMENT_REGEX = _LazyRegex('SQL_SEGMENT_REGEX',
+    r"(?P<COMMENT>--[^\n\r]*|/\*.*?(?:\*/|$))|" + _QUOTED_SEGMENTS + r"|(?P<TEXT>[^'\"\[`\-/]+|[-/])",
+    re.DOTALL,
+)
+SQL_SEGMENT_NO_COMMENTS_REGEX = _LazyRegex('SQL_SEGMENT_NO_COMMENTS_REGEX', _QUOTED_SEGMENTS + r"|(?P<TEXT>[^'\"\[`]+)", re.DOTALL)
+
+# Token level, inside plain text.
+SQL_TEXT_TOKEN_REGEX = _LazyRegex('SQL_TEXT_TOKEN_REGEX',
+    rf"(?P<WS>\s+)|(?P<NUMBER>{_NUMBER_PATTERN})|(?P<WORD>{_WORD_PATTERN})"
+    rf"|(?P<OP>{_MULTI_OP_PATTERN}|[(),;=*/+\-<>.%])|(?P<OTHER>.)",
+    re.DOTALL,
+)
+
+# Both levels folded into one findall() pattern for tokenize(). The \S
+# fallback guarantees a match after any whitespace, so callers rstrip() the
+# text and every match is one token. E"..." stays a single token.
+TOKEN_REGEX = _LazyRegex('TOKEN_REGEX',
+    rf"\s*({_SQ_PATTERN}|(?:\b[Ee])?{_DQ_PATTERN}|{_BRACKET_PATTERN}|{_BACKTICK_PATTERN}"
+    rf"|{_NUMBER_PATTERN}|{_WORD_PATTERN}|{_MULTI_OP_PATTERN}|\S)"
+)
+
+QUOTED_KINDS = frozenset(('STRING', 'QIDENT'))
+
+Token = namedtuple('Token', 'kind text start end')
+
+
+def lex_sql(sql: str, *, comments: bool = True):
+    """
+    Classify *sql* in a single pass and yield Token(kind, text, start, end).
+    Kinds: COMMENT, STRING, QIDENT, WS, NUMBER, WORD, OP, OTHER. The tokens
+    cover the input exactly. With comments=False, comment markers lex as
+    operators.
+    """
+    seg_regex = SQL_SEGMENT_REGEX if comments else SQL_SEGMENT_NO_COMMENTS_REGEX
+    run_start = run_end = 0
+    for m in seg_regex.finditer(sql):
+        if m.lastgroup == 'TEXT':
+            run_end = m.end()
+            continue
+        for t in SQL_TEXT_TOKEN_REGEX.finditer(sql, run_start, run_end):
+            yield Token(t.lastgroup, t.group(), t.start(), t.end())
+        run_start = run_end = m.end()
+        yield Token(m.lastgroup, m.group(), m.start(), m.end())
+    for t in SQL_TEXT_TOKEN_REGEX.finditer(sql, run_start, run_end):
+        yield Token(t.lastgroup, t.group(), t.start(), t.end())
+
+
+@_profiled('strip_sql_comments')
 def strip_sql_comments(s: str) -> str:
     """Remove -- line comments and /* ... */ block comments (non-nested)."""
-    return SQL_COMMENT_OR_STRING_REGEX.sub(
-        lambda m: '' if m.group(0).startswith(('--', '/*')) else m.group(0),
-        s
-    )
+    return ''.join(m.group() for m in SQL_SEGMENT_REGEX.finditer(s) if m.lastgroup != 'COMMENT')
 
 
 def collapse_whitespace(s: str) -> str:
@@ -94,32 +434,13 @@ def collapse_whitespace(s: str) -> str:
     return WHITESPACE_REGEX.sub(' ', s).strip()
 
 
-QUOTED_STRING_REGEX = re.compile(
-    r"""
-    '(?:''|[^'])*(?:'|$)      # Single-quoted strings, handles '' escape and unclosed
-    | "(?:""|[^"])*(?:"|$)      # Double-quoted strings, handles "" escape and unclosed
-    | \[[^\]]*(?:\]|$)          # MS SQL-style [bracketed] identifiers, handles unclosed
-    | `[^`]*(?:`|$)            # MySQL-style `backticked` identifiers, handles unclosed
-    """,
-    re.VERBOSE
-)
-
 def uppercase_outside_quotes(s: str) -> str:
     """
     Uppercase characters outside of quoted regions:
       single quotes '...'; double quotes "..."; [brackets]; `backticks`
     """
-    out = []
-    prev = 0
-    for m in QUOTED_STRING_REGEX.finditer(s):
-        start, end = m.span()
-        if start > prev:
-            out.append(s[prev:start].upper())
-        out.append(m.group(0))
-        prev = end
-    if prev < len(s):
-        out.append(s[prev:].upper())
-    return ''.join(out)
+    return ''.join(m.group() if m.lastgroup in QUOTED_KINDS else m.group().upper()
+                   for m in SQL_SEGMENT_NO_COMMENTS_REGEX.finditer(s))
 
 
 def remove_trailing_semicolon(s: 'Optional[str]') -> 'Optional[str]':
@@ -131,115 +452,176 @@ def remove_trailing_semicolon(s: 'Optional[str]') -> 'Optional[str]':
 
 def remove_outer_parentheses(s: str) -> str:
     """Remove one or more layers of outer wrapping parentheses if they enclose the full statement."""
-    def is_wrapped(text: str) -> bool:
-        if not (text.startswith('(') and text.endswith(')')):
-            return False
-        level = 0; mode = None; i = 0
-        while i < len(text):
-            ch = text[i]
-            if mode is None:
-                if ch == "'": mode = 'single'
-                elif ch == '"': mode = 'double'
-                elif ch == '[': mode = 'bracket'
-                elif ch == '`': mode = 'backtick'
-                elif ch == '(':
-                    level += 1
-                elif ch == ')':
-                    level -= 1
-                    if level == 0 and i != len(text) - 1:
-                        return False
-            elif mode == 'single':
-                if ch == "'":
-                    if i + 1 < len(text) and text[i + 1] == "'":
-                        i += 1
-                    else:
-                        mode = None
-            elif mode == 'double':
-                if ch == '"':
-                    if i + 1 < len(text) and text[i + 1] == '"':
-                        i += 1
-                    else:
-                        mode = None
-            elif mode == 'bracket':
-                if ch == ']': mode = None
-            elif mode == 'backtick':
-                if ch == '`': mode = None
-            i += 1
-        return level == 0
-    changed = True
-    while changed:
-        changed = False
-        s_stripped = s.strip()
-        if s_stripped.startswith('(') and s_stripped.endswith(')') and is_wrapped(s_stripped):
-            s = s_stripped[1:-1].strip()
-            changed = True
-    return s
+    text = s.strip()
+    if not (text.startswith('(') and text.endswith(')')):
+        return s
+    closing = structural_index(text).closing
+    lo, hi = 0, len(text) - 1
+    while lo < hi and text[lo] == '(' and text[hi] == ')' and closing(lo) == hi:
+        lo += 1; hi -= 1
+        while lo <= hi and text[lo].isspace(): lo += 1
+        while hi >= lo and text[hi].isspace(): hi -= 1
+    return s if lo == 0 else text[lo:hi + 1]
 
 
-TOKEN_REGEX = re.compile(
-    r"""
-    (?:'(?:(?:''|[^'])*?)')            # single-quoted string
-  | (?:(?:(?:\bE)?")(?:(?:""|[^"])*?)")  # double-quoted string (allow E"..." too)
-  | (?:\[(?:[^\]]*?)\])                # [bracketed] identifier
-  | (?:`(?:[^`]*?)`)                   # `backticked` identifier
-  | (?:[A-Z_][A-Z0-9_\$]*\b)           # identifiers/keywords (after uppercasing)
-  | (?:[0-9]+\.[0-9]+|[0-9]+)          # numbers
-  | (?:<=|>=|<>|!=|:=|->|::)           # multi-char operators
-  | (?:[(),=*\/\+\-<>\.%])             # single-char tokens
-  | (?:\.)                             # dot
-  | (?:\s+)                            # whitespace (filtered out)
-    """,
-    re.VERBOSE | re.IGNORECASE,
+@_memoized
+@_profiled('tokenize')
+def tokenize(sql: str):
+    """Split *sql* into tokens; whitespace is dropped and quoted regions stay whole."""
+    return TOKEN_REGEX.findall(sql.rstrip())
+
+
+# Keywords and operators get fixed interning ids (their index here), equal in every process.
+_FIXED_TOKENS = (
+    ',', '(', ')', '.', ';', '=', '*', '+', '-', '/', '%', '<', '>',
+    '<=', '>=', '<>', '!=', ':=', '->', '::',
+    'SELECT', 'DISTINCT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'IN', 'IS', 'NULL', 'AS',
+    'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS', 'NATURAL', 'ON', 'USING',
+    'GROUP', 'BY', 'HAVING', 'ORDER', 'ASC', 'DESC', 'LIMIT', 'OFFSET', 'QUALIFY', 'WINDOW',
+    'UNION', 'ALL', 'INTERSECT', 'EXCEPT', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END',
+    'LIKE', 'BETWEEN', 'EXISTS', 'ANY', 'WITH', 'OVER', 'PARTITION', 'CAST',
+    'INSERT', 'INTO', 'VALUES', 'UPDATE', 'SET', 'DELETE', 'MERGE', 'CREATE', 'ALTER', 'DROP',
+    'TABLE', 'VIEW', 'INDEX', 'TRUE', 'FALSE', 'COUNT', 'SUM', 'MIN', 'MAX', 'AVG', 'COALESCE',
 )
 
-def tokenize(sql: str):
-    return [m.group(0) for m in TOKEN_REGEX.finditer(sql) if not m.group(0).isspace()]
-
-
-def _advance_state(text: str, frm: int, to: int, mode: str, level: int):
-    """Advance the quote/paren state machine from index *frm* up to (not including) *to*."""
-    i = frm
-    while i < to:
-        ch = text[i]
-        if mode is None:
-            if ch == "'": mode = 'single'
-            elif ch == '"': mode = 'double'
-            elif ch == '[': mode = 'bracket'
-            elif ch == '`': mode = 'backtick'
-            elif ch == '(': level += 1
-            elif ch == ')': level = max(0, level - 1)
-        else:
-            if mode == 'single' and ch == "'":
-                if i + 1 < len(text) and text[i + 1] == "'": i += 1
-                else: mode = None
-            elif mode == 'double' and ch == '"':
-                if i + 1 < len(text) and text[i + 1] == '"': i += 1
-                else: mode = None
-            elif mode == 'bracket' and ch == ']': mode = None
-            elif mode == 'backtick' and ch == '`': mode = None
-        i += 1
-    return mode, level
+
+class TokenTable:
+    """
+    Interning table mapping token text to compact integer ids, so token lists
+    become array('I') (4 bytes per token) compared and diffed as integers.
+    _FIXED_TOKENS hold fixed ids; other tokens take the next id on first
+    sight. Ids are never reused, so arrays stay valid while the table lives;
+    ids of non-fixed tokens differ between tables and are not persisted. Each
+    ComparisonResult owns a table, so nothing grows with the number of
+    comparisons a process runs.
+    """
+
+    def __init__(self, fixed=_FIXED_TOKENS):
+        self._ids = {t: i for i, t in enumerate(fixed)}
+        self._texts = list(fixed)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._texts)
+
+    def intern(self, tokens) -> array:
+        """Ids of tokens (any iterable of str) as an array('I')."""
+        if not isinstance(tokens, (list, tuple)):
+            tokens = list(tokens)
+        try:
+            return array('I', map(self._ids.__getitem__, tokens))
+        except KeyError:
+            pass
+        out = array('I')
+        with self._lock:
+            ids, texts = self._ids, self._texts
+            for t in tokens:
+                i = ids.get(t)
+                if i is None:
+                    i = ids[t] = len(texts)
+                    texts.append(t)
+                out.append(i)
+        return out
+
+    def texts(self, ids) -> list:
+        """Token text of each id."""
+        texts = self._texts
+        return [texts[i] for i in ids]
+
+
+@_profiled('token_ids')
+def token_ids(sql: str, table: TokenTable) -> array:
+    """tokenize(sql) as ids of table."""
+    return table.intern(TOKEN_REGEX.findall(sql.rstrip()))
+
+
+_STRUCTURE_REGEX = _LazyRegex('_STRUCTURE_REGEX',
+    rf"{_SQ_PATTERN}|{_DQ_PATTERN}|{_BRACKET_PATTERN}|{_BACKTICK_PATTERN}|[()]"
+)
+
+
+class StructuralIndex:
+    """
+    Quote/paren structure of one string, built in a single scan:
+      - depth[i]: parenthesis depth in effect at offset i (never below zero)
+      - quoted[i]: 1 when offset i lies inside a quoted region, after its opening quote
+      - match: offset of each '(' -> offset of its closing ')'
+    Quotes follow the lexer rules ('' and "" escapes; unclosed quotes run to the end).
+    """
+    __slots__ = ('depth', 'quoted', 'match')
+
+    def __init__(self, text: str):
+        n = len(text)
+        depth = array('i', [0]) * n
+        quoted = bytearray(n)
+        match = {}
+        stack = []
+        level = 0; prev = 0
+        for m in _STRUCTURE_REGEX.finditer(text):
+            pos, end = m.span()
+            if end - pos > 1 or text[pos] not in '()':
+                quoted[pos + 1:end] = b'\x01' * (end - pos - 1)
+                continue
+            if level:
+                depth[prev:pos + 1] = array('i', [level]) * (pos + 1 - prev)
+            prev = pos + 1
+            if text[pos] == '(':
+                stack.append(pos); level += 1
+            elif stack:
+                match[stack.pop()] = pos; level -= 1
+        if level:
+            depth[prev:n] = array('i', [level]) * (n - prev)
+        self.depth = depth
+        self.quoted = quoted
+        self.match = match
+
+    def is_top_level(self, i: int) -> bool:
+        """True when offset i is outside quotes and parentheses."""
+        return self.depth[i] == 0 and not self.quoted[i]
+
+    def closing(self, i: int) -> int:
+        """Offset of the ')' matching the '(' at offset i, or -1."""
+        return self.match.get(i, -1)
+
+
+@functools.lru_cache(maxsize=32)
+@_profiled('structural_index')
+def structural_index(text: str) -> StructuralIndex:
+    """Cached StructuralIndex for *text*; the canonicalizers query the same string repeatedly."""
+    return StructuralIndex(text)
+
+
+def _index_from(text: str, start: int) -> tuple:
+    """
+    Return (index, offset) so that index.is_top_level(i - offset) answers
+    "is i top-level when scanning from *start*"; a start inside quotes or
+    parentheses gets its own index of text[start:].
+    """
+    idx = structural_index(text)
+    if start <= 0 or start >= len(text) or idx.is_top_level(start):
+        return idx, 0
+    return structural_index(text[start:]), start
+
+
+@functools.lru_cache(maxsize=64)
+def _literal_regex(sep: str):
+    return re.compile(re.escape(sep))
+
+
+@functools.lru_cache(maxsize=64)
+def _keyword_regex(kw: str):
+    return re.compile(rf"\b{re.escape(kw.upper())}\b", re.IGNORECASE)
 
 
 def split_top_level(s: str, sep: str) -> list:
     """Split by sep at top-level (not inside quotes/parentheses/brackets/backticks)."""
-    pattern = re.compile(re.escape(sep))
+    is_top_level = structural_index(s).is_top_level
     parts = []
-    mode = None
-    level = 0
-    prev_idx = 0
     last_split = 0
-
-    for m in pattern.finditer(s):
-        candidate = m.start()
-        mode, level = _advance_state(s, prev_idx, candidate, mode, level)
-        prev_idx = candidate
-
-        if mode is None and level == 0:
-            parts.append(s[last_split:candidate].strip())
+    for m in _literal_regex(sep).finditer(s):
+        if is_top_level(m.start()):
+            parts.append(s[last_split:m.start()].strip())
             last_split = m.end()
-            prev_idx = m.end()
-
     parts.append(s[last_split:].strip())
     return [p for p in parts if p != '']
 
@@ -247,51 +629,29 @@ def split_top_level(s: str, sep: str) -> list:
 def top_level_find_kw(sql: str, kw: str, start: int = 0):
     """Find top-level occurrence of keyword kw (word boundary) starting at start.
 
-    Uses re.finditer to jump to candidate positions in O(N) instead of
-    evaluating a regex on sql[i:] at every character (O(N^2)).
+    Keyword candidates come from one regex scan; each is checked against the
+    cached structural index in O(1).
     """
-    kw = kw.upper()
-    pattern = re.compile(rf"\b{re.escape(kw)}\b", re.IGNORECASE)
-
-    mode = None; level = 0; prev = start
-    for m in pattern.finditer(sql, pos=start):
-        candidate = m.start()
-        mode, level = _advance_state(sql, prev, candidate, mode, level)
-        prev = m.end()
-        if mode is None and level == 0:
-            return candidate
+    idx, offset = _index_from(sql, start)
+    for m in _keyword_regex(kw).finditer(sql, start):
+        if idx.is_top_level(m.start() - offset):
+            return m.start()
     return -1
 
 
-CLAUSE_SCANNER_RE = re.compile(
-    r"""
-    (
-        '(?:''|[^'])*'            # Single quote (group 1)
-      | "(?:""|[^"])*"            # Double quote (group 1)
-      | \[(?:[^\]]*)\]            # Bracket (group 1)
-      | `(?:[^`]*)`               # Backtick (group 1)
-    )
-    | (\()                        # Open paren (group 2)
-    | (\))                        # Close paren (group 3)
-    | \b(WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|OFFSET|QUALIFY|WINDOW|UNION|INTERSECT|EXCEPT)\b # Keywords (group 4)
-    """,
-    re.VERBOSE | re.IGNORECASE
+CLAUSE_KEYWORD_REGEX = _LazyRegex('CLAUSE_KEYWORD_REGEX',
+    r"\b(?:WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|OFFSET|QUALIFY|WINDOW|UNION|INTERSECT|EXCEPT)\b",
+    re.IGNORECASE,
 )
 
 def clause_end_index(sql: str, start: int) -> int:
     """
     Find end index for a clause (FROM or WHERE) to the next top-level major keyword.
-    Uses regex scanning for performance instead of multiple linear searches.
     """
-    level = 0
-    for match in CLAUSE_SCANNER_RE.finditer(sql, pos=start):
-        if match.group(2): # (
-            level += 1
-        elif match.group(3): # )
-            level = max(0, level - 1)
-        elif match.group(4): # Keyword
-            if level == 0:
-                return match.start()
+    idx, offset = _index_from(sql, start)
+    for m in CLAUSE_KEYWORD_REGEX.finditer(sql, start):
+        if idx.is_top_level(m.start() - offset):
+            return m.start()
     return len(sql)
 
 
@@ -299,18 +659,201 @@ def clause_end_index(sql: str, start: int) -> int:
 # Canonicalization helpers
 # =============================
 
+def _normalized_pieces(sql: str, seg_regex) -> tuple:
+    return _fold_segments(seg_regex.finditer(sql))
+
+
+def _fold_segments(segments) -> tuple:
+    """
+    Fold a stream of segment matches into normalized pieces: comments dropped,
+    whitespace collapsed (inside quotes too) and text outside quotes uppercased.
+    Returns (pieces, glued); glued is True when a dropped comment left a quoted
+    region touching other text, where the joined text may lex differently.
+    """
+    pieces = []; run = []; blocks = []
+    glued = cut = False
+    prev_quoted = None  # None before the first piece, else whether it was quoted
+    for m in segments:
+        kind = m.lastgroup
+        if kind == 'COMMENT':
+            cut = True
+            continue
+        text = m.group()
+        quoted = kind != 'TEXT'
+        if cut and (prev_quoted or quoted) and prev_quoted is not None:
+            prev_text = run[-1] if run else pieces[-1]
+            if not prev_text[-1].isspace() and not text[0].isspace():
+                glued = True
+        cut = False
+        prev_quoted = quoted
+        if not quoted:
+            run.append(text)
+            continue
+        if run:
+            pieces.append(WHITESPACE_REGEX.sub(' ', ''.join(run)).upper()); run = []
+        pieces.append(WHITESPACE_REGEX.sub(' ', text) if WHITESPACE_REGEX.search(text) else text)
+        if len(pieces) > 4096:  # long streams: keep a few big strings, not millions of small ones
+            blocks.append(''.join(pieces[:-1])); del pieces[:-1]
+    if run:
+        pieces.append(WHITESPACE_REGEX.sub(' ', ''.join(run)).upper())
+    return blocks + pieces, glued
+
+
+def _finish_normalized(pieces: list, glued: bool) -> str:
+    if glued:
+        pieces, _ = _normalized_pieces(''.join(pieces), SQL_SEGMENT_NO_COMMENTS_REGEX)
+    sql = ''.join(pieces).strip()
+    if sql.endswith(';'):
+        sql = sql[:-1].strip()
+    if sql.startswith('(') and sql.endswith(')'):
+        sql = remove_outer_parentheses(sql)
+    return sql
+
+
+class PrenormalizedSQL(str):
+    """
+    Text that already went through normalize_sql(), which returns it unchanged.
+    A streamed file also carries what the whitespace tier needs from the raw
+    text: its path, ws_digest (ws_digest() of ws_only_normalize(raw)) and
+    ws_sensitive (the raw text has quotes or comments).
+    """
+    path = None
+    ws_digest = None
+    ws_sensitive = True
+
+
+@_memoized
+@_profiled('normalize_sql')
 def normalize_sql(sql: str) -> str:
-    """Full normalization pipeline."""
-    sql = sql.strip()
-    sql = strip_sql_comments(sql)
-    sql = collapse_whitespace(sql)
-    sql = remove_trailing_semicolon(sql)
-    sql = remove_outer_parentheses(sql)
-    sql = uppercase_outside_quotes(sql)
-    sql = collapse_whitespace(sql)
+    """
+    Full normalization pipeline over one lexer pass: strip comments, collapse
+    whitespace, uppercase outside quotes, then drop a trailing semicolon and
+    wrapping parentheses.
+    """
+    if isinstance(sql, PrenormalizedSQL):
+        return sql
+    return _finish_normalized(*_normalized_pieces(sql.strip(), SQL_SEGMENT_REGEX))
+
+
+def _iter_stream_segments(fileobj, chunk_size: int):
+    """
+    Yield SQL_SEGMENT_REGEX matches over a text stream read in chunks, exactly
+    as over the whole (stripped) text. Segments touching the end of the buffer
+    wait for the next chunk; while one stays unfinished the reads grow
+    geometrically, so long literals are not rescanned quadratically.
+    """
+    buf = ''
+    scan = 0
+    want = chunk_size
+    leading = True
+    eof = False
+    while not eof:
+        chunk = fileobj.read(want)
+        if leading and chunk:
+            chunk = chunk.lstrip()
+            leading = not chunk
+            if leading:
+                continue
+        if chunk:
+            buf = buf[scan:] + chunk
+        else:
+            eof = True
+            buf = buf[scan:].rstrip()
+        scan = 0
+        for m in SQL_SEGMENT_REGEX.finditer(buf):
+            # $ also matches before a final newline, hence the - 1.
+            if not eof and m.end() >= len(buf) - 1:
+                break
+            scan = m.end()
+            yield m
+        want = want * 2 if scan == 0 and not eof else chunk_size
+
+
+class _WsOnlyStream:
+    """
+    ws_only_normalize() over text fed in chunks: feed() returns the output
+    pieces that are final. A trailing ';' (with its space) is held back until
+    more text follows, so whatever is held at the end is the dropped semicolon.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.space = False      # whitespace seen since the last output
+        self.held = ''
+
+    def feed(self, chunk: str) -> str:
+        text = WHITESPACE_REGEX.sub(' ', chunk)
+        if text.startswith(' '):
+            self.space, text = True, text[1:]
+        if not text:
+            return ''
+        out = self.held + (' ' if self.space and self.started else '') + text.rstrip(' ')
+        self.started, self.space = True, text.endswith(' ')
+        keep = 2 if out.endswith(' ;') else 1 if out.endswith(';') else 0
+        self.held = out[len(out) - keep:] if keep else ''
+        return out[:len(out) - keep]
+
+
+class _StreamTee:
+    """File wrapper that also feeds every chunk read to the whitespace-tier digests."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.ws = _WsOnlyStream()
+        self.hasher = hashlib.blake2b(digest_size=16)
+        self.sensitive = False
+        self.last = ''
+
+    def read(self, size: int) -> str:
+        chunk = self.fileobj.read(size)
+        self.hasher.update(self.ws.feed(chunk).encode('utf-8'))
+        # One character of overlap catches -- and /* split across reads.
+        self.sensitive = self.sensitive or bool(_WS_SENSITIVE_REGEX.search(self.last + chunk))
+        self.last = chunk[-1:]
+        return chunk
+
+
+def ws_digest(ws_text: str) -> str:
+    """Digest of a ws_only_normalize() form, as carried by streamed PrenormalizedSQL."""
+    return hashlib.blake2b(ws_text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def normalize_sql_file(path_str: str, *, chunk_size: int = 1 << 20) -> PrenormalizedSQL:
+    """
+    normalize_sql() of a file without loading it: the file is decoded and
+    lexed chunk by chunk and only the normalized pieces are kept. The same
+    pass records the digest of the whitespace-only form (see PrenormalizedSQL).
+    """
+    with open(path_str, encoding='utf-8', errors='ignore') as f:
+        tee = _StreamTee(f)
+        sql = PrenormalizedSQL(_finish_normalized(*_fold_segments(_iter_stream_segments(tee, chunk_size))))
+    sql.path, sql.ws_digest, sql.ws_sensitive = path_str, tee.hasher.hexdigest(), tee.sensitive
     return sql
 
 
+def ws_only_normalize_file(path_str: str, *, chunk_size: int = 1 << 20) -> str:
+    """ws_only_normalize() of a file, read chunk by chunk so the raw text is never held whole."""
+    ws = _WsOnlyStream()
+    pieces = []
+    with open(path_str, encoding='utf-8', errors='ignore') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            pieces.append(ws.feed(chunk))
+    return ''.join(pieces)
+
+
+def normalize_and_tokenize(sql: str) -> tuple:
+    """Return (normalize_sql(sql), tokens of the normalized text)."""
+    norm = normalize_sql(sql)
+    return norm, tokenize(norm)
+
+
+def normalize_and_intern(sql: str, table: TokenTable) -> tuple:
+    """Return (normalize_sql(sql), token_ids of the normalized text in table)."""
+    norm = normalize_sql(sql)
+    return norm, token_ids(norm, table)
+
+
+@_profiled('ws_only_normalize')
 def ws_only_normalize(sql: str) -> str:
     """
     Whitespace-only normalization:
@@ -322,6 +865,7 @@ def ws_only_normalize(sql: str) -> str:
     return remove_trailing_semicolon(collapse_whitespace(sql))
 
 
+@_profiled('canonicalize_select_list')
 def _canonicalize_select_list(s: str) -> str:
     sel_i = top_level_find_kw(s, 'SELECT', 0)
     if sel_i == -1: return s
@@ -338,6 +882,7 @@ def canonicalize_select_list(sql: str) -> str:
     return collapse_whitespace(_canonicalize_select_list(collapse_whitespace(sql)))
 
 
+@_profiled('canonicalize_where_and')
 def _canonicalize_where_and(s: str) -> str:
     where_i = top_level_find_kw(s, 'WHERE', 0)
     if where_i == -1: return s
@@ -354,7 +899,7 @@ def canonicalize_where_and(sql: str) -> str:
     return collapse_whitespace(_canonicalize_where_and(collapse_whitespace(sql)))
 
 
-FROM_BODY_TOKENIZER_RE = re.compile(
+FROM_BODY_TOKENIZER_RE = _LazyRegex('FROM_BODY_TOKENIZER_RE',
     r"""
     (
         '(?:''|[^'])*'?            # single quotes (closed or unclosed)
@@ -444,14 +989,14 @@ def _extract_join_segments(tokens: list, start_idx: int) -> list:
         join_kw = tokens[idx][1]
         idx += 1
 
-        table_text = ''
+        table_parts = []
         cond_kw = None
-        cond_text = ''
+        cond_parts = []
 
         while idx < len(tokens) and tokens[idx][0] not in ('CONDKW', 'JOINKW'):
             k, t = tokens[idx]
             if k == 'TEXT':
-                table_text = (table_text + ' ' + t).strip()
+                table_parts.append(t)
             idx += 1
 
         if idx < len(tokens) and tokens[idx][0] == 'CONDKW':
@@ -460,14 +1005,14 @@ def _extract_join_segments(tokens: list, start_idx: int) -> list:
             while idx < len(tokens) and tokens[idx][0] != 'JOINKW':
                 k, t = tokens[idx]
                 if k == 'TEXT':
-                    cond_text = (cond_text + ' ' + t).strip()
+                    cond_parts.append(t)
                 idx += 1
 
         segments.append({
             'type': _clean_join_type(join_kw),
-            'table': collapse_whitespace(table_text),
+            'table': collapse_whitespace(' '.join(table_parts)),
             'cond_kw': cond_kw,
-            'cond': collapse_whitespace(cond_text),
+            'cond': collapse_whitespace(' '.join(cond_parts)),
         })
     return segments
 
@@ -500,6 +1045,7 @@ def _rebuild_from_body(base: str, segments: list) -> str:
     return ' '.join(parts)
 
 
+@_profiled('canonicalize_joins')
 def _canonicalize_joins(s: str, allow_full_outer: bool = False, allow_left: bool = False) -> str:
     """
     Canonicalize top-level FROM JOIN chains by sorting contiguous runs of:
@@ -551,6 +1097,8 @@ def canonicalize_joins(sql: str, allow_full_outer: bool = False, allow_left: boo
     )
 
 
+@_memoized
+@_profiled('canonicalize_common')
 def canonicalize_common(sql: str, *, enable_join_reorder: bool = True, allow_full_outer: bool = False, allow_left: bool = False) -> str:
     """Apply canonicalizations: SELECT list, WHERE AND-terms, and (optionally) JOIN reordering."""
     s = collapse_whitespace(sql)
@@ -561,6 +1109,178 @@ def canonicalize_common(sql: str, *, enable_join_reorder: bool = True, allow_ful
     return collapse_whitespace(s)
 
 
+# =============================
+# Canonical fingerprints
+# =============================
+
+# Bump whenever a change to normalization or canonicalization can alter the
+# canonical text, so stored fingerprints and cache entries are not reused.
+CANONICAL_VERSION = 1
+
+
+def canonical_flags_key(enable_join_reorder: bool = True, allow_full_outer: bool = False,
+                        allow_left: bool = False) -> str:
+    """Compact key of the canonicalization flags; the LEFT/FULL flags only count when join reordering is on."""
+    if not enable_join_reorder:
+        return 'j0'
+    return f'j1f{int(allow_full_outer)}l{int(allow_left)}'
+
+
+def canonical_fingerprint(sql: str, *, enable_join_reorder: bool = True, allow_full_outer: bool = False,
+                          allow_left: bool = False, digest_size: int = 16) -> str:
+    """
+    Return a hex BLAKE2b digest of canonicalize_common(normalize_sql(sql)).
+    The canonical version and the flag set are hashed in, so digests made under
+    other settings never collide; unlike hash() the value does not depend on
+    PYTHONHASHSEED and is stable across runs and machines.
+    """
+    canonical = canonicalize_common(normalize_sql(sql), enable_join_reorder=enable_join_reorder,
+                                    allow_full_outer=allow_full_outer, allow_left=allow_left)
+    return _fingerprint_of_canonical(canonical, canonical_flags_key(enable_join_reorder, allow_full_outer, allow_left),
+                                     digest_size)
+
+
+def _fingerprint_of_canonical(canonical: str, flags_key: str, digest_size: int = 16) -> str:
+    h = hashlib.blake2b(digest_size=digest_size)
+    h.update(f'sql-compare/v{CANONICAL_VERSION}/{flags_key}\n'.encode('ascii'))
+    h.update(canonical.encode('utf-8', errors='surrogatepass'))
+    return h.hexdigest()
+
+
+# =============================
+# Persistent canonicalization cache
+# =============================
+
+def _sqlite3():
+    """The sqlite3 module, imported on first use."""
+    try:
+        import sqlite3
+    except ImportError:
+        raise RuntimeError('The persistent cache needs the sqlite3 module.') from None
+    return sqlite3
+
+
+class CanonicalCache:
+    """
+    On-disk cache of normalized text, tokens and canonical form per input,
+    stored in SQLite under cache_dir.
+    Entries are keyed by a BLAKE2b digest of the raw SQL, the canonical flags
+    key and CANONICAL_VERSION. The database runs in WAL mode with a busy
+    timeout, so parallel batch workers can share one directory; when it grows
+    past max_bytes the least recently used entries are evicted. Storage errors
+    never fail a comparison: they count as misses. One instance may be shared
+    by threads.
+    """
+
+    DB_NAME = 'canonical-cache.sqlite3'
+    EVICT_EVERY = 64   # puts between size checks
+
+    def __init__(self, cache_dir: str, *, max_bytes: int = 64 * 1024 * 1024, timeout: float = 30.0):
+        sqlite3 = _sqlite3()
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self.path = str(Path(cache_dir) / self.DB_NAME)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.stores = self.evictions = self.errors = 0
+        self._puts_since_check = 0
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' digest TEXT NOT NULL, flags TEXT NOT NULL, version INTEGER NOT NULL,'
+            ' norm TEXT NOT NULL, tokens TEXT NOT NULL, canonical TEXT,'
+            ' size INTEGER NOT NULL, last_used REAL NOT NULL,'
+            ' PRIMARY KEY (digest, flags, version))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        self._db.execute('DELETE FROM entries WHERE version != ?', (CANONICAL_VERSION,))
+
+    @staticmethod
+    def content_digest(sql: str) -> str:
+        return hashlib.blake2b(sql.encode('utf-8', errors='surrogatepass'), digest_size=16).hexdigest()
+
+    def get(self, sql: str, flags_key: str):
+        """Return (norm, tokens, canonical_or_None) for sql, or None on a miss."""
+        key = (self.content_digest(sql), flags_key, CANONICAL_VERSION)
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    'SELECT norm, tokens, canonical FROM entries WHERE digest = ? AND flags = ? AND version = ?',
+                    key).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE entries SET last_used = ? WHERE digest = ? AND flags = ? AND version = ?',
+                                     (time.time(),) + key)
+            except _sqlite3().Error:
+                self.errors += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0], json.loads(row[1]), row[2]
+
+    def put(self, sql: str, flags_key: str, norm: str, tokens: list, canonical: 'Optional[str]' = None):
+        tokens_json = json.dumps(tokens, ensure_ascii=False)
+        size = len(norm) + len(tokens_json) + len(canonical or '')
+        with self._lock:
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (self.content_digest(sql), flags_key, CANONICAL_VERSION, norm, tokens_json, canonical,
+                     size, time.time()))
+            except _sqlite3().Error:
+                self.errors += 1
+                return
+            self.stores += 1
+            self._puts_since_check += 1
+            if self._puts_since_check >= self.EVICT_EVERY:
+                self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache is within 90% of max_bytes."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        self._puts_since_check = 0
+        try:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - int(self.max_bytes * 0.9)
+            doomed = []
+            for rowid, size in self._db.execute('SELECT rowid, size FROM entries ORDER BY last_used'):
+                doomed.append((rowid,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self._db.executemany('DELETE FROM entries WHERE rowid = ?', doomed)
+            self.evictions += len(doomed)
+        except _sqlite3().Error:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        """Counters of this process plus the current size of the shared store."""
+        with self._lock:
+            try:
+                entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            except _sqlite3().Error:
+                entries = size = None
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores,
+                'evictions': self.evictions, 'errors': self.errors, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._db.close()
+
+
+@functools.lru_cache(maxsize=8)
+def open_canonical_cache(cache_dir: str, max_bytes: int = 64 * 1024 * 1024) -> CanonicalCache:
+    """Process-wide CanonicalCache per directory, so batch workers open it once."""
+    return CanonicalCache(cache_dir, max_bytes=max_bytes)
+
+
 # =============================
 # Difference analysis (summary)
 # =============================
@@ -608,8 +1328,9 @@ def _join_reorderable_segments(sql: str, enable_join_reorder: bool, allow_full_o
     return reprs
 
 
+@_profiled('build_difference_summary')
 def build_difference_summary(norm_a: str, norm_b: str, can_a: str, can_b: str,
-                             tokens_a: list, tokens_b: list,
+                             tokens_a, tokens_b,
                              *, enable_join_reorder: bool, allow_full_outer: bool, allow_left: bool):
     summary = []
 
@@ -659,134 +1380,1397 @@ def build_difference_summary(norm_a: str, norm_b: str, can_a: str, can_b: str,
         summary.append('Join reordering is disabled; join order is considered significant in comparisons.')
 
     # Token change counts
-    sm = difflib.SequenceMatcher(a=tokens_a, b=tokens_b, autojunk=False)
-    ins = del_ = rep = 0
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
-        if tag == 'insert':   ins += (j2 - j1)
-        elif tag == 'delete': del_ += (i2 - i1)
-        elif tag == 'replace': rep += max(i2 - i1, j2 - j1)
+    ins, del_, rep, exact = token_change_counts(tokens_a, tokens_b)
     if ins or del_ or rep:
-        summary.append(f'Token-level changes: +{ins} inserts, -{del_} deletes, ~{rep} replaces.')
+        approx = '' if exact else ' (approximate)'
+        summary.append(f'Token-level changes{approx}: +{ins} inserts, -{del_} deletes, ~{rep} replaces.')
 
     if not summary:
         summary.append('No structural differences detected beyond normalization.')
     return summary
 
 
+# =============================
+# Layout
+# =============================
+
+_LAYOUT_CLAUSES = frozenset((
+    'SELECT', 'FROM', 'WHERE', 'HAVING', 'LIMIT', 'OFFSET', 'QUALIFY', 'WINDOW', 'VALUES', 'SET',
+    'WITH', 'UNION', 'INTERSECT', 'EXCEPT', 'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'RETURNING',
+))
+_LAYOUT_BY_CLAUSES = frozenset(('GROUP', 'ORDER'))
+_LAYOUT_LIST_CLAUSES = frozenset(('SELECT', 'GROUP', 'ORDER', 'SET'))
+_LAYOUT_JOIN_WORDS = frozenset(('JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS', 'NATURAL'))
+LAYOUT_WRAP = 80    # a parenthesized list longer than this gets one item per line
+
+
+@_profiled('layout_sql')
+def layout_sql(sql: str, indent: str = '  ') -> str:
+    """
+    Lay out one-line SQL over several lines for line-based diffs: clauses
+    start a line, SELECT/GROUP BY/ORDER BY/SET items, JOINs and top-level
+    AND terms of WHERE/HAVING get a line each, subqueries are indented by
+    nesting depth, and parenthesized lists longer than LAYOUT_WRAP put one
+    item per line. Only line breaks are added (replacing the whitespace they
+    fall on), so the text reads the same; the layout is deterministic and
+    linear in the input.
+    """
+    toks = [t for t in lex_sql(sql) if t.kind != 'WS']
+    if not toks:
+        return sql.strip()
+    closing = structural_index(sql).closing
+    out = [toks[0].text]
+    # frame: [kind ('query' | 'list' | 'inline'), indent level of the frame, clause, BETWEEN pending, open line level]
+    frames = [['query', 0, None, False, 0]]
+    level = 0           # indent level of the current output line
+    first_in_frame = False
+
+    def upper(k):
+        return toks[k].text.upper() if 0 <= k < len(toks) and toks[k].kind == 'WORD' else ''
+
+    def enter(k):
+        nonlocal level, first_in_frame
+        t = toks[k]
+        nxt = upper(k + 1)
+        if nxt in ('SELECT', 'WITH'):
+            frames.append(['query', level + 1, None, False, level])
+        elif closing(t.start) - t.start > LAYOUT_WRAP:
+            frames.append(['list', level + 1, None, False, level])
+        else:
+            frames.append(['inline', level, None, False, level])
+        first_in_frame = True
+
+    if toks[0].text == '(':
+        enter(0)
+    elif toks[0].kind == 'WORD':
+        frames[0][2] = upper(0)
+    for k in range(1, len(toks)):
+        t, prev = toks[k], toks[k - 1]
+        frame = frames[-1]
+        kind, base = frame[0], frame[1]
+        word = upper(k)
+        brk = None
+        if t.text == ')' and len(frames) > 1:
+            if kind != 'inline':
+                brk = frame[4]
+        elif first_in_frame:
+            if kind != 'inline':
+                brk = base
+        elif kind == 'query':
+            if word in _LAYOUT_CLAUSES or (word in _LAYOUT_BY_CLAUSES and upper(k + 1) == 'BY'):
+                brk = base
+            elif word in _LAYOUT_JOIN_WORDS and frame[2] == 'FROM' and upper(k - 1) not in _LAYOUT_JOIN_WORDS:
+                brk = base + 1
+            elif word == 'AND' and frame[2] in ('WHERE', 'HAVING'):
+                if frame[3]:
+                    frame[3] = False
+                else:
+                    brk = base + 1
+            elif prev.text == ',' and frame[2] in _LAYOUT_LIST_CLAUSES:
+                brk = base + 1
+        elif kind == 'list' and prev.text == ',':
+            brk = base
+        first_in_frame = False
+        if kind == 'query' and (word in _LAYOUT_CLAUSES or word in _LAYOUT_BY_CLAUSES):
+            frame[2] = word
+        elif kind == 'query' and word == 'BETWEEN':
+            frame[3] = True
+        if brk is None:
+            out.append(sql[prev.end:t.start])
+        else:
+            level = brk
+            out.append('\n' + indent * level)
+        out.append(t.text)
+        if t.text == '(':
+            enter(k)
+        elif t.text == ')' and len(frames) > 1:
+            frames.pop()
+    return ''.join(out)
+
+
+# =============================
+# Token diff
+# =============================
+
+TOKEN_DIFF_SMALL = 250_000       # len(a) * len(b) up to which difflib.SequenceMatcher is used
+TOKEN_DIFF_MAX_COST = 2_000_000  # Myers diagonals explored before the rest is aligned on patience anchors
+
+
+@_profiled('token_diff')
+def token_change_counts(tokens_a, tokens_b, *, algorithm: str = 'auto',
+                        max_cost: 'Optional[int]' = None) -> tuple:
+    """
+    Return (inserts, deletes, replaces, exact) turning tokens_a into tokens_b
+    (token lists, or token_ids arrays which are diffed as they are).
+    Every gap between matched tokens counts as a replace of max(len) when both
+    sides are non-empty, as an insert or delete otherwise. algorithm 'auto'
+    uses SequenceMatcher for small inputs and the linear-space Myers diff
+    otherwise. Myers explores at most max_cost diagonals (default
+    TOKEN_DIFF_MAX_COST); regions left over are aligned on patience anchors
+    (tokens unique to both sides) and exact is False, the counts then being
+    an upper bound. 'patience' uses the anchors alone.
+    """
+    if algorithm == 'auto':
+        algorithm = 'sequencematcher' if len(tokens_a) * len(tokens_b) <= TOKEN_DIFF_SMALL else 'myers'
+    if algorithm == 'sequencematcher':
+        import difflib
+        sm = difflib.SequenceMatcher(a=tokens_a, b=tokens_b, autojunk=False)
+        return (*_gap_counts(sm.get_matching_blocks(), len(tokens_a), len(tokens_b)), True)
+    if algorithm not in ('myers', 'patience'):
+        raise ValueError(f'Unknown token diff algorithm: {algorithm}')
+    ids_a, ids_b = (tokens_a, tokens_b) if isinstance(tokens_a, array) else _intern_tokens(tokens_a, tokens_b)
+    budget = (TOKEN_DIFF_MAX_COST if max_cost is None else max_cost) if algorithm == 'myers' else 0
+    matches, exact = _myers_matches(ids_a, ids_b, budget)
+    return (*_gap_counts(matches, len(ids_a), len(ids_b)), exact)
+
+
+def _intern_tokens(tokens_a: list, tokens_b: list) -> tuple:
+    """Map both token lists onto shared integer ids, so the diff compares ints."""
+    ids = {}
+    return ([ids.setdefault(t, len(ids)) for t in tokens_a],
+            [ids.setdefault(t, len(ids)) for t in tokens_b])
+
+
+def _gap_counts(matches, len_a: int, len_b: int) -> tuple:
+    """(inserts, deletes, replaces) from sorted (i, j, size) matched runs."""
+    ins = del_ = rep = 0
+    pi = pj = 0
+    for i, j, size in [*matches, (len_a, len_b, 0)]:
+        di, dj = i - pi, j - pj
+        if di and dj: rep += max(di, dj)
+        elif di:      del_ += di
+        elif dj:      ins += dj
+        pi, pj = i + size, j + size
+    return ins, del_, rep
+
+
+def _myers_matches(a: list, b: list, max_cost: int) -> tuple:
+    """
+    (matches, exact): sorted (i, j, size) runs of a shortest edit script
+    between a and b, from Myers' O((N+M)D) diff in linear space, which splits
+    every region at its middle snake. Once max_cost diagonals have been
+    explored, remaining regions are matched on patience anchors and exact is
+    False.
+    """
+    matches = []
+    budget = [max_cost]
+    exact = True
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1; blo += 1
+        if alo > start:
+            matches.append((start, blo - (alo - start), alo - start))
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1; bhi -= 1
+        if ahi < end:
+            matches.append((ahi, bhi, end - ahi))
+        if alo == ahi or blo == bhi:
+            continue
+        split = _middle_split(a, alo, ahi, b, blo, bhi, budget)
+        if split is None:
+            exact = False
+            matches.extend((alo + i, blo + j, 1) for i, j in _patience_matches(a[alo:ahi], b[blo:bhi]))
+        elif split:
+            x, y = split
+            stack.append((x, ahi, y, bhi))
+            stack.append((alo, x, blo, y))
+    matches.sort()
+    return matches, exact
+
+
+def _middle_split(a: list, alo: int, ahi: int, b: list, blo: int, bhi: int, budget: list):
+    """
+    Point (x, y) where the forward and backward D-paths of a[alo:ahi] and
+    b[blo:bhi] overlap, () when the regions share no token, None once the
+    diagonals explored exceed budget[0] (which is decremented as they are).
+    """
+    n, m = ahi - alo, bhi - blo
+    max_d = (n + m + 1) // 2
+    offset, size = max_d, 2 * max_d + 2
+    vf = [-1] * size; vf[offset + 1] = 0
+    vb = [-1] * size; vb[offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+    kf_start = kf_end = kb_start = kb_end = 0
+    for d in range(max_d):
+        budget[0] -= 2 * d + 2
+        if budget[0] < 0:
+            return None
+        for k in range(-d + kf_start, d + 1 - kf_end, 2):
+            ko = offset + k
+            if k == -d or (k != d and vf[ko - 1] < vf[ko + 1]):
+                x = vf[ko + 1]
+            else:
+                x = vf[ko - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1; y += 1
+            vf[ko] = x
+            if x > n:
+                kf_end += 2
+            elif y > m:
+                kf_start += 2
+            elif front:
+                kbo = offset + delta - k
+                if 0 <= kbo < size and vb[kbo] != -1 and x >= n - vb[kbo]:
+                    return alo + x, blo + y
+        for k in range(-d + kb_start, d + 1 - kb_end, 2):
+            ko = offset + k
+            if k == -d or (k != d and vb[ko - 1] < vb[ko + 1]):
+                x = vb[ko + 1]
+            else:
+                x = vb[ko - 1] + 1
+            y = x - k
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1; y += 1
+            vb[ko] = x
+            if x > n:
+                kb_end += 2
+            elif y > m:
+                kb_start += 2
+            elif not front:
+                kfo = offset + delta - k
+                if 0 <= kfo < size and vf[kfo] != -1:
+                    xf = vf[kfo]
+                    if xf >= n - x:
+                        return alo + xf, blo + xf - (kfo - offset)
+    return ()
+
+
 # =============================
 # Comparison
 # =============================
 
+@_profiled('unified_diff')
+def _unified_diff(a: str, b: str, fromfile: str, tofile: str) -> str:
+    import difflib
+    return "\n".join(difflib.unified_diff(
+        a.splitlines(), b.splitlines(),
+        fromfile=fromfile, tofile=tofile, lineterm=''
+    ))
+
+
+# Verdict cascade tiers, cheapest first.
+TIER_RAW = 'raw'
+TIER_WHITESPACE = 'whitespace'
+TIER_EXACT = 'exact'
+TIER_CANONICAL = 'canonical'
+
+# Quotes and comments, where a whitespace-only change can still change tokens.
+_WS_SENSITIVE_REGEX = _LazyRegex('_WS_SENSITIVE_REGEX', r"['\"\[`]|--|/\*")
+
+
+class ComparisonResult(Mapping):
+    """
+    Result of compare_sql(), read like the former result dict:
+      - ws_a/ws_b, ws_equal, diff_ws
+      - norm_a/norm_b, tokens_a/tokens_b, exact_equal, diff_norm
+      - can_a/can_b, canonical_equal, diff_can
+      - summary (list of bullet strings)
+    Every entry is computed on first access and cached, so asking only for a
+    verdict never builds the diffs or the summary. decide() reaches a verdict
+    through the cheapest tier that settles it.
+    """
+
+    def __init__(self, a: str, b: str, *, enable_join_reorder: bool = True,
+                 allow_full_outer: bool = False, allow_left: bool = False, cache=None):
+        self.a = a
+        self.b = b
+        self.enable_join_reorder = enable_join_reorder
+        self.allow_full_outer = allow_full_outer
+        self.allow_left = allow_left
+        self.cache = cache
+        self._values = {}
+        self.table = TokenTable()
+        self._ids = {}          # side -> array('I') of self.table ids
+        self._tiers = {}        # verdict key -> tier that decided it
+        self._cache_loaded = False
+
+    def _sides(self):
+        return (('a', self.a), ('b', self.b))
+
+    def _load_cached(self):
+        """Seed norm/tokens/can from the persistent cache, once."""
+        if self.cache is None or self._cache_loaded:
+            return
+        self._cache_loaded = True
+        flags_key = canonical_flags_key(self.enable_join_reorder, self.allow_full_outer, self.allow_left)
+        for side, sql in self._sides():
+            entry = self.cache.get(sql, flags_key)
+            if entry is not None:
+                norm, tokens, can = entry
+                self._values.update({f'norm_{side}': norm, f'tokens_{side}': tokens})
+                self._ids[side] = self.table.intern(tokens)
+                if can is not None:
+                    self._values[f'can_{side}'] = can
+
+    def _store_cached(self, side: str, sql: str):
+        if self.cache is not None:
+            self.cache.put(sql, canonical_flags_key(self.enable_join_reorder, self.allow_full_outer, self.allow_left),
+                           self._values[f'norm_{side}'], self.table.texts(self._ids[side]),
+                           self._values.get(f'can_{side}'))
+
+    def _streamed(self) -> bool:
+        return isinstance(self.a, PrenormalizedSQL) or isinstance(self.b, PrenormalizedSQL)
+
+    def _compute_ws(self):
+        for side, sql in self._sides():
+            if isinstance(sql, PrenormalizedSQL):
+                self._values[f'ws_{side}'] = ws_only_normalize_file(sql.path)
+            else:
+                self._values[f'ws_{side}'] = ws_only_normalize(sql)
+        self._values.setdefault('ws_equal', self._values['ws_a'] == self._values['ws_b'])
+
+    def _compute_ws_equal(self):
+        # Streamed files are compared by the digest their streaming pass recorded.
+        if not self._streamed():
+            return self._compute_ws()
+        a, b = (sql.ws_digest if isinstance(sql, PrenormalizedSQL) else ws_digest(ws_only_normalize(sql))
+                for _, sql in self._sides())
+        self._values['ws_equal'] = a == b
+
+    def _compute_norm(self):
+        self._load_cached()
+        for side, sql in self._sides():
+            if f'norm_{side}' not in self._values:
+                self._values[f'norm_{side}'], self._ids[side] = normalize_and_intern(sql, self.table)
+                self._store_cached(side, sql)
+        self._values['exact_equal'] = self._ids['a'] == self._ids['b']
+
+    def _compute_tokens(self):
+        if 'norm_a' not in self._values:
+            self._compute_norm()
+        for side in ('a', 'b'):
+            if f'tokens_{side}' not in self._values:
+                self._values[f'tokens_{side}'] = self.table.texts(self._ids[side])
+
+    def _compute_can(self):
+        self._load_cached()
+        flags = dict(enable_join_reorder=self.enable_join_reorder,
+                     allow_full_outer=self.allow_full_outer, allow_left=self.allow_left)
+        for side, sql in self._sides():
+            if f'can_{side}' not in self._values:
+                self._values[f'can_{side}'] = canonicalize_common(self[f'norm_{side}'], **flags)
+                self._store_cached(side, sql)
+        self._values['canonical_equal'] = self._values['can_a'] == self._values['can_b']
+
+    def _compute_diff_ws(self):
+        self._values['diff_ws'] = _unified_diff(
+            layout_sql(self['ws_a']), layout_sql(self['ws_b']), 'sql1(ws)', 'sql2(ws)')
+
+    def _compute_diff_norm(self):
+        self._values['diff_norm'] = _unified_diff(
+            layout_sql(self['norm_a']), layout_sql(self['norm_b']), 'sql1(norm)', 'sql2(norm)')
+
+    def _compute_diff_can(self):
+        self._values['diff_can'] = _unified_diff(
+            layout_sql(self['can_a']), layout_sql(self['can_b']), 'sql1(canon)', 'sql2(canon)')
+
+    def _compute_summary(self):
+        self._values['summary'] = build_difference_summary(
+            self['norm_a'], self['norm_b'], self['can_a'], self['can_b'],
+            self._ids['a'], self._ids['b'],
+            enable_join_reorder=self.enable_join_reorder,
+            allow_full_outer=self.allow_full_outer,
+            allow_left=self.allow_left)
+
+    _PRODUCERS = {
+        'ws_a': _compute_ws, 'ws_b': _compute_ws, 'ws_equal': _compute_ws_equal, 'diff_ws': _compute_diff_ws,
+        'norm_a': _compute_norm, 'norm_b': _compute_norm, 'tokens_a': _compute_tokens, 'tokens_b': _compute_tokens,
+        'exact_equal': _compute_norm, 'diff_norm': _compute_diff_norm,
+        'can_a': _compute_can, 'can_b': _compute_can, 'canonical_equal': _compute_can, 'diff_can': _compute_diff_can,
+        'summary': _compute_summary,
+    }
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._PRODUCERS:
+                raise KeyError(key)
+            self._PRODUCERS[key](self)
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._PRODUCERS
+
+    def __iter__(self):
+        return iter(self._PRODUCERS)
+
+    def __len__(self):
+        return len(self._PRODUCERS)
+
+    def computed(self) -> list:
+        """Keys whose values have been computed so far."""
+        return [k for k in self._PRODUCERS if k in self._values]
+
+    def decide(self, mode: str, ignore_ws: bool) -> tuple:
+        """
+        Return (verdict, tier) for *mode*, trying the tiers in order and
+        stopping at the first that settles it:
+          - raw: identical inputs are equal at every level
+          - whitespace: equal after collapsing whitespace; settles the other
+            verdicts too when neither text has quotes or comments
+          - exact: equal tokens; for the canonical verdict, equal normalized text
+          - canonical: equal canonical forms
+        """
+        key = verdict_key(mode, ignore_ws)
+        if key not in self._tiers:
+            self._tiers[key] = self._cascade(key)
+        return self._values[key], self._tiers[key]
+
+    def _settle(self, tier: str, *keys) -> str:
+        """Record keys as equal, decided by tier, unless already known."""
+        for key in keys:
+            self._values.setdefault(key, True)
+            self._tiers.setdefault(key, tier)
+        return tier
+
+    def _cascade(self, key: str) -> str:
+        if key in self._values:
+            return _VERDICT_TIERS[key]
+        if self.a == self.b and not self._streamed():
+            self._values.update(diff_ws='', diff_norm='', diff_can='')
+            return self._settle(TIER_RAW, 'ws_equal', 'exact_equal', 'canonical_equal')
+        if key == 'ws_equal':
+            self['ws_equal']
+            return TIER_WHITESPACE
+        sensitive = self.a.ws_sensitive if isinstance(self.a, PrenormalizedSQL) else _WS_SENSITIVE_REGEX.search(self.a)
+        if not sensitive and self['ws_equal']:
+            return self._settle(TIER_WHITESPACE, 'exact_equal', 'canonical_equal')
+        if key == 'exact_equal':
+            self['exact_equal']
+            return TIER_EXACT
+        if self['norm_a'] == self['norm_b']:
+            return self._settle(TIER_EXACT, 'canonical_equal')
+        self['canonical_equal']
+        return TIER_CANONICAL
+
+    def __repr__(self):
+        return f'<ComparisonResult computed={self.computed()}>'
+
+
+_VERDICT_TIERS = {'ws_equal': TIER_WHITESPACE, 'exact_equal': TIER_EXACT, 'canonical_equal': TIER_CANONICAL}
+
+
 def compare_sql(a: str, b: str,
                 *, ignore_ws: bool = False,
                 enable_join_reorder: bool = True,
                 allow_full_outer: bool = False,
-                allow_left: bool = False):
+                allow_left: bool = False,
+                cache: 'Optional[CanonicalCache]' = None) -> ComparisonResult:
     """
-    Return a result dict with:
+    Return a lazy ComparisonResult with:
       - ws_equal, ws_norm forms and diff
       - exact_equal (token-based on normalized)
       - canonical_equal (with SELECT/WHERE/JOIN canonicalization per flags)
       - summary (list of bullet strings)
+    Nothing is computed until a key is read. With a CanonicalCache, inputs
+    seen before skip normalization, tokenization and canonicalization.
     """
-    ws_a = ws_only_normalize(a)
-    ws_b = ws_only_normalize(b)
-    ws_equal = (ws_a == ws_b)
-    ws_diff = "\n".join(difflib.unified_diff(
-        ws_a.splitlines(), ws_b.splitlines(),
-        fromfile='sql1(ws)', tofile='sql2(ws)', lineterm=''
-    ))
+    return ComparisonResult(a, b, enable_join_reorder=enable_join_reorder,
+                            allow_full_outer=allow_full_outer, allow_left=allow_left, cache=cache)
 
-    norm_a = normalize_sql(a)
-    norm_b = normalize_sql(b)
-    tokens_a = tokenize(norm_a)
-    tokens_b = tokenize(norm_b)
-    exact_equal = (tokens_a == tokens_b)
-    diff_norm = "\n".join(difflib.unified_diff(
-        norm_a.splitlines(), norm_b.splitlines(),
-        fromfile='sql1(norm)', tofile='sql2(norm)', lineterm=''
-    ))
 
-    can_a = canonicalize_common(norm_a, enable_join_reorder=enable_join_reorder,
-                                allow_full_outer=allow_full_outer, allow_left=allow_left)
-    can_b = canonicalize_common(norm_b, enable_join_reorder=enable_join_reorder,
-                                allow_full_outer=allow_full_outer, allow_left=allow_left)
-    canonical_equal = (can_a == can_b)
-    diff_can = "\n".join(difflib.unified_diff(
-        can_a.splitlines(), can_b.splitlines(),
-        fromfile='sql1(canon)', tofile='sql2(canon)', lineterm=''
-    ))
+def verdict_key(mode: str, ignore_ws: bool) -> str:
+    """Result key holding the verdict used for the exit code of *mode*."""
+    if mode == 'exact':
+        return 'ws_equal' if ignore_ws else 'exact_equal'
+    return 'canonical_equal'
 
-    summary = build_difference_summary(norm_a, norm_b, can_a, can_b, tokens_a, tokens_b,
-                                       enable_join_reorder=enable_join_reorder,
-                                       allow_full_outer=allow_full_outer,
-                                       allow_left=allow_left)
-
-    return {
-        'ws_a': ws_a, 'ws_b': ws_b, 'ws_equal': ws_equal, 'diff_ws': ws_diff,
-        'norm_a': norm_a, 'norm_b': norm_b, 'tokens_a': tokens_a, 'tokens_b': tokens_b,
-        'exact_equal': exact_equal, 'diff_norm': diff_norm,
-        'can_a': can_a, 'can_b': can_b, 'canonical_equal': canonical_equal, 'diff_can': diff_can,
-        'summary': summary,
-    }
+
+def result_is_success(result, mode: str, ignore_ws: bool) -> bool:
+    """Return the verdict used for the exit code of *mode*."""
+    if isinstance(result, ComparisonResult):
+        return result.decide(mode, ignore_ws)[0]
+    return result[verdict_key(mode, ignore_ws)]
 
 
 # =============================
-# CLI
+# Batch comparison
 # =============================
 
-def parse_args(argv):
-    p = argparse.ArgumentParser(description='Compare two SQL statements with Exact/Canonical modes and GUI.')
-    p.add_argument('files', nargs='*', help='Two SQL files to compare')
-    p.add_argument('--strings', nargs=2, metavar=('SQL1', 'SQL2'), help='Provide two SQL strings inline')
-    p.add_argument('--stdin', action='store_true', help='Read two SQL statements from stdin separated by a line with ---')
-    p.add_argument('--mode', choices=['exact', 'canonical', 'both'], default='both', help='Comparison mode (default: both)')
-    p.add_argument('--ignore-whitespace', action='store_true', help='Consider queries equal if they differ only by whitespace')
-
-    # Global join reordering toggle (default ON) + fine-grained flags
-    jg = p.add_mutually_exclusive_group()
-    jg.add_argument('--join-reorder', dest='join_reorder', action='store_true', help='Enable join reordering (default)')
-    jg.add_argument('--no-join-reorder', dest='join_reorder', action='store_false', help='Disable join reordering')
-    p.set_defaults(join_reorder=True)
+BATCH_EQUAL = 'equal'
+BATCH_DIFFERENT = 'different'
+BATCH_MISSING = 'missing'
+BATCH_ERROR = 'error'
 
-    p.add_argument('--allow-full-outer-reorder', action='store_true', help='When join reordering is enabled, allow FULL OUTER JOIN reordering (heuristic)')
-    p.add_argument('--allow-left-reorder', action='store_true', help='When join reordering is enabled, allow LEFT JOIN reordering (heuristic)')
 
-    p.add_argument('--report', help='Write a comparison report to this file (html or txt)')
-    p.add_argument('--report-format', choices=['html', 'txt'], default='html', help='Report format (default: html)')
-    return p.parse_args(argv)
+def pair_directories(dir_a: str, dir_b: str, pattern: str = '*.sql') -> list:
+    """
+    Pair the files of two directory trees by relative path.
+    Returns a sorted list of (relpath, path_a, path_b); a side is None when
+    the file exists in only one of the trees.
+    """
+    roots = (Path(dir_a), Path(dir_b))
+    for root in roots:
+        if not root.is_dir():
+            raise NotADirectoryError(f'Not a directory: {root}')
+    found = [
+        {p.relative_to(root).as_posix(): str(p) for p in root.rglob(pattern) if p.is_file()}
+        for root in roots
+    ]
+    return [(rel, found[0].get(rel), found[1].get(rel))
+            for rel in sorted(set(found[0]) | set(found[1]))]
+
+
+def read_manifest(path_str: str) -> list:
+    """
+    Read a manifest of pairs, one "file1<TAB>file2" per line (whitespace is
+    accepted when neither path contains spaces). Blank lines and # comments are
+    skipped; relative paths resolve against the manifest's directory.
+    """
+    base = Path(path_str).parent
+    pairs = []
+    for lineno, line in enumerate(safe_read_file(path_str).splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = [x.strip() for x in line.split('\t')] if '\t' in line else line.split()
+        if len(parts) != 2 or not all(parts):
+            raise ValueError(f'{path_str}:{lineno}: expected two paths per line')
+        a, b = (str(base / x) for x in parts)
+        pairs.append((f'{parts[0]} <> {parts[1]}', a, b))
+    return pairs
+
+
+def _compare_pair_job(job) -> dict:
+    """Compare one batch pair; runs in a worker process, so it must stay picklable."""
+    label, path_a, path_b, options = job
+    if path_a is None or path_b is None:
+        return _compare_texts_job((label, path_a, path_b, options))
+    try:
+        a = read_sql_file(path_a, options.get('memory_budget'))
+        b = read_sql_file(path_b, options.get('memory_budget'))
+    except Exception as e:
+        return {'label': label, 'status': BATCH_ERROR, 'detail': str(e), 'summary': []}
+    return _compare_texts_job((label, a, b, options))
+
+
+_CACHE_OPEN_FAILED = set()   # cache dirs this process could not open; warned about once
+
+
+def _batch_cache(options: dict) -> 'Optional[CanonicalCache]':
+    """The worker's shared cache, or None when none is configured or it cannot be opened."""
+    cache_dir = options.get('cache_dir')
+    if not cache_dir or cache_dir in _CACHE_OPEN_FAILED:
+        return None
+    try:
+        return open_canonical_cache(cache_dir, options['cache_max_bytes'])
+    except Exception as e:
+        _CACHE_OPEN_FAILED.add(cache_dir)
+        print(f'[Cache] Disabled: {e}', file=sys.stderr)
+        return None
 
 
-def read_from_stdin_two_parts():
-    # Prevent DoS from unbounded piped input
-    raw = sys.stdin.read(MAX_FILE_SIZE_BYTES + 1)
-    if len(raw) > MAX_FILE_SIZE_BYTES:
-        raise ValueError(f'Input too large. Limit is {MAX_FILE_SIZE_MB} MB.')
-    parts = re.split(r"^\s*---\s*$", raw, flags=re.M)
-    if len(parts) != 2:
-        raise ValueError('When using --stdin, provide exactly two parts separated by a line containing only ---')
-    return parts[0].strip(), parts[1].strip()
+def _compare_texts_job(job) -> dict:
+    """Compare two SQL texts (None = missing side) into a batch result dict; picklable like _compare_pair_job."""
+    label, a, b, options = job
+    if a is None or b is None:
+        side = 'SQL2' if a is None else 'SQL1'
+        return {'label': label, 'status': BATCH_MISSING, 'detail': f'only in {side}', 'summary': []}
+    cache = _batch_cache(options)
+    if cache is not None:
+        hits, misses = cache.hits, cache.misses
+    start = time.perf_counter()
+    try:
+        result = compare_sql(
+            a, b,
+            ignore_ws=options['ignore_ws'],
+            enable_join_reorder=options['enable_join_reorder'],
+            allow_full_outer=options['allow_full_outer'],
+            allow_left=options['allow_left'],
+            cache=cache,
+        )
+        equal, tier = result.decide(options['mode'], options['ignore_ws'])
+        res = {
+            'label': label,
+            'status': BATCH_EQUAL if equal else BATCH_DIFFERENT,
+            'detail': '',
+            'summary': [] if equal else result['summary'],
+            'tier': tier,
+        }
+        if options.get('report_dir') or options.get('timing'):
+            res['elapsed_s'] = time.perf_counter() - start
+    except Exception as e:
+        return {'label': label, 'status': BATCH_ERROR, 'detail': str(e), 'summary': []}
+    if options.get('report_dir') and not equal:
+        try:
+            res['page'] = write_batch_page(result, label, options['mode'], options['ignore_ws'], options['report_dir'])
+        except Exception as e:
+            res['detail'] = f'report page failed: {e}'
+    if cache is not None:
+        res['cache_hits'] = cache.hits - hits
+        res['cache_misses'] = cache.misses - misses
+    return res
 
 
-def load_inputs(args):
-    if args.strings:
-        return args.strings[0], args.strings[1], 'strings'
-    if args.stdin:
+def _ordered_map(fn, items, *, jobs: int = 1, max_in_flight: int = 0, mp_context=None):
+    """
+    Yield fn(item) for every item in input order.
+    With jobs > 1 the calls run on a process pool with at most max_in_flight
+    submissions ahead of the consumer; closing the generator cancels them.
+    mp_context (a multiprocessing context) picks the pool's start method.
+    """
+    if jobs <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    import concurrent.futures
+    max_in_flight = max_in_flight or jobs * 4
+    pending = deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as pool:
+        try:
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
+def iter_batch_results(pairs, *, mode: str = 'both', ignore_ws: bool = False,
+                       enable_join_reorder: bool = True, allow_full_outer: bool = False,
+                       allow_left: bool = False, jobs: int = 1, fail_fast: bool = False,
+                       cache_dir: 'Optional[str]' = None, cache_max_bytes: int = 64 * 1024 * 1024,
+                       memory_budget: 'Optional[int]' = None, report_dir: 'Optional[str]' = None,
+                       timing: bool = False, mp_context=None):
+    """
+    Compare (label, path_a, path_b) pairs and yield one result dict per pair,
+    in input order. With fail_fast, stop after the first pair that is not
+    equal and cancel the outstanding work. With cache_dir, every worker shares
+    the persistent CanonicalCache there and results carry cache_hits/cache_misses.
+    Files above memory_budget bytes are streamed (see read_sql_file). With
+    report_dir (prepared by BatchReport), results carry elapsed_s and the
+    workers write a detail page for every differing pair, named in 'page'.
+    With timing (implied by report_dir), compared pairs carry elapsed_s.
+    mp_context sets the worker pool's start method (see _ordered_map).
+    """
+    options = {
+        'mode': mode, 'ignore_ws': ignore_ws, 'enable_join_reorder': enable_join_reorder,
+        'allow_full_outer': allow_full_outer, 'allow_left': allow_left,
+        'cache_dir': cache_dir, 'cache_max_bytes': cache_max_bytes, 'memory_budget': memory_budget,
+        'report_dir': report_dir, 'timing': timing,
+    }
+    return _iter_verdicts(_compare_pair_job, ((label, a, b, options) for label, a, b in pairs),
+                          jobs=jobs, fail_fast=fail_fast, mp_context=mp_context)
+
+
+def _iter_verdicts(job_fn, jobs_iter, *, jobs: int = 1, fail_fast: bool = False, mp_context=None):
+    results = _ordered_map(job_fn, jobs_iter, jobs=jobs, mp_context=mp_context)
+    try:
+        for res in results:
+            yield res
+            if fail_fast and res['status'] != BATCH_EQUAL:
+                return
+    finally:
+        results.close()
+
+
+def batch_exit_code(statuses) -> int:
+    """0 when every pair is equal, 2 if any pair errored, otherwise 1."""
+    statuses = set(statuses)
+    if BATCH_ERROR in statuses:
+        return 2
+    if statuses - {BATCH_EQUAL}:
+        return 1
+    return 0
+
+
+# =============================
+# JSONL stream protocol
+# =============================
+
+JSONL_OPTION_KEYS = frozenset(('mode', 'ignore_ws', 'enable_join_reorder', 'allow_full_outer', 'allow_left'))
+
+
+def _iter_bounded_lines(stream, max_chars: int):
+    """Yield (lineno, line) from stream; a line longer than max_chars is skipped and yields (lineno, None)."""
+    lineno = 0
+    while True:
+        line = stream.readline(max_chars + 1)
+        if not line:
+            return
+        lineno += 1
+        if len(line) > max_chars and not line.endswith('\n'):
+            while line and not line.endswith('\n'):
+                line = stream.readline(max_chars + 1)
+            yield lineno, None
+            continue
+        yield lineno, line
+
+
+def _parse_jsonl_record(lineno: int, line: 'Optional[str]', defaults: dict) -> tuple:
+    """Turn one JSONL line into a (label, a, b, options, error) job; error is None for a valid record."""
+    if line is None:
+        return f'line {lineno}', None, None, None, 'line exceeds the memory budget'
+    try:
+        rec = json.loads(line)
+    except ValueError as e:
+        return f'line {lineno}', None, None, None, f'invalid JSON ({e})'
+    if not isinstance(rec, dict):
+        return f'line {lineno}', None, None, None, 'expected an object with "a" and "b"'
+    label = rec.get('id', f'line {lineno}')
+    a, b, opts = rec.get('a'), rec.get('b'), rec.get('options') or {}
+    if not isinstance(a, str) or not isinstance(b, str):
+        return label, None, None, None, 'expected SQL strings in "a" and "b"'
+    if not isinstance(opts, dict) or set(opts) - JSONL_OPTION_KEYS:
+        return label, None, None, None, f'options must be an object with keys among {sorted(JSONL_OPTION_KEYS)}'
+    return label, a, b, dict(defaults, **opts), None
+
+
+def _jsonl_job(job) -> dict:
+    """Compare one parsed JSONL record; picklable like _compare_texts_job."""
+    label, a, b, options, error = job
+    if error is not None:
+        res = {'label': label, 'status': BATCH_ERROR, 'detail': error, 'summary': []}
+    else:
+        res = _compare_texts_job((label, a, b, options))
+    return {'id': res.pop('label'), **res}
+
+
+def iter_jsonl_results(stream, *, mode: str = 'both', ignore_ws: bool = False,
+                       enable_join_reorder: bool = True, allow_full_outer: bool = False,
+                       allow_left: bool = False, jobs: int = 1, max_line_chars: 'Optional[int]' = None):
+    """
+    Compare an unbounded text stream of JSON lines {"id", "a", "b", "options"}
+    and yield one result dict (id, status, detail, summary) per non-blank line,
+    in input order. "options" may override mode, ignore_ws and the join flags
+    for that record. Records are read lazily and at most a bounded number is
+    in flight, so memory does not grow with the length of the stream. Lines
+    that are too long (default: MAX_FILE_SIZE_BYTES characters), malformed or
+    incomplete yield an error result instead of stopping the stream.
+    """
+    defaults = {
+        'mode': mode, 'ignore_ws': ignore_ws, 'enable_join_reorder': enable_join_reorder,
+        'allow_full_outer': allow_full_outer, 'allow_left': allow_left,
+    }
+    limit = MAX_FILE_SIZE_BYTES if max_line_chars is None else max_line_chars
+    records = (_parse_jsonl_record(lineno, line, defaults)
+               for lineno, line in _iter_bounded_lines(stream, limit) if line is None or line.strip())
+    return _ordered_map(_jsonl_job, records, jobs=jobs)
+
+
+# =============================
+# Equivalence classes
+# =============================
+
+def collect_cluster_inputs(paths, pattern: str = '*.sql') -> list:
+    """
+    Expand cluster inputs into (label, path, sql) jobs: directories contribute
+    every file matching pattern, *.jsonl files one query per line (a JSON
+    string or an object with "sql" and optional "id"), anything else is one
+    query per file and is read later by the worker (sql is None).
+    """
+    items = []
+    for path_str in paths:
+        path = Path(path_str)
+        if path.is_dir():
+            items.extend((str(p), str(p), None) for p in sorted(path.rglob(pattern)) if p.is_file())
+        elif path.suffix.lower() == '.jsonl':
+            for lineno, line in enumerate(safe_read_file(path_str).splitlines(), 1):
+                if not line.strip():
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f'{path_str}:{lineno}: invalid JSON ({e})') from None
+                if isinstance(rec, dict):
+                    sql, label = rec.get('sql'), rec.get('id', f'{path_str}:{lineno}')
+                else:
+                    sql, label = rec, f'{path_str}:{lineno}'
+                if not isinstance(sql, str):
+                    raise ValueError(f'{path_str}:{lineno}: expected a SQL string or an object with "sql"')
+                items.append((str(label), None, sql))
+        else:
+            items.append((path_str, path_str, None))
+    return items
+
+
+def _canonical_job(job) -> tuple:
+    """Canonicalize one cluster input; returns (label, fingerprint, canonical, error)."""
+    label, path, sql, flags, budget = job
+    try:
+        if sql is None:
+            sql = read_sql_file(path, budget)
+        canonical = canonicalize_common(normalize_sql(sql), **flags)
+    except Exception as e:
+        return label, None, None, str(e)
+    return label, _fingerprint_of_canonical(canonical, canonical_flags_key(**flags)), canonical, None
+
+
+def cluster_queries(items, *, enable_join_reorder: bool = True, allow_full_outer: bool = False,
+                    allow_left: bool = False, jobs: int = 1, memory_budget: 'Optional[int]' = None) -> tuple:
+    """
+    Group (label, path, sql) inputs into canonical equivalence classes.
+    Every query is canonicalized once (on a process pool when jobs > 1) and
+    hashed, so the cost is linear in the number of queries; files above
+    memory_budget bytes are streamed (see read_sql_file). Returns
+    (classes, errors): classes are dicts with fingerprint, members and the
+    canonical form of the first member, largest class first; errors are
+    (label, message) pairs.
+    """
+    flags = dict(enable_join_reorder=enable_join_reorder, allow_full_outer=allow_full_outer, allow_left=allow_left)
+    classes = {}
+    errors = []
+    for label, digest, canonical, error in _ordered_map(
+            _canonical_job, ((label, path, sql, flags, memory_budget) for label, path, sql in items),
+            jobs=jobs):
+        if error is not None:
+            errors.append((label, error))
+        elif digest in classes:
+            classes[digest]['members'].append(label)
+        else:
+            classes[digest] = {'fingerprint': digest, 'members': [label], 'canonical': canonical}
+    ordered = sorted(classes.values(), key=lambda c: -len(c['members']))   # stable: ties keep first-seen order
+    return ordered, errors
+
+
+# =============================
+# Multi-statement scripts
+# =============================
+
+# Inside plain text: parentheses, statement terminators and GO batch lines.
+_SCRIPT_SPLIT_REGEX = _LazyRegex('_SCRIPT_SPLIT_REGEX',
+    r'(?P<PAREN>[()])|(?P<SEMI>;)|(?P<GO>^[ \t]*GO[ \t]*(?=\r?\n|\Z))',
+    re.MULTILINE | re.IGNORECASE,
+)
+
+
+def iter_statements(source, *, go_separator: bool = False, chunk_size: int = 1 << 16):
+    """
+    Lazily yield the statements of a SQL script, split at top-level ';'
+    (outside quotes, comments and parentheses) and, with go_separator, at
+    lines holding only GO. source is a string or a text file object read in
+    chunk_size pieces; memory stays bounded by the longest statement.
+    Statements are stripped, without the ';'; comment-only ones are skipped.
+    """
+    pieces = iter((source,)) if isinstance(source, str) else None
+    buf = ''
+    start = scan = depth = 0
+    want = chunk_size
+    eof = False
+    while not eof:
+        chunk = next(pieces, '') if pieces is not None else source.read(want)
+        if chunk:
+            buf = buf[start:] + chunk
+            scan -= start
+            start = 0
+        else:
+            eof = True
+        for m in SQL_SEGMENT_REGEX.finditer(buf, scan):
+            # A segment touching the end of the buffer may continue in the next
+            # chunk ($ also matches before a final newline), so wait for it.
+            if not eof and m.end() >= len(buf) - 1:
+                break
+            scan = m.end()
+            if m.lastgroup != 'TEXT':
+                continue
+            for t in _SCRIPT_SPLIT_REGEX.finditer(buf, m.start(), m.end()):
+                kind = t.lastgroup
+                if kind == 'PAREN':
+                    depth = depth + 1 if t.group() == '(' else max(depth - 1, 0)
+                    continue
+                if kind == 'GO' and (not go_separator or (t.end() == m.end() < len(buf))):
+                    continue
+                if kind == 'SEMI' and depth:
+                    continue
+                stmt = buf[start:t.start()].strip()
+                start = t.end()
+                depth = 0 if kind == 'GO' else depth
+                if strip_sql_comments(stmt).strip():
+                    yield stmt
+        # Appending a chunk copies the unfinished statement, and a long
+        # unfinished segment is rescanned from its start, so while no
+        # statement ends the reads grow geometrically; the copying and
+        # rescanning then stay linear in the statement's length.
+        want = want * 2 if start == 0 else chunk_size
+    stmt = buf[start:].strip()
+    if strip_sql_comments(stmt).strip():
+        yield stmt
+
+
+def _statement_head(stmt: 'Optional[str]') -> str:
+    head = collapse_whitespace(stmt[:200]) if stmt else ''
+    return head[:60] + ('...' if len(head) > 60 else '')
+
+
+def _statement_label(n: int, stmt: 'Optional[str]') -> str:
+    return f'#{n} {_statement_head(stmt)}'
+
+
+def iter_script_results(statements_a, statements_b, *, mode: str = 'both', ignore_ws: bool = False,
+                        enable_join_reorder: bool = True, allow_full_outer: bool = False,
+                        allow_left: bool = False, jobs: int = 1, fail_fast: bool = False):
+    """
+    Compare two statement streams position by position (see iter_statements)
+    and yield one batch-style result dict per statement, in order. Statements
+    are consumed lazily and at most a bounded number is in flight.
+    """
+    options = {
+        'mode': mode, 'ignore_ws': ignore_ws, 'enable_join_reorder': enable_join_reorder,
+        'allow_full_outer': allow_full_outer, 'allow_left': allow_left,
+    }
+    pairs = itertools.zip_longest(statements_a, statements_b)
+    return _iter_verdicts(
+        _compare_texts_job,
+        ((_statement_label(n, a if a is not None else b), a, b, options) for n, (a, b) in enumerate(pairs, 1)),
+        jobs=jobs, fail_fast=fail_fast)
+
+
+SCRIPT_UNCHANGED = 'unchanged'
+SCRIPT_MOVED = 'moved'
+SCRIPT_MODIFIED = 'modified'
+SCRIPT_ADDED = 'added'
+SCRIPT_REMOVED = 'removed'
+
+
+def _longest_increasing_pairs(pairs: list) -> list:
+    """Longest run of (i, j) pairs (sorted by i) whose j also increases; patience sorting, O(k log k)."""
+    tails, tail_idx, prev = [], [], [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j); tail_idx.append(k)
+        else:
+            tails[pos] = j; tail_idx[pos] = k
+        prev[k] = tail_idx[pos - 1] if pos else None
+    out = []
+    k = tail_idx[-1] if tail_idx else None
+    while k is not None:
+        out.append(pairs[k])
+        k = prev[k]
+    return out[::-1]
+
+
+def _patience_matches(fa: list, fb: list) -> list:
+    """
+    Patience alignment of two fingerprint lists: match common prefix and
+    suffix, anchor on fingerprints unique to both sides in increasing order,
+    and repeat inside every gap. Returns sorted (i, j) matches.
+    """
+    matches = []
+    stack = [(0, len(fa), 0, len(fb))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        while alo < ahi and blo < bhi and fa[alo] == fb[blo]:
+            matches.append((alo, blo)); alo += 1; blo += 1
+        while alo < ahi and blo < bhi and fa[ahi - 1] == fb[bhi - 1]:
+            ahi -= 1; bhi -= 1; matches.append((ahi, bhi))
+        if alo >= ahi or blo >= bhi:
+            continue
+        count_a = Counter(fa[alo:ahi])
+        count_b = Counter(fb[blo:bhi])
+        pos_b = {fb[j]: j for j in range(blo, bhi) if count_b[fb[j]] == 1}
+        anchors = _longest_increasing_pairs(
+            [(i, pos_b[fa[i]]) for i in range(alo, ahi) if count_a[fa[i]] == 1 and fa[i] in pos_b])
+        if not anchors:
+            continue
+        matches.extend(anchors)
+        bounds = [(alo - 1, blo - 1)] + anchors + [(ahi, bhi)]
+        for (i0, j0), (i1, j1) in zip(bounds, bounds[1:]):
+            if i1 - i0 > 1 and j1 - j0 > 1:
+                stack.append((i0 + 1, i1, j0 + 1, j1))
+    return sorted(matches)
+
+
+def align_scripts(statements_a, statements_b, *, mode: str = 'both', ignore_ws: bool = False,
+                  enable_join_reorder: bool = True, allow_full_outer: bool = False,
+                  allow_left: bool = False, jobs: int = 1) -> list:
+    """
+    Align two scripts by the canonical fingerprints of their statements.
+    Returns one dict per statement with op (unchanged, moved, modified,
+    added or removed), the 0-based positions a/b (None on the missing side),
+    a label and, for modified pairs, the summary of a detailed compare_sql
+    run. Fingerprints are matched patience-style, identical statements left
+    over count as moved, and the remaining statements between two matches
+    are paired in order as modified; so only those residual pairs are diffed.
+    A statement that fails to canonicalize matches nothing (not even the same
+    failure on the other side) and its error is reported in detail.
+    """
+    flags = dict(enable_join_reorder=enable_join_reorder, allow_full_outer=allow_full_outer, allow_left=allow_left)
+    sides = []
+    for stmts in (list(statements_a), list(statements_b)):
+        digests, errors = [], {}
+        for label, digest, _, error in _ordered_map(
+                _canonical_job, ((n, None, sql, flags, None) for n, sql in enumerate(stmts)), jobs=jobs):
+            if error is not None:
+                errors[label] = f'canonicalization failed: {error}'
+                digest = object()   # unique, so it can never match
+            digests.append(digest)
+        sides.append((stmts, digests, errors))
+    (sa, fa, errors_a), (sb, fb, errors_b) = sides
+
+    matched = _patience_matches(fa, fb)
+    used_a = {i for i, _ in matched}
+    used_b = {j for _, j in matched}
+    left_b = {}
+    for j, digest in enumerate(fb):
+        if j not in used_b:
+            left_b.setdefault(digest, deque()).append(j)
+    moved = []
+    for i, digest in enumerate(fa):
+        if i not in used_a and left_b.get(digest):
+            moved.append((i, left_b[digest].popleft()))
+    used_a.update(i for i, _ in moved)
+    used_b.update(j for _, j in moved)
+
+    ops = [(SCRIPT_UNCHANGED, i, j) for i, j in matched] + [(SCRIPT_MOVED, i, j) for i, j in moved]
+    bounds = [(-1, -1)] + matched + [(len(sa), len(sb))]
+    for (i0, j0), (i1, j1) in zip(bounds, bounds[1:]):
+        gap_a = [i for i in range(i0 + 1, i1) if i not in used_a]
+        gap_b = [j for j in range(j0 + 1, j1) if j not in used_b]
+        ops.extend((SCRIPT_MODIFIED, i, j) for i, j in zip(gap_a, gap_b))
+        ops.extend((SCRIPT_REMOVED, i, None) for i in gap_a[len(gap_b):])
+        ops.extend((SCRIPT_ADDED, None, j) for j in gap_b[len(gap_a):])
+    # Report in the order of the new script; a removed statement follows the
+    # new position of its nearest non-moved predecessor in the old one.
+    b_of_a = {i: j for op, i, j in ops if op != SCRIPT_MOVED and i is not None and j is not None}
+    prev_b, last = [], -1
+    for i in range(len(sa)):
+        prev_b.append(last)
+        last = b_of_a.get(i, last)
+    ops.sort(key=lambda op: (op[2], 0, 0) if op[2] is not None else (prev_b[op[1]], 1, op[1]))
+
+    options = dict(flags, mode=mode, ignore_ws=ignore_ws)
+    modified = [(op, i, j) for op, i, j in ops if op == SCRIPT_MODIFIED]
+    details = _ordered_map(_compare_texts_job, ((f'{i}:{j}', sa[i], sb[j], options) for _, i, j in modified),
+                           jobs=jobs)
+    results = []
+    for op, i, j in ops:
+        stmt = sa[i] if i is not None else sb[j]
+        res = {'op': op, 'a': i, 'b': j, 'summary': [], 'detail': '',
+               'label': f"{'-' if i is None else i + 1} -> {'-' if j is None else j + 1}  {_statement_head(stmt)}"}
+        if op == SCRIPT_MODIFIED:
+            detail = next(details)
+            res['summary'], res['detail'] = detail['summary'], detail['detail']
+        res['detail'] = res['detail'] or errors_a.get(i) or errors_b.get(j, '')
+        results.append(res)
+    return results
+
+
+# =============================
+# Compare daemon
+# =============================
+
+DEFAULT_DAEMON_ADDR = '127.0.0.1:8765'
+
+
+# The daemon is unauthenticated, so it only ever binds these.
+LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+
+def _split_addr(addr: str) -> tuple:
+    host, _, port = addr.rpartition(':')
+    return host.strip('[]') or '127.0.0.1', int(port)
+
+
+class _Coalescer:
+    """Run identical concurrent calls once: later callers with the same key wait for the first one's result."""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        import concurrent.futures
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = concurrent.futures.Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return fut.result()
+        try:
+            value = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+def _request_flags(req: dict) -> dict:
+    return dict(enable_join_reorder=bool(req.get('enable_join_reorder', True)),
+                allow_full_outer=bool(req.get('allow_full_outer', False)),
+                allow_left=bool(req.get('allow_left', False)))
+
+
+def _daemon_compare(req: dict, cache) -> dict:
+    """{"a", "b", flags, "mode", "ignore_ws", "keys"} -> {"success", "result": {key: value}}."""
+    mode, ignore_ws = req.get('mode', 'both'), bool(req.get('ignore_ws', False))
+    result = compare_sql(req['a'], req['b'], ignore_ws=ignore_ws, cache=cache, **_request_flags(req))
+    equal, tier = result.decide(mode, ignore_ws)
+    values = {k: result[k] for k in req.get('keys', ())}
+    return {'success': equal, 'tier': tier, 'result': values}
+
+
+def _daemon_fingerprint(req: dict, cache) -> dict:
+    """{"sql", flags, "digest_size"} -> {"fingerprint"}."""
+    return {'fingerprint': canonical_fingerprint(req['sql'], digest_size=int(req.get('digest_size', 16)),
+                                                 **_request_flags(req))}
+
+
+def _daemon_report(req: dict, cache) -> dict:
+    """{"a", "b", flags, "mode", "ignore_ws", "format"} -> {"success", "report"}."""
+    mode, ignore_ws = req.get('mode', 'both'), bool(req.get('ignore_ws', False))
+    result = compare_sql(req['a'], req['b'], ignore_ws=ignore_ws, cache=cache, **_request_flags(req))
+    return {'success': result_is_success(result, mode, ignore_ws),
+            'report': render_report(result, mode, req.get('format', 'html'), ignore_ws)}
+
+
+class CompareDaemon:
+    """
+    Long-running compare server on localhost HTTP. POST /compare, /fingerprint
+    and /report take and return JSON objects; GET /stats reports memo, cache and
+    coalescing counters. Requests are served on threads and share the warm
+    in-process memo and, with cache_dir, a CanonicalCache; identical requests
+    arriving while one is being computed wait for it instead of repeating it.
+    """
+
+    ROUTES = {'/compare': _daemon_compare, '/fingerprint': _daemon_fingerprint, '/report': _daemon_report}
+
+    def __init__(self, addr: str = DEFAULT_DAEMON_ADDR, *, cache_dir: 'Optional[str]' = None,
+                 cache_max_bytes: int = 64 * 1024 * 1024):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        host, port = _split_addr(addr)
+        if host not in LOOPBACK_HOSTS:
+            raise ValueError(f'refusing to serve on {host}: the daemon only binds loopback addresses '
+                             f"({', '.join(LOOPBACK_HOSTS)})")
+        self.cache = open_canonical_cache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.coalescer = _Coalescer()
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/stats':
+                    return self._reply(404, {'error': f'unknown path {self.path}'})
+                self._reply(200, daemon.stats())
+
+            def do_POST(self):
+                route = daemon.ROUTES.get(self.path)
+                if route is None:
+                    return self._reply(404, {'error': f'unknown path {self.path}'})
+                length = int(self.headers.get('Content-Length') or 0)
+                if length > 2 * MAX_FILE_SIZE_BYTES:
+                    return self._reply(413, {'error': 'request too large'})
+                body = self.rfile.read(length)
+                try:
+                    req = json.loads(body)
+                    if not isinstance(req, dict):
+                        raise ValueError('expected a JSON object')
+                    key = (self.path, hashlib.blake2b(body, digest_size=16).digest())
+                    reply = daemon.coalescer.run(key, lambda: route(req, daemon.cache))
+                except (KeyError, TypeError, ValueError) as e:
+                    return self._reply(400, {'error': f'bad request: {e}'})
+                except Exception as e:
+                    return self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+                with daemon._requests_lock:
+                    daemon.requests += 1
+                self._reply(200, reply)
+
+            def _reply(self, status: int, payload: dict):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server_cls = ThreadingHTTPServer
+        if ':' in host:
+            import socket
+            server_cls = type('ThreadingHTTPServer6', (ThreadingHTTPServer,), {'address_family': socket.AF_INET6})
+        self.server = server_cls((host, port), Handler)
+        self.server.daemon_threads = True
+        self.addr = '%s:%d' % self.server.server_address[:2]
+
+    def stats(self) -> dict:
+        return {'requests': self.requests, 'coalesced': self.coalescer.coalesced, 'memo': memo_stats(),
+                'cache': self.cache.stats() if self.cache is not None else None}
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def daemon_call(addr: str, path: str, payload: dict, *, timeout: float = 60.0) -> 'Optional[dict]':
+    """
+    POST payload to the daemon at addr and return its JSON reply, or None
+    when no daemon answers or it rejects the request, so callers can fall
+    back to computing in-process.
+    """
+    import http.client
+    host, port = _split_addr(addr)
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request('POST', path, body=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                     headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        reply = json.loads(resp.read())
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+    return reply if resp.status == 200 else None
+
+
+# =============================
+# CLI
+# =============================
+
+def parse_args(argv):
+    import argparse
+    p = argparse.ArgumentParser(description='Compare two SQL statements with Exact/Canonical modes and GUI.')
+    p.add_argument('files', nargs='*', help='Two SQL files to compare')
+    p.add_argument('--strings', nargs=2, metavar=('SQL1', 'SQL2'), help='Provide two SQL strings inline')
+    p.add_argument('--stdin', action='store_true', help='Read two SQL statements from stdin separated by a line with ---')
+    p.add_argument('--batch', nargs=2, metavar=('DIR1', 'DIR2'), help='Compare every file of two directory trees, paired by relative path')
+    p.add_argument('--manifest', help='Compare the pairs listed in this file (one "file1<TAB>file2" per line)')
+    p.add_argument('--script', action='store_true',
+                   help='Treat the two files as multi-statement scripts and compare them statement by statement')
+    p.add_argument('--go', action='store_true', help='With --script, also split batches at lines holding only GO')
+    p.add_argument('--align', action='store_true',
+                   help='With --script, align statements by canonical fingerprint and report moved/added/removed/modified ones')
+    p.add_argument('--jsonl', action='store_true',
+                   help='Read {"id", "a", "b", "options"} records from stdin, one per line, and write one JSON result line each')
+    p.add_argument('--cluster', action='store_true',
+                   help='Group the given files, directories and .jsonl query lists into canonical equivalence classes')
+    p.add_argument('--pattern', default='*.sql', help='File glob used by --batch and --cluster directories (default: *.sql)')
+    p.add_argument('--jobs', type=int, default=1, help='Worker processes for batch, script and cluster runs (default: 1; 0 = one per CPU)')
+    p.add_argument('--fail-fast', action='store_true', help='Stop a batch or script at the first pair that is not equal')
+    p.add_argument('--mode', choices=['exact', 'canonical', 'both'], default='both', help='Comparison mode (default: both)')
+    p.add_argument('--ignore-whitespace', action='store_true', help='Consider queries equal if they differ only by whitespace')
+    p.add_argument('--check', '--quiet', '-q', dest='check', action='store_true',
+                   help='Only compute the verdict for --mode; print nothing and report it through the exit code')
+
+    # Global join reordering toggle (default ON) + fine-grained flags
+    jg = p.add_mutually_exclusive_group()
+    jg.add_argument('--join-reorder', dest='join_reorder', action='store_true', help='Enable join reordering (default)')
+    jg.add_argument('--no-join-reorder', dest='join_reorder', action='store_false', help='Disable join reordering')
+    p.set_defaults(join_reorder=True)
+
+    p.add_argument('--allow-full-outer-reorder', action='store_true', help='When join reordering is enabled, allow FULL OUTER JOIN reordering (heuristic)')
+    p.add_argument('--allow-left-reorder', action='store_true', help='When join reordering is enabled, allow LEFT JOIN reordering (heuristic)')
+
+    p.add_argument('--fingerprint', action='store_true',
+                   help='Print a stable canonical fingerprint for each input (files, --strings or --stdin) instead of comparing')
+    p.add_argument('--digest-size', type=int, default=16, help='Fingerprint digest size in bytes (default: 16)')
+
+    p.add_argument('--cache-dir', help='Keep normalized/canonical forms in a persistent cache in this directory')
+    p.add_argument('--cache-max-mb', type=int, default=64, help='Size bound of the persistent cache in MB (default: 64)')
+    p.add_argument('--memory-budget-mb', type=float, default=MAX_FILE_SIZE_MB,
+                   help=f'Read SQL files up to this size whole; stream and normalize larger ones in chunks (default: {MAX_FILE_SIZE_MB})')
+
+    p.add_argument('--serve', nargs='?', const=DEFAULT_DAEMON_ADDR, metavar='HOST:PORT',
+                   help=f'Run a compare daemon on localhost HTTP with warm caches (default address: {DEFAULT_DAEMON_ADDR})')
+    p.add_argument('--daemon', nargs='?', const=DEFAULT_DAEMON_ADDR, metavar='HOST:PORT',
+                   help='Send compare and fingerprint work to a running --serve daemon; computes in-process if none answers')
+
+    p.add_argument('--report', help='Write a comparison report to this file (html or txt); with --batch or --manifest, '
+                                    'an HTML report directory (index.html plus a page per differing pair)')
+    p.add_argument('--report-format', choices=['html', 'txt'], default='html', help='Report format (default: html)')
+    p.add_argument('--profile', nargs='?', const='', metavar='JSON_PATH',
+                   help='Print per-stage time, calls, characters and peak memory to stderr (and write them as JSON to JSON_PATH); '
+                        'also added to --report')
+    return p.parse_args(argv)
+
+
+def read_stdin_bounded() -> str:
+    # Prevent DoS from unbounded piped input
+    raw = sys.stdin.read(MAX_FILE_SIZE_BYTES + 1)
+    if len(raw) > MAX_FILE_SIZE_BYTES:
+        raise ValueError(f'Input too large. Limit is {MAX_FILE_SIZE_MB} MB.')
+    return raw
+
+
+def read_from_stdin_two_parts():
+    raw = read_stdin_bounded()
+    parts = re.split(r"^\s*---\s*$", raw, flags=re.M)
+    if len(parts) != 2:
+        raise ValueError('When using --stdin, provide exactly two parts separated by a line containing only ---')
+    return parts[0].strip(), parts[1].strip()
+
+
+def memory_budget_bytes(args) -> int:
+    return int(args.memory_budget_mb * 1024 * 1024)
+
+
+def load_inputs(args):
+    if args.strings:
+        return args.strings[0], args.strings[1], 'strings'
+    if args.stdin:
         a, b = read_from_stdin_two_parts()
         return a, b, 'stdin'
     if args.files and len(args.files) == 2:
         f1, f2 = args.files
-        a = safe_read_file(f1)
-        b = safe_read_file(f2)
+        a = read_sql_file(f1, memory_budget_bytes(args))
+        b = read_sql_file(f2, memory_budget_bytes(args))
         return a, b, 'files'
     return None, None, None
 
 
+def result_keys_for(mode: str, ignore_ws: bool, *, check: bool = False,
+                    report_format: 'Optional[str]' = None) -> list:
+    """Result keys that the CLI output (or only the verdict, with check) and a report of report_format read."""
+    keys = [verdict_key(mode, ignore_ws)]
+    if not check or report_format:
+        keys += ['ws_equal', 'exact_equal', 'canonical_equal', 'summary']
+    shown = [('ws', ignore_ws), ('norm', mode in ('both', 'exact')), ('can', mode in ('both', 'canonical'))]
+    for form, on in shown:
+        if on and (not check or report_format == 'txt'):
+            keys.append(f'diff_{form}')
+        if on and report_format == 'html':
+            keys += [f'{form}_a', f'{form}_b']
+    return list(dict.fromkeys(keys))
+
+
+def compare_via_daemon(args, a: str, b: str) -> 'Optional[dict]':
+    """
+    Compare on the daemon at args.daemon, fetching only the keys the CLI will
+    read; None if it is unavailable. Streamed (PrenormalizedSQL) inputs are
+    never sent: the daemon would take their normalized text for raw SQL.
+    """
+    if isinstance(a, PrenormalizedSQL) or isinstance(b, PrenormalizedSQL):
+        return None
+    reply = daemon_call(args.daemon, '/compare', {
+        'a': a, 'b': b, 'mode': args.mode, 'ignore_ws': args.ignore_whitespace,
+        'enable_join_reorder': args.join_reorder,
+        'allow_full_outer': args.allow_full_outer_reorder, 'allow_left': args.allow_left_reorder,
+        'keys': result_keys_for(args.mode, args.ignore_whitespace, check=args.check,
+                                report_format=args.report_format if args.report else None),
+    })
+    return dict(reply['result'], tier=reply.get('tier')) if reply is not None else None
+
+
 def print_result_and_exit(result: dict, mode: str, ignore_ws: bool):
     print('=== SQL Compare ===')
     print(f"Whitespace-only equal: {'YES' if result['ws_equal'] else 'NO'}")
     print(f"Exact tokens equal   : {'YES' if result['exact_equal'] else 'NO'}")
     print(f"Canonical equal      : {'YES' if result['canonical_equal'] else 'NO'}")
+    tier = result.decide(mode, ignore_ws)[1] if isinstance(result, ComparisonResult) else result.get('tier')
+    if tier:
+        print(f'Decided at tier      : {tier}')
     print("\n-- Summary of differences --")
     for line in result['summary']:
         print(f'- {line}')
@@ -805,14 +2789,239 @@ def print_result_and_exit(result: dict, mode: str, ignore_ws: bool):
         print(result['diff_can'] if result['diff_can'] else '(no differences)')
         print()
 
-    if mode == 'exact':
-        success = (result['ws_equal'] if ignore_ws else result['exact_equal'])
+    sys.exit(0 if result_is_success(result, mode, ignore_ws) else 1)
+
+
+def print_fingerprints_and_exit(args):
+    """Print "<digest>  <name>" per input, like sha256sum; exit 2 if any input failed."""
+    if args.strings:
+        items = [('SQL1', args.strings[0]), ('SQL2', args.strings[1])]
+    elif args.stdin:
+        items = [('-', None)]
     else:
-        success = result['canonical_equal']
-    sys.exit(0 if success else 1)
+        items = [(f, None) for f in args.files]
+    if not items:
+        print('Provide files, --strings or --stdin to fingerprint.', file=sys.stderr)
+        sys.exit(2)
+    code = 0
+    for name, text in items:
+        try:
+            if text is None:
+                text = read_stdin_bounded() if name == '-' else read_sql_file(name, memory_budget_bytes(args))
+            flags = dict(enable_join_reorder=args.join_reorder,
+                         allow_full_outer=args.allow_full_outer_reorder, allow_left=args.allow_left_reorder)
+            reply = args.daemon and daemon_call(args.daemon, '/fingerprint',
+                                                dict(flags, sql=text, digest_size=args.digest_size))
+            digest = reply['fingerprint'] if reply else canonical_fingerprint(
+                text, digest_size=args.digest_size, **flags)
+        except (OSError, ValueError) as e:
+            print(f'[Fingerprint] {name}: {e}', file=sys.stderr)
+            code = 2
+            continue
+        print(f'{digest}  {name}')
+    sys.exit(code)
+
+
+def run_batch_and_exit(pairs, args):
+    """Print one line per pair (plus its summary when it differs) and exit with the aggregate code."""
+    report = None
+    if args.report and args.report_format != 'html':
+        print('--report with --batch/--manifest writes an HTML directory; --report-format txt is not supported.',
+              file=sys.stderr)
+        sys.exit(2)
+    if args.report:
+        try:
+            report = BatchReport(args.report)
+        except OSError as e:
+            print(f'[Report] Failed: {e}', file=sys.stderr)
+            sys.exit(2)
+    results = iter_batch_results(
+        pairs, mode=args.mode, ignore_ws=args.ignore_whitespace,
+        enable_join_reorder=args.join_reorder,
+        allow_full_outer=args.allow_full_outer_reorder,
+        allow_left=args.allow_left_reorder,
+        jobs=args.jobs or os.cpu_count() or 1, fail_fast=args.fail_fast,
+        cache_dir=args.cache_dir, cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+        memory_budget=memory_budget_bytes(args), report_dir=args.report)
+    if report is not None:
+        results = report.track(results)
+    print_verdicts_and_exit(results, args, total=len(pairs))
+
+
+def run_script_and_exit(args):
+    """Compare two scripts statement by statement, streaming both files."""
+    if len(args.files) != 2:
+        print('--script needs exactly two files.', file=sys.stderr)
+        sys.exit(2)
+    try:
+        with open(args.files[0], encoding='utf-8', errors='ignore') as fa, \
+                open(args.files[1], encoding='utf-8', errors='ignore') as fb:
+            if args.align:
+                print_alignment_and_exit(align_scripts(
+                    iter_statements(fa, go_separator=args.go), iter_statements(fb, go_separator=args.go),
+                    mode=args.mode, ignore_ws=args.ignore_whitespace,
+                    enable_join_reorder=args.join_reorder,
+                    allow_full_outer=args.allow_full_outer_reorder,
+                    allow_left=args.allow_left_reorder,
+                    jobs=args.jobs or os.cpu_count() or 1), args)
+            results = iter_script_results(
+                iter_statements(fa, go_separator=args.go), iter_statements(fb, go_separator=args.go),
+                mode=args.mode, ignore_ws=args.ignore_whitespace,
+                enable_join_reorder=args.join_reorder,
+                allow_full_outer=args.allow_full_outer_reorder,
+                allow_left=args.allow_left_reorder,
+                jobs=args.jobs or os.cpu_count() or 1, fail_fast=args.fail_fast)
+            print_verdicts_and_exit(results, args)
+    except OSError as e:
+        print(f'[Script] {e}', file=sys.stderr)
+        sys.exit(2)
+
+
+def print_alignment_and_exit(ops, args):
+    """Print one line per aligned statement and a tally; exit 0 only when every statement is unchanged."""
+    counts = Counter(op['op'] for op in ops)
+    if not args.check:
+        for op in ops:
+            detail = f" ({op['detail']})" if op['detail'] else ''
+            print(f"[{op['op'].upper()}] {op['label']}{detail}")
+            for line in op['summary']:
+                print(f'    - {line}')
+        print(f"=== {len(ops)} statements: " + ', '.join(
+            f'{counts[k]} {k}' for k in (SCRIPT_UNCHANGED, SCRIPT_MOVED, SCRIPT_MODIFIED, SCRIPT_ADDED, SCRIPT_REMOVED))
+            + ' ===')
+    sys.exit(0 if counts[SCRIPT_UNCHANGED] == len(ops) else 1)
+
+
+def print_verdicts_and_exit(results, args, total: 'Optional[int]' = None):
+    """Print batch-style verdict lines and a tally, then exit with batch_exit_code()."""
+    statuses = []
+    cache_hits = cache_misses = 0
+    for res in results:
+        statuses.append(res['status'])
+        cache_hits += res.get('cache_hits', 0)
+        cache_misses += res.get('cache_misses', 0)
+        if args.check:
+            continue
+        detail = f" ({res['detail']})" if res['detail'] else ''
+        print(f"[{res['status'].upper()}] {res['label']}{detail}")
+        for line in res['summary']:
+            print(f'    - {line}')
+    counts = Counter(statuses)
+    skipped = total - len(statuses) if total is not None else 0
+    if not args.check:
+        print(f"=== {len(statuses)} compared: {counts[BATCH_EQUAL]} equal, {counts[BATCH_DIFFERENT]} different, "
+              f"{counts[BATCH_MISSING]} missing, {counts[BATCH_ERROR]} errors"
+              + (f'; {skipped} skipped (fail-fast)' if skipped else '') + ' ===')
+        if args.cache_dir:
+            print(f'[Cache] {cache_hits} hits, {cache_misses} misses', file=sys.stderr)
+    sys.exit(batch_exit_code(statuses))
+
+
+def run_jsonl_and_exit(args):
+    """Stream JSONL records from stdin to JSON result lines on stdout; exit with batch_exit_code()."""
+    statuses = set()
+    for res in iter_jsonl_results(
+            sys.stdin, mode=args.mode, ignore_ws=args.ignore_whitespace,
+            enable_join_reorder=args.join_reorder,
+            allow_full_outer=args.allow_full_outer_reorder,
+            allow_left=args.allow_left_reorder,
+            jobs=args.jobs or os.cpu_count() or 1,
+            max_line_chars=memory_budget_bytes(args)):
+        statuses.add(res['status'])
+        sys.stdout.write(json.dumps(res, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+    sys.exit(batch_exit_code(statuses))
+
+
+def run_daemon_and_exit(args):
+    """Serve until interrupted."""
+    try:
+        daemon = CompareDaemon(args.serve, cache_dir=args.cache_dir, cache_max_bytes=args.cache_max_mb * 1024 * 1024)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f'[Daemon] {e}', file=sys.stderr)
+        sys.exit(2)
+    print(f'[Daemon] Listening on {daemon.addr}', file=sys.stderr)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server.server_close()
+    sys.exit(0)
+
+
+def run_cluster_and_exit(args):
+    """Print the equivalence classes and a canonical diff of each class against the largest; exit 0 if one class."""
+    try:
+        items = collect_cluster_inputs(args.files, pattern=args.pattern)
+    except (OSError, ValueError) as e:
+        print(f'[Cluster] {e}', file=sys.stderr)
+        sys.exit(2)
+    classes, errors = cluster_queries(
+        items, enable_join_reorder=args.join_reorder,
+        allow_full_outer=args.allow_full_outer_reorder,
+        allow_left=args.allow_left_reorder,
+        jobs=args.jobs or os.cpu_count() or 1, memory_budget=memory_budget_bytes(args))
+    if not args.check:
+        print(f'=== {len(items)} queries, {len(classes)} classes, {len(errors)} errors ===')
+        for n, cls in enumerate(classes, 1):
+            count = len(cls['members'])
+            print(f"[Class {n}] {count} member{'s' if count != 1 else ''}  {cls['fingerprint']}")
+            for label in cls['members']:
+                print(f'    {label}')
+        for label, message in errors:
+            print(f'[ERROR] {label} ({message})')
+        for n, cls in enumerate(classes[1:], 2):
+            print(f'\n---- Class {n} vs Class 1 (Canonicalized) ----')
+            print(_unified_diff(layout_sql(classes[0]['canonical']), layout_sql(cls['canonical']), 'class1(canon)', f'class{n}(canon)'))
+    sys.exit(2 if errors else (0 if len(classes) <= 1 else 1))
+
+
+REPORT_CSS = """\
+body { font-family: Segoe UI, Tahoma, Arial, sans-serif; margin: 16px; color: #111; }
+h1,h2 { margin: 12px 0; }
+table.diff { font-family: Consolas, monospace; font-size: 12px; border-collapse: collapse; width: 100%; }
+table.diff td, table.diff th { border: 1px solid #ddd; padding: 4px 6px; vertical-align: top; }
+table.diff thead th { background: #f6f8fa; }
+/* HtmlDiff cell classes */
+.diff_add { background: #e6ffed; color: #1a7f37; }   /* additions: green */
+.diff_sub { background: #ffeef0; color: #cf222e; }   /* deletions: red */
+.diff_chg { background: #fff5b1; color: #4d2d00; }   /* changes: amber */
+/* Line number cols */
+.diff_next, .diff_header { background: #f6f8fa; color: #57606a; }
+/* Batch index */
+table.index { border-collapse: collapse; width: 100%; font-size: 13px; }
+table.index td, table.index th { border: 1px solid #ddd; padding: 4px 6px; vertical-align: top; text-align: left; }
+table.index th { background: #f6f8fa; cursor: pointer; }
+.status-equal { color: #1a7f37; } .status-different { color: #cf222e; }
+.status-missing, .status-error { color: #9a6700; }
+"""
+
+REPORT_LEGEND = """
+    <div style="margin:8px 0;">
+      <strong>Legend:</strong>
+      <span style="background:#e6ffed;border:1px solid #34d058;padding:2px 6px;margin-left:6px;">Added</span>
+      <span style="background:#ffeef0;border:1px solid #d73a49;padding:2px 6px;margin-left:6px;">Removed</span>
+      <span style="background:#fff5b1;border:1px solid #d9c10c;padding:2px 6px;margin-left:6px;">Changed</span>
+    </div>
+    """
+
+
+def generate_report(result: dict, mode: str, fmt: str, out_path: str, ignore_ws: bool,
+                    profile: 'Optional[dict]' = None):
+    Path(out_path).write_text(render_report(result, mode, fmt, ignore_ws, profile), encoding='utf-8')
 
 
-def generate_report(result: dict, mode: str, fmt: str, out_path: str, ignore_ws: bool):
+@_profiled('render_report')
+def render_report(result: dict, mode: str, fmt: str, ignore_ws: bool, profile: 'Optional[dict]' = None,
+                  *, title: str = 'SQL Compare Report', index_href: 'Optional[str]' = None,
+                  stylesheet: 'Optional[str]' = None) -> str:
+    """
+    Return the text of a txt or html comparison report; profile
+    (StageProfiler.stats()) adds a stage table. For a page of a batch report,
+    index_href links back to the index (which carries the legend) and
+    stylesheet replaces the inline CSS.
+    """
     if fmt == 'txt':
         lines = []
         lines.append('=== SQL Compare Report ===')
@@ -836,20 +3045,28 @@ def generate_report(result: dict, mode: str, fmt: str, out_path: str, ignore_ws:
             lines.append('---- Unified Diff (Canonicalized) ----')
             lines.append(result['diff_can'] if result['diff_can'] else '(no differences)')
             lines.append('')
-        Path(out_path).write_text('\n'.join(lines), encoding='utf-8')
-        return
+        if profile:
+            lines.append('---- Profile ----')
+            lines.append(format_profile_table(profile))
+            lines.append('')
+        return '\n'.join(lines)
 
     # HTML (color-coded)
+    import difflib
+    import html as html_mod
     hd = difflib.HtmlDiff(wrapcolumn=120)
+    @_profiled('html_diff')
     def mk(title, a, b, fromname, toname):
-        table = hd.make_table(a.splitlines(), b.splitlines(),
+        table = hd.make_table(layout_sql(a).splitlines(), layout_sql(b).splitlines(),
                               fromdesc=html_mod.escape(fromname),
                               todesc=html_mod.escape(toname),
                               context=True, numlines=3)
         return f"<h2>{html_mod.escape(title)}</h2>\n{table}"
 
     sections = []
-    sections.append('<h1>SQL Compare Report</h1>')
+    if index_href:
+        sections.append(f'<p><a href="{html_mod.escape(index_href)}">&larr; Index</a></p>')
+    sections.append(f'<h1>{html_mod.escape(title)}</h1>')
     sections.append('<h2>Summary</h2>')
     sections.append('<ul>')
     sections.append(f"<li>Whitespace-only equal: <b>{'YES' if result['ws_equal'] else 'NO'}</b></li>")
@@ -862,14 +3079,8 @@ def generate_report(result: dict, mode: str, fmt: str, out_path: str, ignore_ws:
     <ul>
     """ + '\n'.join(f'<li>{html_mod.escape(line)}</li>' for line in result['summary']) + '</ul>')
 
-    sections.append("""
-    <div style="margin:8px 0;">
-      <strong>Legend:</strong>
-      <span style="background:#e6ffed;border:1px solid #34d058;padding:2px 6px;margin-left:6px;">Added</span>
-      <span style="background:#ffeef0;border:1px solid #d73a49;padding:2px 6px;margin-left:6px;">Removed</span>
-      <span style="background:#fff5b1;border:1px solid #d9c10c;padding:2px 6px;margin-left:6px;">Changed</span>
-    </div>
-    """)
+    if not index_href:
+        sections.append(REPORT_LEGEND)
 
     if ignore_ws:
         sections.append(mk('Whitespace-only Diff', result['ws_a'], result['ws_b'], 'sql1(ws)', 'sql2(ws)'))
@@ -877,32 +3088,371 @@ def generate_report(result: dict, mode: str, fmt: str, out_path: str, ignore_ws:
         sections.append(mk('Normalized Diff', result['norm_a'], result['norm_b'], 'sql1(norm)', 'sql2(norm)'))
     if mode in ('both', 'canonical'):
         sections.append(mk('Canonicalized Diff', result['can_a'], result['can_b'], 'sql1(canon)', 'sql2(canon)'))
+    if profile:
+        sections.append(f"<h2>Profile</h2>\n<pre>{html_mod.escape(format_profile_table(profile))}</pre>")
 
+    style = (f'<link rel="stylesheet" href="{html_mod.escape(stylesheet)}">' if stylesheet
+             else f'<style>\n{REPORT_CSS}</style>')
     html_out = f"""<!DOCTYPE html>
-<html><head><meta charset="utf-8"><title>SQL Compare Report</title>
-<style>
-body {{ font-family: Segoe UI, Tahoma, Arial, sans-serif; margin: 16px; color: #111; }}
-h1,h2 {{ margin: 12px 0; }}
-table.diff {{ font-family: Consolas, monospace; font-size: 12px; border-collapse: collapse; width: 100%; }}
-table.diff td, table.diff th {{ border: 1px solid #ddd; padding: 4px 6px; vertical-align: top; }}
-table.diff thead th {{ background: #f6f8fa; }}
-/* HtmlDiff cell classes */
-.diff_add {{ background: #e6ffed; color: #1a7f37; }}   /* additions: green */
-.diff_sub {{ background: #ffeef0; color: #cf222e; }}   /* deletions: red */
-.diff_chg {{ background: #fff5b1; color: #4d2d00; }}   /* changes: amber */
-/* Line number cols */
-.diff_next, .diff_header {{ background: #f6f8fa; color: #57606a; }}
-</style>
+<html><head><meta charset="utf-8"><title>{html_mod.escape(title)}</title>
+{style}
 </head><body>
 {''.join(sections)}
 </body></html>"""
-    Path(out_path).write_text(html_out, encoding='utf-8')
+    return html_out
+
+
+# =============================
+# Batch report
+# =============================
+
+_INDEX_SORT_JS = """
+document.querySelectorAll('table.index th').forEach(function (th, col) {
+  th.addEventListener('click', function () {
+    var body = th.closest('table').tBodies[0];
+    var asc = th.dataset.order !== 'asc';
+    th.dataset.order = asc ? 'asc' : 'desc';
+    var key = function (row) { var c = row.cells[col]; return c.dataset.sort !== undefined ? parseFloat(c.dataset.sort) : c.textContent; };
+    Array.from(body.rows).sort(function (a, b) {
+      var x = key(a), y = key(b);
+      return (x < y ? -1 : x > y ? 1 : 0) * (asc ? 1 : -1);
+    }).forEach(function (row) { body.appendChild(row); });
+  });
+});
+"""
+
+
+def batch_page_name(label: str) -> str:
+    """File name (under pairs/) of the detail page of a batch pair; stable and safe for any label."""
+    return hashlib.blake2b(label.encode('utf-8', 'surrogatepass'), digest_size=10).hexdigest() + '.html'
+
+
+def write_batch_page(result, label: str, mode: str, ignore_ws: bool, report_dir: str) -> str:
+    """Write the detail page of one differing pair into report_dir/pairs; returns its path relative to report_dir."""
+    rel = f'pairs/{batch_page_name(label)}'
+    page = render_report(result, mode, 'html', ignore_ws, title=label,
+                         index_href='../index.html', stylesheet='../report.css')
+    Path(report_dir, rel).write_text(page, encoding='utf-8')
+    return rel
+
+
+class BatchReport:
+    """
+    Directory report of a batch run: one detail page per differing pair under
+    pairs/ (rendered by the batch workers, see iter_batch_results(report_dir=...)),
+    then report.css and an index.html with a sortable table of verdicts, tiers,
+    summaries and timings. If the run aborts, the directories created for it
+    are removed again.
+    """
+
+    def __init__(self, out_dir: str, *, title: str = 'SQL Compare Batch Report'):
+        self.out_dir = Path(out_dir)
+        self.title = title
+        self.rows = []
+        pairs = self.out_dir / 'pairs'
+        missing = [p for p in (*reversed(pairs.parents), pairs) if not p.exists()]
+        self._created = missing[0] if missing else None
+        pairs.mkdir(parents=True, exist_ok=True)
+
+    def track(self, results):
+        """Yield results unchanged, recording them; the index is written once they are exhausted."""
+        try:
+            for res in results:
+                self.rows.append(res)
+                yield res
+        except BaseException:
+            self.discard()
+            raise
+        self.write_index()
+
+    def discard(self):
+        """Remove the directory created for an unfinished report (a pre-existing one is left alone)."""
+        if self._created is not None:
+            import shutil
+            shutil.rmtree(self._created, ignore_errors=True)
+
+    def write_index(self) -> Path:
+        import html as html_mod
+        counts = Counter(res['status'] for res in self.rows)
+        body = []
+        for n, res in enumerate(self.rows, 1):
+            label = html_mod.escape(str(res['label']))
+            if res.get('page'):
+                label = f'<a href="{html_mod.escape(res["page"])}">{label}</a>'
+            notes = [res['detail']] if res['detail'] else []
+            summary = '<br>'.join(html_mod.escape(line) for line in notes + list(res['summary']))
+            elapsed = res.get('elapsed_s', 0.0)
+            body.append(
+                f'<tr><td data-sort="{n}">{n}</td><td>{label}</td>'
+                f'<td class="status-{res["status"]}">{res["status"]}</td><td>{res.get("tier", "")}</td>'
+                f'<td>{summary}</td><td data-sort="{elapsed:.6f}">{elapsed * 1000:.1f}</td></tr>')
+        tally = ', '.join(f'{counts[s]} {s}' for s in (BATCH_EQUAL, BATCH_DIFFERENT, BATCH_MISSING, BATCH_ERROR))
+        page = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html_mod.escape(self.title)}</title>
+<link rel="stylesheet" href="report.css">
+</head><body>
+<h1>{html_mod.escape(self.title)}</h1>
+<p>{len(self.rows)} pairs: {tally}. Click a column header to sort.</p>
+{REPORT_LEGEND}
+<table class="index">
+<thead><tr><th>#</th><th>Pair</th><th>Status</th><th>Tier</th><th>Summary</th><th>Compare ms</th></tr></thead>
+<tbody>
+{chr(10).join(body)}
+</tbody></table>
+<script>{_INDEX_SORT_JS}</script>
+</body></html>"""
+        (self.out_dir / 'report.css').write_text(REPORT_CSS, encoding='utf-8')
+        path = self.out_dir / 'index.html'
+        path.write_text(page, encoding='utf-8')
+        return path
 
 
 # =============================
 # GUI
 # =============================
 
+class _GuiJob:
+    """
+    Base of the GUI's background jobs. Subclasses define run(), which start()
+    executes on a worker thread and which reports (kind, payload) tuples
+    through `events`, ending with exactly one of ('done', ...), ('error',
+    message) or ('cancelled', None). cancel() takes effect at the job's next
+    checkpoint; the Tk side polls `events` with root.after.
+    """
+
+    def __init__(self, *, mode: str = 'both', ignore_ws: bool = False,
+                 enable_join_reorder: bool = True, allow_full_outer: bool = False, allow_left: bool = False):
+        self.mode, self.ignore_ws = mode, ignore_ws
+        self.flags = dict(enable_join_reorder=enable_join_reorder,
+                          allow_full_outer=allow_full_outer, allow_left=allow_left)
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='sql-compare-gui', daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+
+class CompareJob(_GuiJob):
+    """
+    One file-pair comparison. Events, in order: ('progress', (label, done,
+    total)) before each step, ('verdicts', dict) as soon as the equality
+    verdicts are known, then ('done', result). Cancel is checked between steps.
+    """
+
+    def __init__(self, path_a: str, path_b: str, **options):
+        super().__init__(**options)
+        self.path_a, self.path_b = path_a, path_b
+
+    def steps(self) -> list:
+        """(label, result key) for every step after the verdicts, in display order."""
+        steps = [('Summarizing differences', 'summary')]
+        if self.ignore_ws:
+            steps.append(('Diffing whitespace-normalized SQL', 'diff_ws'))
+        if self.mode in ('both', 'exact'):
+            steps.append(('Diffing normalized SQL', 'diff_norm'))
+        if self.mode in ('both', 'canonical'):
+            steps.append(('Diffing canonicalized SQL', 'diff_can'))
+        return steps
+
+    def run(self):
+        steps = self.steps()
+        total = 3 + len(steps)
+        try:
+            texts = []
+            for n, path in enumerate((self.path_a, self.path_b)):
+                if self._stopped(f'Reading {os.path.basename(path)}', n, total):
+                    return
+                texts.append(read_sql_file(path))
+            if self._stopped('Comparing', 2, total):
+                return
+            result = compare_sql(texts[0], texts[1], ignore_ws=self.ignore_ws, **self.flags)
+            verdict, tier = result.decide(self.mode, self.ignore_ws)
+            verdicts = {key: result[key] for key in ('ws_equal', 'exact_equal', 'canonical_equal')}
+            self.events.put(('verdicts', dict(verdicts, verdict=verdict, tier=tier)))
+            for n, (label, key) in enumerate(steps, start=3):
+                if self._stopped(label, n, total):
+                    return
+                result[key]
+            self.events.put(('done', result))
+        except Exception as e:
+            self.events.put(('error', str(e)))
+
+    def _stopped(self, label: str, done: int, total: int) -> bool:
+        if self._cancel.is_set():
+            self.events.put(('cancelled', None))
+            return True
+        self.events.put(('progress', (label, done, total)))
+        return False
+
+
+class FolderJob(_GuiJob):
+    """
+    Folder-vs-folder comparison: files are paired by relative path
+    (pair_directories) and compared on a process pool (iter_batch_results).
+    Events: ('pairs', [(relpath, path_a, path_b), ...]) once, then
+    ('result', (index, result dict)) per pair in order, then ('done', counts by
+    status). Cancel is checked between results; pairs already submitted to the
+    pool still finish. The pool is spawned rather than forked: forking from a
+    thread of the Tk process could copy locks held by other threads.
+    """
+
+    def __init__(self, dir_a: str, dir_b: str, *, pattern: str = '*.sql', jobs: int = 0, **options):
+        super().__init__(**options)
+        self.dir_a, self.dir_b, self.pattern = dir_a, dir_b, pattern
+        self.jobs = jobs or os.cpu_count() or 1
+
+    def run(self):
+        try:
+            pairs = pair_directories(self.dir_a, self.dir_b, self.pattern)
+            self.events.put(('pairs', pairs))
+            counts = Counter()
+            import multiprocessing
+            results = iter_batch_results(pairs, mode=self.mode, ignore_ws=self.ignore_ws,
+                                         jobs=min(self.jobs, max(1, len(pairs))), timing=True,
+                                         mp_context=multiprocessing.get_context('spawn'), **self.flags)
+            try:
+                for n, res in enumerate(results):
+                    if self._cancel.is_set():
+                        self.events.put(('cancelled', None))
+                        return
+                    counts[res['status']] += 1
+                    self.events.put(('result', (n, res)))
+            finally:
+                results.close()
+            self.events.put(('done', dict(counts)))
+        except Exception as e:
+            self.events.put(('error', str(e)))
+
+
+GUI_PAGE_LINES = 500    # output rows inserted into the Text widget per page
+GUI_WINDOW_PAGES = 3    # pages held by the widget at once; the rest stay in the OutputModel
+
+_HUNK_REGEX = _LazyRegex('_HUNK_REGEX', r'@@ -(\d+)(?:,(\d+))? \+')
+
+# Unified diff -> the side-a text it was built from, for expanding folds.
+_DIFF_SOURCES = {'diff_ws': 'ws_a', 'diff_norm': 'norm_a', 'diff_can': 'can_a'}
+
+
+def _verdict_lines(result) -> list:
+    return [
+        '=== SQL Compare ===',
+        f"Whitespace-only equal: {'YES' if result['ws_equal'] else 'NO'}",
+        f"Exact tokens equal   : {'YES' if result['exact_equal'] else 'NO'}",
+        f"Canonical equal      : {'YES' if result['canonical_equal'] else 'NO'}",
+        '',
+    ]
+
+
+class OutputModel:
+    """
+    The GUI output of one comparison as a flat list of (text, tag, fold) rows.
+
+    The widget only ever holds a window of rows. The unchanged lines that
+    difflib leaves out between hunks become fold rows ("⋯ N unchanged lines ⋯",
+    fold = (diff key, lo, hi) over the laid-out side-a lines) that expand()
+    replaces in place. iter_text() streams the plain output straight from the
+    result, folds unexpanded, for copying.
+    """
+
+    def __init__(self, result, mode: str, ignore_ws: bool):
+        self.result = result
+        self.sections = []
+        if ignore_ws:
+            self.sections.append(('---- Unified Diff (Whitespace-only normalized) ----', 'diff_ws'))
+        if mode in ('both', 'exact'):
+            self.sections.append(('---- Unified Diff (Normalized) ----', 'diff_norm'))
+        if mode in ('both', 'canonical'):
+            self.sections.append(('---- Unified Diff (Canonicalized) ----', 'diff_can'))
+        self._sources = {}
+        self.rows = []
+        for part in self._head():
+            self.rows.append((part, 'header' if part.startswith(('===', '--')) else None, None))
+        for title, key in self.sections:
+            self.rows.append((title, 'header', None))
+            self._add_diff_rows(key)
+            self.rows.append(('', None, None))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _head(self) -> list:
+        lines = _verdict_lines(self.result)
+        lines.append('-- Summary of differences --')
+        lines.extend(f'- {line}' for line in self.result['summary'])
+        lines.append('')
+        return lines
+
+    def _add_diff_rows(self, key: str):
+        diff = self.result[key]
+        if not diff:
+            self.rows.append(('(no differences)', None, None))
+            return
+        seen = 0            # side-a lines covered by the rows so far
+        in_header = True    # the '---'/'+++' file lines before the first hunk
+        for line in diff.split('\n'):
+            m = _HUNK_REGEX.match(line)
+            if m:
+                start, length = int(m.group(1)), int(m.group(2) or 1)
+                first = start - 1 if length else start    # 0-based first side-a line of the hunk
+                if first > seen:
+                    self.rows.append(self._fold(key, seen, first))
+                seen = first + length
+                in_header = False
+                tag = 'hunk'
+            elif in_header:
+                tag = 'hunk'
+            else:
+                tag = {'+': 'add', '-': 'del', ' ': 'context'}.get(line[:1])
+            self.rows.append((line, tag, None))
+        if seen < len(self._side_a(key)):
+            self.rows.append(self._fold(key, seen, None))
+
+    def _side_a(self, key: str) -> list:
+        """The laid-out side-a lines a diff section was made from."""
+        if key not in self._sources:
+            self._sources[key] = layout_sql(self.result[_DIFF_SOURCES[key]]).splitlines()
+        return self._sources[key]
+
+    @staticmethod
+    def _fold(key: str, lo: int, hi: 'Optional[int]') -> tuple:
+        text = f'⋯ {hi - lo} unchanged lines ⋯' if hi is not None else '⋯ remaining unchanged lines ⋯'
+        return (text, 'fold', (key, lo, hi))
+
+    def window(self, start: int, stop: int) -> list:
+        return self.rows[start:stop]
+
+    def expand(self, index: int) -> bool:
+        """Replace the fold row at index by the lines it hides; False if it is not a fold row."""
+        text, tag, fold = self.rows[index]
+        if fold is None:
+            return False
+        key, lo, hi = fold
+        lines = self._side_a(key)[lo:hi]
+        self.rows[index:index + 1] = [(' ' + line, 'context', None) for line in lines]
+        return True
+
+    def iter_text(self):
+        """Yield the plain output (as rendered before folding) piece by piece."""
+        yield '\n'.join(self._head())
+        for title, key in self.sections:
+            yield '\n' + title + '\n'
+            yield self.result[key] or '(no differences)'
+            yield '\n'
+
+
 class SQLCompareGUI:
     def __init__(self, root):
         self.root = root
@@ -917,9 +3467,19 @@ class SQLCompareGUI:
         self.allow_full = tk.BooleanVar(value=False)
         self.allow_left = tk.BooleanVar(value=False)
 
-        self._create_widgets()
+        self.source = tk.StringVar(value='files')
+        self.pattern = tk.StringVar(value='*.sql')
+        self.status = tk.StringVar(value='')
 
         self.last_result = None  # cache for report generation
+        self.job = None          # running CompareJob, if any
+        self.folder_job = None   # running FolderJob, if any
+        self.folder_pairs = []   # (relpath, path_a, path_b) per folder row
+        self.model = None        # OutputModel behind the output pane
+        self.win_start = self.win_stop = 0
+        self._paging = False
+
+        self._create_widgets()
 
     def _create_widgets(self):
         pad = {'padx': 8, 'pady': 6}
@@ -929,19 +3489,31 @@ class SQLCompareGUI:
         self._create_flags_frame(pad)
         self._create_buttons_frame(pad)
         self._create_output_frame(pad)
+        self._create_folder_frame()
 
         ttk.Label(self.root, text='Tip: CLI supports --strings/--stdin, --mode, --ignore-whitespace, --join-reorder/--no-join-reorder, --allow-full-outer-reorder, --allow-left-reorder, and --report.').pack(anchor='w', padx=8, pady=4)
 
     def _create_top_frame(self, pad):
         frm_top = ttk.Frame(self.root)
         frm_top.pack(fill='x', **pad)
-        ttk.Label(frm_top, text='SQL File 1:').grid(row=0, column=0, sticky='w')
+        frm_source = ttk.Frame(frm_top)
+        frm_source.grid(row=0, column=0, columnspan=3, sticky='w', pady=(0, 4))
+        ttk.Label(frm_source, text='Compare:').pack(side='left')
+        for text, val in [('Files', 'files'), ('Folders', 'folders')]:
+            ttk.Radiobutton(frm_source, text=text, value=val, variable=self.source,
+                            command=self._toggle_source).pack(side='left', padx=6)
+        ttk.Label(frm_source, text='Pattern:').pack(side='left', padx=(16, 4))
+        self.ent_pattern = ttk.Entry(frm_source, textvariable=self.pattern, width=16)
+        self.ent_pattern.pack(side='left')
+        self.lbl1 = ttk.Label(frm_top, text='SQL File 1:')
+        self.lbl1.grid(row=1, column=0, sticky='w')
         e1 = ttk.Entry(frm_top, textvariable=self.sql1_path, width=90)
-        e1.grid(row=0, column=1, sticky='we', padx=(8, 8))
-        ttk.Button(frm_top, text='Browse...', command=self.browse1).grid(row=0, column=2)
-        ttk.Label(frm_top, text='SQL File 2:').grid(row=1, column=0, sticky='w')
-        e2 = ttk.Entry(frm_top, textvariable=self.sql2_path, width=90); e2.grid(row=1, column=1, sticky='we', padx=(8, 8))
-        ttk.Button(frm_top, text='Browse...', command=self.browse2).grid(row=1, column=2)
+        e1.grid(row=1, column=1, sticky='we', padx=(8, 8))
+        ttk.Button(frm_top, text='Browse...', command=self.browse1).grid(row=1, column=2)
+        self.lbl2 = ttk.Label(frm_top, text='SQL File 2:')
+        self.lbl2.grid(row=2, column=0, sticky='w')
+        e2 = ttk.Entry(frm_top, textvariable=self.sql2_path, width=90); e2.grid(row=2, column=1, sticky='we', padx=(8, 8))
+        ttk.Button(frm_top, text='Browse...', command=self.browse2).grid(row=2, column=2)
         frm_top.columnconfigure(1, weight=1)
 
     def _create_mode_frame(self, pad):
@@ -966,7 +3538,11 @@ class SQLCompareGUI:
     def _create_buttons_frame(self, pad):
         frm_btns = ttk.Frame(self.root)
         frm_btns.pack(fill='x', **pad)
-        ttk.Button(frm_btns, text='Compare', command=self.do_compare).pack(side='left')
+        self.btn_compare = ttk.Button(frm_btns, text='Compare', command=self.do_compare)
+        self.btn_compare.pack(side='left')
+        self.btn_cancel = ttk.Button(frm_btns, text='Cancel', command=self.cancel_compare)
+        self.btn_cancel.pack(side='left', padx=6)
+        self.btn_cancel.state(['disabled'])
         self.btn_copy = ttk.Button(frm_btns, text='Copy Output', command=self.copy_output)
         self.btn_copy.pack(side='left', padx=6)
         self.btn_copy.state(['disabled'])
@@ -976,14 +3552,20 @@ class SQLCompareGUI:
         self.btn_save = ttk.Button(frm_btns, text='Save Report…', command=self.save_report)
         self.btn_save.pack(side='left', padx=6)
         self.btn_save.state(['disabled'])
+        self.progress = ttk.Progressbar(frm_btns, mode='determinate', length=160)
+        self.progress.pack(side='left', padx=(16, 6))
+        ttk.Label(frm_btns, textvariable=self.status).pack(side='left')
 
     def _create_output_frame(self, pad):
-        frm_out = ttk.Frame(self.root)
-        frm_out.pack(fill='both', expand=True, **pad)
+        self.paned = ttk.Panedwindow(self.root, orient='vertical')
+        self.paned.pack(fill='both', expand=True, **pad)
+        frm_out = ttk.Frame(self.paned)
+        self.paned.add(frm_out, weight=3)
         self.txt = tk.Text(frm_out, wrap='none', font=('Consolas', 10))
         xscroll = ttk.Scrollbar(frm_out, orient='horizontal', command=self.txt.xview)
         yscroll = ttk.Scrollbar(frm_out, orient='vertical', command=self.txt.yview)
-        self.txt.configure(xscrollcommand=xscroll.set, yscrollcommand=yscroll.set)
+        self.yscroll = yscroll
+        self.txt.configure(xscrollcommand=xscroll.set, yscrollcommand=self._on_yscroll)
         self.txt.grid(row=0, column=0, sticky='nsew')
         yscroll.grid(row=0, column=1, sticky='ns')
         xscroll.grid(row=1, column=0, sticky='ew')
@@ -1019,8 +3601,49 @@ class SQLCompareGUI:
         self.txt.bind('<Tab>', _focus_next)
         self.txt.bind('<ISO_Left_Tab>', _focus_prev)
         self.txt.tag_configure('empty', foreground='gray', justify='center')
+        self.txt.tag_configure('header', font=('Consolas', 10, 'bold'))
+        self.txt.tag_configure('hunk', foreground='#4050a0')
+        self.txt.tag_configure('add', foreground='#1a7f37')
+        self.txt.tag_configure('del', foreground='#b42318')
+        self.txt.tag_configure('context', foreground='#555555')
+        self.txt.tag_configure('fold', foreground='gray', background='#f0f0f0')
+        self.txt.tag_bind('fold', '<Button-1>', self._expand_fold)
+        self.txt.tag_bind('fold', '<Enter>', lambda e: self.txt.configure(cursor='hand2'))
+        self.txt.tag_bind('fold', '<Leave>', lambda e: self.txt.configure(cursor=''))
         self.txt.insert('1.0', 'Select files and click Compare to see results here.', 'empty')
 
+    def _create_folder_frame(self):
+        # Folder-mode results; shown above the output pane only while folder mode is on.
+        self.frm_folder = ttk.Frame(self.paned)
+        columns = ('status', 'tier', 'time', 'detail')
+        self.tree = ttk.Treeview(self.frm_folder, columns=columns, height=10)
+        for col, text, width in [('#0', 'File', 360), ('status', 'Status', 90), ('tier', 'Tier', 90),
+                                 ('time', 'Time', 90), ('detail', 'Detail', 260)]:
+            self.tree.heading(col, text=text, anchor='w')
+            self.tree.column(col, width=width, stretch=col in ('#0', 'detail'))
+        yscroll = ttk.Scrollbar(self.frm_folder, orient='vertical', command=self.tree.yview)
+        self.tree.configure(yscrollcommand=yscroll.set)
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        yscroll.grid(row=0, column=1, sticky='ns')
+        self.frm_folder.rowconfigure(0, weight=1); self.frm_folder.columnconfigure(0, weight=1)
+        self.tree.tag_configure(BATCH_EQUAL, foreground='#1a7f37')
+        self.tree.tag_configure(BATCH_DIFFERENT, foreground='#b42318')
+        self.tree.tag_configure(BATCH_MISSING, foreground='gray')
+        self.tree.tag_configure(BATCH_ERROR, foreground='#b54708')
+        self.tree.bind('<Double-1>', self._open_pair)
+        self._toggle_source()
+
+    def _toggle_source(self):
+        folders = self.source.get() == 'folders'
+        self.lbl1.configure(text='Folder 1:' if folders else 'SQL File 1:')
+        self.lbl2.configure(text='Folder 2:' if folders else 'SQL File 2:')
+        self.ent_pattern.state(['!disabled'] if folders else ['disabled'])
+        shown = str(self.frm_folder) in map(str, self.paned.panes())
+        if folders and not shown:
+            self.paned.insert(0, self.frm_folder, weight=2)
+        elif not folders and shown:
+            self.paned.forget(self.frm_folder)
+
     def _toggle_join_options(self):
         # Enable/disable dependent flags based on global join toggle
         if self.enable_join.get():
@@ -1031,16 +3654,25 @@ class SQLCompareGUI:
             self.chk_left.state(['disabled'])
 
     def browse1(self):
-        path = filedialog.askopenfilename(title='Select SQL File 1',
-                                          filetypes=[('SQL files', '*.sql *.txt'), ('All files', '*.*')])
+        if self.source.get() == 'folders':
+            path = filedialog.askdirectory(title='Select Folder 1')
+        else:
+            path = filedialog.askopenfilename(title='Select SQL File 1',
+                                              filetypes=[('SQL files', '*.sql *.txt'), ('All files', '*.*')])
         if path: self.sql1_path.set(path)
 
     def browse2(self):
-        path = filedialog.askopenfilename(title='Select SQL File 2',
-                                          filetypes=[('SQL files', '*.sql *.txt'), ('All files', '*.*')])
+        if self.source.get() == 'folders':
+            path = filedialog.askdirectory(title='Select Folder 2')
+        else:
+            path = filedialog.askopenfilename(title='Select SQL File 2',
+                                              filetypes=[('SQL files', '*.sql *.txt'), ('All files', '*.*')])
         if path: self.sql2_path.set(path)
 
     def clear_output(self):
+        if self.job is not None:
+            self.job.cancel()
+        self.model = None
         self.txt.delete('1.0', 'end')
         self.txt.insert('1.0', 'Select files and click Compare to see results here.', 'empty')
         self.btn_copy.state(['disabled'])
@@ -1050,58 +3682,216 @@ class SQLCompareGUI:
 
     def copy_output(self):
         try:
-            content = self.txt.get('1.0', 'end-1c')
-            self.root.clipboard_clear(); self.root.clipboard_append(content)
+            self.root.clipboard_clear()
+            if self.model is None:
+                self.root.clipboard_append(self.txt.get('1.0', 'end-1c'))
+            else:
+                for piece in self.model.iter_text():
+                    self.root.clipboard_append(piece)
             messagebox.showinfo('Copied', 'Output copied to clipboard.')
         except Exception as e:
             messagebox.showerror('Error', f'Failed to copy: {e}')
 
+    def _job_options(self) -> dict:
+        return dict(mode=self.mode.get(), ignore_ws=self.ignore_ws.get(),
+                    enable_join_reorder=self.enable_join.get(),
+                    allow_full_outer=self.allow_full.get(), allow_left=self.allow_left.get())
+
+    def _update_buttons(self):
+        running = self.job is not None or self.folder_job is not None
+        self.btn_compare.state(['disabled'] if running else ['!disabled'])
+        self.btn_cancel.state(['!disabled'] if running else ['disabled'])
+
     def do_compare(self):
         p1 = self.sql1_path.get().strip(); p2 = self.sql2_path.get().strip()
+        if self.source.get() == 'folders':
+            self.do_compare_folders(p1, p2); return
         if not p1 or not p2:
             messagebox.showwarning('Missing files', 'Please select both SQL files.'); return
         if not os.path.exists(p1) or not os.path.exists(p2):
             messagebox.showerror('File error', 'One or both files do not exist.'); return
-        try:
-            a = safe_read_file(p1)
-            b = safe_read_file(p2)
-            result = compare_sql(
-                a, b,
-                ignore_ws=self.ignore_ws.get(),
-                enable_join_reorder=self.enable_join.get(),
-                allow_full_outer=self.allow_full.get(),
-                allow_left=self.allow_left.get()
-            )
-            self.last_result = result
-            self.render_result(result, self.mode.get(), self.ignore_ws.get())
-        except Exception as e:
-            messagebox.showerror('Error', str(e))
+        self._start_compare(p1, p2)
 
-    def render_result(self, result: dict, mode: str, ignore_ws: bool):
+    def _start_compare(self, p1: str, p2: str):
+        if self.job is not None:
+            self.job.cancel()
+        self.job = CompareJob(p1, p2, **self._job_options()).start()
+        self.last_result = None
+        self._update_buttons()
+        self.btn_save.state(['disabled'])
+        self.progress.configure(value=0, maximum=1)
+        self.status.set('Starting…')
+        self.root.after(50, self._poll_job, self.job)
+
+    def cancel_compare(self):
+        jobs = [job for job in (self.job, self.folder_job) if job is not None]
+        for job in jobs:
+            job.cancel()
+        if jobs:
+            self.btn_cancel.state(['disabled'])
+            self.status.set('Cancelling…')
+
+    def do_compare_folders(self, d1: str, d2: str):
+        if not d1 or not d2:
+            messagebox.showwarning('Missing folders', 'Please select both folders.'); return
+        if not os.path.isdir(d1) or not os.path.isdir(d2):
+            messagebox.showerror('Folder error', 'One or both folders do not exist.'); return
+        if self.folder_job is not None:
+            self.folder_job.cancel()
+        self.tree.delete(*self.tree.get_children())
+        self.folder_pairs = []
+        self.folder_job = FolderJob(d1, d2, pattern=self.pattern.get().strip() or '*.sql',
+                                    **self._job_options()).start()
+        self._update_buttons()
+        self.progress.configure(value=0, maximum=1)
+        self.status.set('Pairing files…')
+        self.root.after(50, self._poll_folder_job, self.folder_job)
+
+    def _poll_folder_job(self, job):
+        if job is not self.folder_job:
+            return
+        while True:
+            try:
+                kind, payload = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'pairs':
+                self.folder_pairs = payload
+                for n, (rel, _, _) in enumerate(payload):
+                    self.tree.insert('', 'end', iid=str(n), text=rel, values=('…', '', '', ''))
+                self.progress.configure(value=0, maximum=max(1, len(payload)))
+                self.status.set(f'Comparing {len(payload):,} pairs…')
+            elif kind == 'result':
+                n, res = payload
+                elapsed = f"{res['elapsed_s'] * 1000:.1f} ms" if 'elapsed_s' in res else ''
+                self.tree.item(str(n), values=(res['status'], res.get('tier', ''), elapsed, res['detail']),
+                               tags=(res['status'],))
+                self.progress.configure(value=n + 1)
+            else:
+                self._finish_folder_job(kind, payload)
+                return
+        self.root.after(50, self._poll_folder_job, job)
+
+    def _finish_folder_job(self, kind, payload):
+        self.folder_job = None
+        self._update_buttons()
+        self.progress.configure(value=0)
+        if kind == 'done':
+            counts = ', '.join(f'{payload[status]} {status}' for status in
+                               (BATCH_EQUAL, BATCH_DIFFERENT, BATCH_MISSING, BATCH_ERROR) if payload.get(status))
+            self.status.set(f'{len(self.folder_pairs):,} pairs: {counts or "none found"}.')
+        elif kind == 'cancelled':
+            self.status.set('Cancelled.')
+        else:
+            self.status.set('Failed.')
+            messagebox.showerror('Error', payload)
+
+    def _open_pair(self, event):
+        # Double-click on a folder row: show that pair in the single-pair view below.
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return
+        rel, path_a, path_b = self.folder_pairs[int(iid)]
+        if path_a is None or path_b is None:
+            messagebox.showinfo('Missing file', f"{rel} exists only in Folder {1 if path_b is None else 2}."); return
+        self._start_compare(path_a, path_b)
+
+    def _poll_job(self, job):
+        # Runs on the Tk thread; a replaced or finished job stops polling.
+        if job is not self.job:
+            return
+        while True:
+            try:
+                kind, payload = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                label, done, total = payload
+                self.progress.configure(value=done, maximum=total)
+                self.status.set(f'{label}…')
+            elif kind == 'verdicts':
+                if not job.cancelled:
+                    self.render_verdicts(payload)
+            else:
+                self._finish_job(kind, payload)
+                return
+        self.root.after(50, self._poll_job, job)
+
+    def _finish_job(self, kind, payload):
+        self.job = None
+        self._update_buttons()
+        self.progress.configure(value=0)
+        if kind == 'done':
+            self.status.set('')
+            self.last_result = payload
+            self.render_result(payload, self.mode.get(), self.ignore_ws.get())
+        elif kind == 'cancelled':
+            self.status.set('Cancelled.')
+        else:
+            self.status.set('Failed.')
+            messagebox.showerror('Error', payload)
+
+    def render_verdicts(self, verdicts: dict):
+        # Shown while the summary and diffs are still being computed.
+        self.model = None
         self.txt.delete('1.0', 'end')
+        self.btn_clear.state(['!disabled'])
+        lines = _verdict_lines(verdicts)
+        lines.append('(computing summary and diffs…)')
+        self.txt.insert('1.0', "\n".join(lines))
+
+    def render_result(self, result: dict, mode: str, ignore_ws: bool):
         self.btn_copy.state(['!disabled'])
         self.btn_clear.state(['!disabled'])
         self.btn_save.state(['!disabled'])
-        lines = []
-        lines.append('=== SQL Compare ===')
-        lines.append(f"Whitespace-only equal: {'YES' if result['ws_equal'] else 'NO'}")
-        lines.append(f"Exact tokens equal   : {'YES' if result['exact_equal'] else 'NO'}")
-        lines.append(f"Canonical equal      : {'YES' if result['canonical_equal'] else 'NO'}")
-        lines.append('')
-        lines.append('-- Summary of differences --')
-        for line in result['summary']:
-            lines.append(f'- {line}')
-        lines.append('')
-        if ignore_ws:
-            lines.append('---- Unified Diff (Whitespace-only normalized) ----')
-            lines.append(result['diff_ws'] if result['diff_ws'] else '(no differences)'); lines.append('')
-        if mode in ('both', 'exact'):
-            lines.append('---- Unified Diff (Normalized) ----')
-            lines.append(result['diff_norm'] if result['diff_norm'] else '(no differences)'); lines.append('')
-        if mode in ('both', 'canonical'):
-            lines.append('---- Unified Diff (Canonicalized) ----')
-            lines.append(result['diff_can'] if result['diff_can'] else '(no differences)'); lines.append('')
-        self.txt.insert('1.0', "\n".join(lines))
+        self.model = OutputModel(result, mode, ignore_ws)
+        self._show_window(0, 0)
+
+    def _show_window(self, start: int, top: int):
+        # Fill the widget with rows [start, start + window) and scroll model row top to the top.
+        model = self.model
+        size = GUI_PAGE_LINES * GUI_WINDOW_PAGES
+        start = max(0, min(start, len(model) - size))
+        stop = min(len(model), start + size)
+        chunks = []
+        for text, tag, _ in model.window(start, stop):
+            chunks += [text + '\n', tag or ()]
+        self.txt.delete('1.0', 'end')
+        self.txt.insert('end', *chunks)
+        self.txt.delete('end-2c')    # the last row's newline
+        self.win_start, self.win_stop = start, stop
+        self.txt.yview(f'{top - start + 1}.0')
+        if stop - start < len(model):
+            self.status.set(f'Rows {start + 1:,}–{stop:,} of {len(model):,}')
+
+    def _on_yscroll(self, first, last):
+        self.yscroll.set(first, last)
+        if self.model is not None and not self._paging and (
+                (float(last) > 0.9 and self.win_stop < len(self.model)) or
+                (float(first) < 0.1 and self.win_start > 0)):
+            self._paging = True
+            self.root.after_idle(self._page)
+
+    def _page(self):
+        # Slide the window by one page toward the edge being scrolled to.
+        self._paging = False
+        if self.model is None:
+            return
+        top = self.win_start + int(self.txt.index('@0,0').split('.')[0]) - 1
+        first, last = self.txt.yview()
+        if last > 0.9 and self.win_stop < len(self.model):
+            self._show_window(self.win_start + GUI_PAGE_LINES, top)
+        elif first < 0.1 and self.win_start > 0:
+            self._show_window(self.win_start - GUI_PAGE_LINES, top)
+
+    def _expand_fold(self, event):
+        if self.model is None:
+            return
+        line = int(self.txt.index(f'@{event.x},{event.y}').split('.')[0])
+        row = self.win_start + line - 1
+        top = self.win_start + int(self.txt.index('@0,0').split('.')[0]) - 1
+        if self.model.expand(row):
+            self._show_window(self.win_start, top)
 
     def save_report(self):
         if not self.last_result:
@@ -1125,8 +3915,10 @@ class SQLCompareGUI:
 
 def maybe_launch_gui(args_parsed) -> bool:
     """Return True if GUI launched and program should exit afterward."""
-    if (args_parsed.files is None or len(args_parsed.files) == 0) and not args_parsed.strings and not args_parsed.stdin:
-        if not TK_AVAILABLE:
+    if ((args_parsed.files is None or len(args_parsed.files) == 0) and not args_parsed.strings and not args_parsed.stdin
+            and not args_parsed.batch and not args_parsed.manifest and not args_parsed.fingerprint
+            and not args_parsed.cluster and not args_parsed.jsonl and not args_parsed.serve):
+        if not _load_tk():
             print('Tkinter is not available. Provide CLI inputs, or install Python with Tk support.', file=sys.stderr)
             sys.exit(2)
         root = tk.Tk()
@@ -1136,27 +3928,95 @@ def maybe_launch_gui(args_parsed) -> bool:
     return False
 
 
+def profile_and_exit(args, a: str, b: str):
+    """Compare in-process under a StageProfiler, then print (and optionally save) the stage table before the usual output."""
+    with StageProfiler(memory=True) as profiler:
+        result = compare_sql(
+            a, b,
+            ignore_ws=args.ignore_whitespace,
+            enable_join_reorder=args.join_reorder,
+            allow_full_outer=args.allow_full_outer_reorder,
+            allow_left=args.allow_left_reorder,
+        )
+        for key in result_keys_for(args.mode, args.ignore_whitespace, check=args.check,
+                                   report_format=args.report_format if args.report else None):
+            result[key]
+        report = None
+        if args.report:
+            try:
+                report = render_report(result, args.mode, args.report_format, args.ignore_whitespace, profiler.stats())
+            except Exception as e:
+                print(f'[Report] Failed: {e}', file=sys.stderr)
+                sys.exit(2)
+    stats = profiler.stats()
+    print(format_profile_table(stats), file=sys.stderr)
+    try:
+        if args.profile:
+            Path(args.profile).write_text(json.dumps({'stages': stats}, indent=2) + '\n', encoding='utf-8')
+        if report is not None:
+            Path(args.report).write_text(report, encoding='utf-8')
+            if not args.check:
+                print(f'[Report] Saved to: {args.report}')
+    except OSError as e:
+        print(f'[Profile] Failed: {e}', file=sys.stderr)
+        sys.exit(2)
+    if args.check:
+        sys.exit(0 if result_is_success(result, args.mode, args.ignore_whitespace) else 1)
+    print_result_and_exit(result, args.mode, args.ignore_whitespace)
+
+
 def main(argv=None):
     args = parse_args(argv or sys.argv[1:])
     if maybe_launch_gui(args): return
+    if args.serve:
+        run_daemon_and_exit(args)
+    if args.fingerprint:
+        print_fingerprints_and_exit(args)
+    if args.jsonl:
+        run_jsonl_and_exit(args)
+    if args.cluster:
+        run_cluster_and_exit(args)
+    if args.script:
+        run_script_and_exit(args)
+    if args.batch or args.manifest:
+        try:
+            pairs = pair_directories(*args.batch, pattern=args.pattern) if args.batch else read_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            print(f'[Batch] {e}', file=sys.stderr)
+            sys.exit(2)
+        run_batch_and_exit(pairs, args)
     a, b, src = load_inputs(args)
     if a is None or b is None:
         print('Provide two files, or --strings, or --stdin; or run with no args to open the GUI.', file=sys.stderr)
         sys.exit(2)
-    result = compare_sql(
-        a, b,
-        ignore_ws=args.ignore_whitespace,
-        enable_join_reorder=args.join_reorder,
-        allow_full_outer=args.allow_full_outer_reorder,
-        allow_left=args.allow_left_reorder
-    )
+    if args.profile is not None:
+        profile_and_exit(args, a, b)
+    result = compare_via_daemon(args, a, b) if args.daemon else None
+    if result is None:
+        cache = None
+        if args.cache_dir:
+            try:
+                cache = open_canonical_cache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+            except Exception as e:
+                print(f'[Cache] Disabled: {e}', file=sys.stderr)
+        result = compare_sql(
+            a, b,
+            ignore_ws=args.ignore_whitespace,
+            enable_join_reorder=args.join_reorder,
+            allow_full_outer=args.allow_full_outer_reorder,
+            allow_left=args.allow_left_reorder,
+            cache=cache,
+        )
     if args.report:
         try:
             generate_report(result, args.mode, args.report_format, args.report, args.ignore_whitespace)
-            print(f'[Report] Saved to: {args.report}')
+            if not args.check:
+                print(f'[Report] Saved to: {args.report}')
         except Exception as e:
             print(f'[Report] Failed: {e}', file=sys.stderr)
             sys.exit(2)
+    if args.check:
+        sys.exit(0 if result_is_success(result, args.mode, args.ignore_whitespace) else 1)
     print_result_and_exit(result, args.mode, args.ignore_whitespace)
 
 
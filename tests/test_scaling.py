@@ -0,0 +1,103 @@
+import io
+import time
+import unittest
+
+from sql_compare import (
+    configure_memo, structural_index, StructuralIndex,
+    normalize_sql, tokenize, lex_sql, strip_sql_comments, uppercase_outside_quotes,
+    split_top_level, top_level_find_kw, clause_end_index, canonicalize_common,
+    _parse_from_clause_body, iter_statements, token_change_counts, layout_sql,
+)
+
+
+# Adversarial input families; each maps n to a text that grows linearly in n.
+INPUTS = {
+    'unclosed_quote': lambda n: "SELECT a FROM t WHERE x = 'abc" + 'x y, ' * n,
+    'unclosed_identifier': lambda n: 'SELECT "abc' + 'x y, ' * n + ' [q' + 'z ' * n,
+    'unclosed_comment': lambda n: 'SELECT 1 /*' + 'x y; ' * n,
+    'escaped_quotes': lambda n: 'SELECT ' + "'a''b', " * n + ' FROM t',
+    'comment_markers': lambda n: 'SELECT ' + '-/ ' * n + ' FROM t',
+    'nested_parens': lambda n: '(' * n + 'SELECT a, b FROM t WHERE x = 1 AND y = 2' + ')' * n,
+    'open_parens': lambda n: 'SELECT a FROM t WHERE ' + '(' * n + 'x',
+    'keyword_dense': lambda n: 'SELECT a FROM t WHERE ' + 'x AND FROM JOIN ON WHERE SELECT ' * n,
+    'and_terms': lambda n: 'SELECT a FROM t WHERE ' + ' AND '.join(f"c{i} = 'v,w'" for i in range(n)),
+    'select_list': lambda n: 'SELECT ' + ', '.join(f"f(c{i}, 'a,b')" for i in range(n)) + ' FROM t',
+    'join_chain': lambda n: 'SELECT a FROM t ' + ' '.join(f'JOIN t{i} ON t{i}.a = t.a' for i in range(n)),
+    'subqueries': lambda n: 'SELECT a FROM t WHERE ' + ' AND '.join(
+        f'(x{i} IN (SELECT b FROM u JOIN v ON u.a = v.a WHERE c = {i}))' for i in range(n)),
+    'statements': lambda n: "select 'a;b' from t; " * n,
+}
+
+# Stages under test; each takes the raw text.
+STAGES = {
+    'normalize_sql': normalize_sql,
+    'tokenize': tokenize,
+    'lex_sql': lambda s: list(lex_sql(s)),
+    'strip_sql_comments': strip_sql_comments,
+    'uppercase_outside_quotes': uppercase_outside_quotes,
+    'StructuralIndex': StructuralIndex,
+    'split_top_level': lambda s: split_top_level(s, ','),
+    'top_level_find_kw': lambda s: top_level_find_kw(s, 'WHERE', len(s) // 2),
+    'clause_end_index': lambda s: clause_end_index(s, len(s) // 3),
+    'canonicalize_common': lambda s: canonicalize_common(normalize_sql(s)),
+    '_parse_from_clause_body': _parse_from_clause_body,
+    'iter_statements': lambda s: list(iter_statements(io.StringIO(s), chunk_size=256)),
+    'layout_sql': layout_sql,
+    'token_change_counts': lambda s: token_change_counts(
+        tokenize(s), tokenize(s[:len(s) // 3] + ' x, y ' + s[len(s) // 2:]), algorithm='myers'),
+}
+
+
+class TestNearLinearScaling(unittest.TestCase):
+    """
+    Run every stage on every adversarial input at sizes N, 2N, 4N and 8N and
+    require near-linear growth: an O(N^2) path or a backtracking regex makes
+    the 8N run ~64 times slower than the N run, linear code ~8 times.
+    """
+
+    MIN_BASE_S = 0.001     # N is doubled until the N run takes at least this long
+    MAX_N = 1 << 16
+    MAX_RATIO = 24         # allowed t(8N) / t(N)
+    REPEAT = 3
+
+    def setUp(self):
+        configure_memo(enabled=False)
+        self.addCleanup(configure_memo, enabled=True)
+
+    def _best_time(self, fn, text) -> float:
+        best = float('inf')
+        for _ in range(self.REPEAT):
+            structural_index.cache_clear()
+            start = time.perf_counter()
+            fn(text)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def _growth(self, fn, make) -> tuple:
+        n = 64
+        while n < self.MAX_N and self._best_time(fn, make(n)) < self.MIN_BASE_S:
+            n *= 2
+        times = [self._best_time(fn, make(n * k)) for k in (1, 2, 4, 8)]
+        return n, times
+
+    def test_stages_scale_near_linearly(self):
+        for input_name, make in INPUTS.items():
+            for stage_name, fn in STAGES.items():
+                with self.subTest(input=input_name, stage=stage_name):
+                    n, times = self._growth(fn, make)
+                    if times[3] / times[0] > self.MAX_RATIO:
+                        n, times = self._growth(fn, make)   # one retry absorbs timer noise
+                    self.assertLess(times[3] / times[0], self.MAX_RATIO,
+                                    f'N={n}: ' + ', '.join(f'{t * 1000:.2f} ms' for t in times))
+
+    def test_harness_catches_quadratic_code(self):
+        def quadratic(s):
+            out = ''
+            for ch in s[:len(s) // 4]:
+                out = ch + out
+        _, times = self._growth(quadratic, INPUTS['and_terms'])
+        self.assertGreater(times[3] / times[0], self.MAX_RATIO)
+
+
+if __name__ == '__main__':
+    unittest.main()
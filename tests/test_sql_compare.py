@@ -1,17 +1,35 @@
 import unittest
+import json
 import argparse
+import os
 import shutil
 import subprocess
+import sys
 import textwrap
+import time
 from pathlib import Path
 from unittest.mock import patch
 from sql_compare import (
+    CanonicalCache, configure_memo, memo_stats,
+    canonical_fingerprint, canonical_flags_key,
     _extract_base_table,
     canonicalize_joins, clause_end_index, tokenize,
     strip_sql_comments, uppercase_outside_quotes,
     top_level_find_kw, collapse_whitespace,
     _tokenize_from_clause_body, split_top_level,
     canonicalize_select_list,
+    lex_sql, normalize_sql, normalize_and_tokenize,
+    TokenTable, token_ids, layout_sql,
+    StructuralIndex, remove_outer_parentheses,
+    pair_directories, read_manifest, iter_batch_results, batch_exit_code, main,
+    collect_cluster_inputs, cluster_queries, iter_jsonl_results,
+    iter_statements, iter_script_results, align_scripts,
+    compare_sql,
+    normalize_sql_file, read_sql_file, PrenormalizedSQL, ws_only_normalize, ws_only_normalize_file,
+    CompareDaemon, daemon_call, _Coalescer,
+    StageProfiler, render_report, batch_page_name, BatchReport,
+    token_change_counts, build_difference_summary, _myers_matches,
+    CompareJob, FolderJob, OutputModel,
 )
 
 
@@ -385,11 +403,9 @@ class TestTokenize(unittest.TestCase):
              "SELECT 'string', E'string2', \"col 1\", E\"esc\"",
              ['SELECT', "'string'", ',', 'E', "'string2'", ',', '"col 1"', ',', 'E"esc"']),
 
-            # Note: 'it''s' is parsed as 'it', 's' by the regex currently.
-            # This test ensures no unexpected regressions.
             ("Strings with escaped single quotes",
              "SELECT 'it''s'",
-             ['SELECT', "'it'", "'s'"]),
+             ['SELECT', "'it''s'"]),
 
             ("Bracketed and backticked identifiers",
              "SELECT [my table], `my col`",
@@ -419,6 +435,152 @@ class TestTokenize(unittest.TestCase):
                 self.assertEqual(tokenize(sql), expected)
 
 
+class TestLexSql(unittest.TestCase):
+    def test_tokens_cover_input_with_offsets(self):
+        sql = "select a->>'k', [x y] /* c */ from t -- tail\nwhere b <= 2.5;"
+        tokens = list(lex_sql(sql))
+        self.assertEqual(''.join(t.text for t in tokens), sql)
+        for tok in tokens:
+            self.assertEqual(sql[tok.start:tok.end], tok.text)
+        kinds = {t.text: t.kind for t in tokens}
+        self.assertEqual(kinds["'k'"], 'STRING')
+        self.assertEqual(kinds['[x y]'], 'QIDENT')
+        self.assertEqual(kinds['/* c */'], 'COMMENT')
+        self.assertEqual(kinds['-- tail'], 'COMMENT')
+        self.assertEqual(kinds['<='], 'OP')
+        self.assertEqual(kinds['->'], 'OP')
+        self.assertEqual(kinds['2.5'], 'NUMBER')
+        self.assertEqual(kinds['select'], 'WORD')
+
+    def test_comment_markers_without_comments(self):
+        kinds = [t.kind for t in lex_sql('a -- b', comments=False) if t.kind != 'WS']
+        self.assertEqual(kinds, ['WORD', 'OP', 'OP', 'WORD'])
+
+
+class TestNormalizeSql(unittest.TestCase):
+    def test_normalize_scenarios(self):
+        test_cases = [
+            ("comments, case and whitespace",
+             "select  a, -- x\n 'Mixed  Case' /* y */ from t ;",
+             "SELECT A, 'Mixed Case' FROM T"),
+            ("comment glues adjacent text", "select a/**/b", "SELECT AB"),
+            ("wrapping parentheses", " ((select (1)) ) ", "SELECT (1)"),
+            ("parentheses that do not wrap", "(a) + (b)", "(A) + (B)"),
+            ("quoted markers kept", "select '--x', \"/*y*/\"", "SELECT '--x', \"/*y*/\""),
+            ("unclosed quote", "select 'abc;", "SELECT 'abc"),
+        ]
+        for description, sql, expected in test_cases:
+            with self.subTest(description=description):
+                self.assertEqual(normalize_sql(sql), expected)
+
+    def test_normalize_and_tokenize_matches_tokenize(self):
+        sql = "select e\"x\", 'it''s', [a] from (t) where x<>1 -- c"
+        norm, tokens = normalize_and_tokenize(sql)
+        self.assertEqual(norm, normalize_sql(sql))
+        self.assertEqual(tokens, tokenize(norm))
+        self.assertEqual(tokens[1], 'E"x"')
+
+
+class TestTokenInterning(unittest.TestCase):
+    def test_keywords_and_operators_have_fixed_ids(self):
+        first, second = TokenTable(), TokenTable()
+        second.intern(['x', 'y'])
+        for tok in ('SELECT', 'FROM', 'WHERE', 'AND', ',', '(', '<>'):
+            self.assertEqual(first.intern([tok]), second.intern([tok]))
+        self.assertEqual(first.intern(['y']), second.intern(['x']))
+
+    def test_ids_round_trip_to_tokens(self):
+        sql = normalize_sql("select a, 'it''s', [b c] from t where x <> 1")
+        table = TokenTable()
+        ids = token_ids(sql, table)
+        self.assertEqual(ids.typecode, 'I')
+        self.assertEqual(table.texts(ids), tokenize(sql))
+        self.assertEqual(token_ids(sql, table), ids)
+        self.assertEqual(table.intern(iter(tokenize(sql))), ids)   # any iterable, also on the slow path
+        fresh = table.intern(t for t in ('A', 'NEW'))
+        self.assertEqual(fresh, table.intern(['A', 'NEW']))
+        self.assertEqual(table.texts(fresh), ['A', 'NEW'])
+
+    def test_tables_stay_bounded_over_a_long_stream(self):
+        import io
+        baseline = len(TokenTable())
+        lines = [json.dumps({'id': i, 'a': f"select c{i} from t{i} where x = 'v{i}'",
+                             'b': f"select c{i} from t{i} where x = 'w{i}'"}) for i in range(2000)]
+        tables = []
+        with patch('sql_compare.TokenTable', side_effect=lambda: tables.append(TokenTable()) or tables[-1]):
+            for line in iter_jsonl_results(io.StringIO('\n'.join(lines))):
+                self.assertEqual(line['status'], 'different')
+        self.assertEqual(len(tables), 2000)
+        self.assertLessEqual(max(len(t) for t in tables) - baseline, 6)
+
+    def test_comparison_uses_ids_and_keeps_token_lists(self):
+        result = compare_sql('select a from t', 'SELECT  a FROM t -- c')
+        self.assertTrue(result['exact_equal'])
+        self.assertNotIn('tokens_a', result.computed())
+        self.assertEqual(result['tokens_a'], ['SELECT', 'A', 'FROM', 'T'])
+        self.assertFalse(compare_sql('select a from t', 'select b from t')['exact_equal'])
+
+
+class TestLayoutSql(unittest.TestCase):
+    def test_clause_item_and_join_per_line(self):
+        sql = normalize_sql('select a, b from t join u on t.x = u.x left join v on v.y = t.y '
+                            'where p = 1 and q between 1 and 2 and (r = 1 or s = 2) order by a, b')
+        self.assertEqual(layout_sql(sql).splitlines(), [
+            'SELECT A,', '  B', 'FROM T', '  JOIN U ON T.X = U.X', '  LEFT JOIN V ON V.Y = T.Y',
+            'WHERE P = 1', '  AND Q BETWEEN 1 AND 2', '  AND (R = 1 OR S = 2)', 'ORDER BY A,', '  B'])
+
+    def test_subqueries_indent_by_depth(self):
+        sql = 'SELECT A FROM (SELECT B FROM T WHERE X IN (SELECT Y FROM U)) S'
+        self.assertEqual(layout_sql(sql).splitlines(), [
+            'SELECT A', 'FROM (', '  SELECT B', '  FROM T', '  WHERE X IN (',
+            '    SELECT Y', '    FROM U', '  )', ') S'])
+
+    def test_only_line_breaks_are_added(self):
+        for sql in ("SELECT COALESCE(A,0), 'x, y AND z' FROM T WHERE A IN (" + ', '.join(map(str, range(50))) + ')',
+                    "select a -- c, d\nfrom t where x = 1 and y = 2", '', '(((', ')) SELECT'):
+            with self.subTest(sql=sql):
+                self.assertEqual(''.join(layout_sql(sql).split()), ''.join(sql.split()))
+        self.assertIn("'x, y AND z'", layout_sql("SELECT A, 'x, y AND z' FROM T"))
+
+    def test_diff_is_local_to_the_change(self):
+        terms = [f'C{i} = {i}' for i in range(500)]
+        a = 'SELECT A FROM T WHERE ' + ' AND '.join(terms)
+        terms[250] = 'C250 = 0'
+        result = compare_sql(a, 'SELECT A FROM T WHERE ' + ' AND '.join(terms))
+        changed = [line for line in result['diff_norm'].splitlines() if line[:1] in '+-' and line[:3] not in ('+++', '---')]
+        self.assertEqual(changed, ['-  AND C250 = 250', '+  AND C250 = 0'])
+
+
+class TestStructuralIndex(unittest.TestCase):
+    def test_depth_quotes_and_matching_parens(self):
+        text = "a (b ')' [(] c) (d"
+        idx = StructuralIndex(text)
+        self.assertTrue(idx.is_top_level(0))
+        self.assertFalse(idx.is_top_level(text.index('b')))
+        self.assertFalse(idx.is_top_level(text.index("')'") + 1))
+        self.assertEqual(idx.closing(2), text.index(' c)') + 2)
+        self.assertEqual(idx.closing(text.rindex('(')), -1)
+        self.assertFalse(idx.is_top_level(len(text) - 1))
+
+    def test_unbalanced_close_does_not_go_negative(self):
+        idx = StructuralIndex("a) b (c")
+        self.assertTrue(idx.is_top_level(3))
+        self.assertFalse(idx.is_top_level(6))
+
+    def test_remove_outer_parentheses(self):
+        test_cases = [
+            ("single layer", "(SELECT 1)", "SELECT 1"),
+            ("nested layers with spaces", " ( (SELECT 1) ) ", "SELECT 1"),
+            ("sibling groups kept", "(a) + (b)", "(a) + (b)"),
+            ("paren inside quotes", "('(' )", "'('"),
+            ("unbalanced", "((a)", "((a)"),
+            ("deep nesting", "(" * 5000 + "x" + ")" * 5000, "x"),
+        ]
+        for description, sql, expected in test_cases:
+            with self.subTest(description=description):
+                self.assertEqual(remove_outer_parentheses(sql), expected)
+
+
 class TestClauseEndIndex(unittest.TestCase):
     def test_no_terminators(self):
         """Should return length of string if no terminators found."""
@@ -867,5 +1029,950 @@ class TestCanonicalizeSelectList(unittest.TestCase):
         self.assertEqual(canonicalize_select_list("SELECT a, b WHERE x=1"), "SELECT a, b WHERE x=1")
 
 
+class TestBatchCompare(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.dir_a = self.tmp / 'a'; self.dir_b = self.tmp / 'b'
+        files = {
+            ('a', 'same.sql'): 'select a, b from t', ('b', 'same.sql'): 'SELECT b, a FROM t',
+            ('a', 'sub/diff.sql'): 'select 1', ('b', 'sub/diff.sql'): 'select 2',
+            ('a', 'only_a.sql'): 'select 3',
+        }
+        for (side, rel), text in files.items():
+            path = self.tmp / side / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text, encoding='utf-8')
+
+    def test_pair_directories_by_relative_path(self):
+        pairs = pair_directories(str(self.dir_a), str(self.dir_b))
+        self.assertEqual([p[0] for p in pairs], ['only_a.sql', 'same.sql', 'sub/diff.sql'])
+        self.assertIsNone(pairs[0][2])
+
+    def test_results_in_input_order_with_pool(self):
+        pairs = pair_directories(str(self.dir_a), str(self.dir_b))
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                statuses = [r['status'] for r in iter_batch_results(pairs, jobs=jobs)]
+                self.assertEqual(statuses, ['missing', 'equal', 'different'])
+                self.assertEqual(batch_exit_code(statuses), 1)
+
+    def test_fail_fast_stops_at_first_difference(self):
+        pairs = pair_directories(str(self.dir_a), str(self.dir_b))[1:]
+        results = list(iter_batch_results(pairs, fail_fast=True))
+        self.assertEqual([r['status'] for r in results], ['equal', 'different'])
+        results = list(iter_batch_results(list(reversed(pairs)), fail_fast=True))
+        self.assertEqual([r['status'] for r in results], ['different'])
+
+    def test_manifest_and_exit_codes(self):
+        manifest = self.tmp / 'pairs.txt'
+        manifest.write_text('# pairs\na/same.sql\tb/same.sql\na/nope.sql b/same.sql\n', encoding='utf-8')
+        pairs = read_manifest(str(manifest))
+        statuses = [r['status'] for r in iter_batch_results(pairs)]
+        self.assertEqual(statuses, ['equal', 'error'])
+        self.assertEqual(batch_exit_code(statuses), 2)
+        self.assertEqual(batch_exit_code(['equal', 'equal']), 0)
+
+    def test_report_directory_with_index_and_detail_pages(self):
+        out = self.tmp / 'report'
+        with patch('builtins.print'):
+            with self.assertRaises(SystemExit) as cm:
+                main(['--batch', str(self.dir_a), str(self.dir_b), '--report', str(out), '--jobs', '2'])
+        self.assertEqual(cm.exception.code, 1)
+        self.assertTrue((out / 'report.css').is_file())
+        pages = list((out / 'pairs').iterdir())
+        self.assertEqual([p.name for p in pages], [batch_page_name('sub/diff.sql')])
+        page = pages[0].read_text(encoding='utf-8')
+        self.assertIn('href="../report.css"', page)
+        self.assertNotIn('<style>', page)
+        index = (out / 'index.html').read_text(encoding='utf-8')
+        self.assertEqual(index.count('<tr><td'), 3)
+        self.assertIn(f'href="pairs/{pages[0].name}"', index)
+        self.assertIn('1 equal, 1 different, 1 missing, 0 error', index)
+
+    def test_batch_report_rejects_txt_format(self):
+        out = self.tmp / 'report'
+        with patch('sys.stderr'):
+            with self.assertRaises(SystemExit) as cm:
+                main(['--batch', str(self.dir_a), str(self.dir_b), '--report', str(out), '--report-format', 'txt'])
+        self.assertEqual(cm.exception.code, 2)
+        self.assertFalse(out.exists())
+
+    def test_aborted_batch_leaves_no_report_directory(self):
+        out = self.tmp / 'report'
+        pairs = pair_directories(str(self.dir_a), str(self.dir_b))
+        report = BatchReport(str(out))
+        results = report.track(iter_batch_results(pairs, report_dir=str(out)))
+        next(results)
+        with self.assertRaises(KeyboardInterrupt):
+            results.throw(KeyboardInterrupt)
+        self.assertFalse(out.exists())
+
+    def test_cli_batch_exit_code(self):
+        with patch('builtins.print'):
+            with self.assertRaises(SystemExit) as cm:
+                main(['--batch', str(self.dir_a), str(self.dir_b), '--fail-fast'])
+        self.assertEqual(cm.exception.code, 1)
+
+
+class TestLazyComparisonResult(unittest.TestCase):
+    def test_only_requested_entries_are_computed(self):
+        result = compare_sql('select a, b from t', 'SELECT b, a FROM t')
+        self.assertEqual(result.computed(), [])
+        self.assertFalse(result['ws_equal'])
+        self.assertNotIn('norm_a', result.computed())
+        self.assertTrue(result['canonical_equal'])
+        self.assertNotIn('diff_can', result.computed())
+        self.assertNotIn('summary', result.computed())
+
+    def test_behaves_like_the_former_dict(self):
+        result = compare_sql('select 1', 'select 2')
+        self.assertIn('diff_norm', result)
+        self.assertNotIn('nope', result)
+        as_dict = dict(result)
+        self.assertEqual(len(as_dict), 15)
+        self.assertIn('+SELECT 2', as_dict['diff_norm'])
+        self.assertTrue(as_dict['summary'])
+        with self.assertRaises(KeyError):
+            result['nope']
+
+    def test_cascade_stops_at_the_cheapest_deciding_tier(self):
+        cases = [
+            ('select a from t', 'select a from t', 'both', False, True, 'raw', []),
+            ('select a  from t', 'select a\nfrom t', 'both', False, True, 'whitespace', ['norm_a', 'can_a']),
+            ("select 'a' from t", "select 'b' from t", 'both', False, False, 'canonical', ['summary']),
+            ('select a from t', 'SELECT a FROM t', 'exact', True, False, 'whitespace', ['norm_a']),
+            ('select a from t', 'SELECT a FROM t', 'exact', False, True, 'exact', ['can_a']),
+            ('select a from t -- x', 'SELECT a FROM t', 'both', False, True, 'exact', ['can_a']),
+            ('select a, b from t', 'select b, a from t', 'canonical', False, True, 'canonical', ['summary']),
+        ]
+        for a, b, mode, ignore_ws, equal, tier, skipped in cases:
+            with self.subTest(a=a, b=b, mode=mode, ignore_ws=ignore_ws):
+                result = compare_sql(a, b)
+                self.assertEqual(result.decide(mode, ignore_ws), (equal, tier))
+                for key in skipped:
+                    self.assertNotIn(key, result.computed())
+                for key in ('ws_equal', 'exact_equal', 'canonical_equal'):
+                    self.assertEqual(result[key], dict(compare_sql(a, b))[key])
+
+    def test_cli_check_prints_nothing(self):
+        for sqls, code in ((['select a,b from t', 'select b,a from t'], 0), (['select 1', 'select 2'], 1)):
+            with self.subTest(code=code):
+                with patch('builtins.print') as mock_print:
+                    with self.assertRaises(SystemExit) as cm:
+                        main(['--strings', *sqls, '--check'])
+                self.assertEqual(cm.exception.code, code)
+                mock_print.assert_not_called()
+
+
+class TestCompareJob(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        (self.tmp / 'a.sql').write_text('select a, b from t where x = 1', encoding='utf-8')
+        (self.tmp / 'b.sql').write_text('SELECT b, a FROM t WHERE x = 2', encoding='utf-8')
+
+    def _events(self, job) -> list:
+        events = []
+        while not job.events.empty():
+            events.append(job.events.get_nowait())
+        return events
+
+    def test_verdicts_arrive_before_the_diffs(self):
+        job = CompareJob(str(self.tmp / 'a.sql'), str(self.tmp / 'b.sql'), mode='canonical').start()
+        job._thread.join(10)
+        events = self._events(job)
+        kinds = [kind for kind, _ in events]
+        self.assertEqual(kinds[-1], 'done')
+        self.assertEqual(kinds.count('verdicts'), 1)
+        verdicts = events[kinds.index('verdicts')][1]
+        self.assertEqual((verdicts['canonical_equal'], verdicts['verdict'], verdicts['tier']), (False, False, 'canonical'))
+        labels = [payload[0] for kind, payload in events if kind == 'progress']
+        self.assertLess(kinds.index('verdicts'), kinds.index('progress', kinds.index('verdicts')))
+        self.assertIn('Diffing canonicalized SQL', labels)
+        self.assertNotIn('Diffing normalized SQL', labels)
+        self.assertIn('diff_can', events[-1][1].computed())
+
+    def test_cancel_stops_between_steps(self):
+        job = CompareJob(str(self.tmp / 'a.sql'), str(self.tmp / 'b.sql'))
+        job.cancel()
+        job.run()
+        self.assertEqual(self._events(job), [('cancelled', None)])
+
+    def test_errors_are_reported_as_events(self):
+        job = CompareJob(str(self.tmp / 'a.sql'), str(self.tmp / 'missing.sql'))
+        job.run()
+        kind, message = self._events(job)[-1]
+        self.assertEqual(kind, 'error')
+        self.assertTrue(message)
+
+    def test_folder_job_fills_rows_in_order(self):
+        for side, files in (('d1', {'x.sql': 'select a, b from t', 'sub/y.sql': 'select 1', 'only1.sql': 'select 3'}),
+                            ('d2', {'x.sql': 'SELECT b, a FROM t', 'sub/y.sql': 'select 2'})):
+            for rel, text in files.items():
+                (self.tmp / side / rel).parent.mkdir(parents=True, exist_ok=True)
+                (self.tmp / side / rel).write_text(text, encoding='utf-8')
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                job = FolderJob(str(self.tmp / 'd1'), str(self.tmp / 'd2'), jobs=jobs, mode='canonical')
+                job.run()
+                events = self._events(job)
+                self.assertEqual(events[0], ('pairs', [
+                    ('only1.sql', str(self.tmp / 'd1' / 'only1.sql'), None),
+                    ('sub/y.sql', str(self.tmp / 'd1' / 'sub' / 'y.sql'), str(self.tmp / 'd2' / 'sub' / 'y.sql')),
+                    ('x.sql', str(self.tmp / 'd1' / 'x.sql'), str(self.tmp / 'd2' / 'x.sql')),
+                ]))
+                rows = [payload for kind, payload in events if kind == 'result']
+                self.assertEqual([(n, res['status'], res.get('tier')) for n, res in rows],
+                                 [(0, 'missing', None), (1, 'different', 'canonical'), (2, 'equal', 'canonical')])
+                self.assertIn('elapsed_s', rows[2][1])
+                self.assertEqual(events[-1], ('done', {'missing': 1, 'different': 1, 'equal': 1}))
+
+    def test_folder_job_spawns_its_pool(self):
+        for side in ('d1', 'd2'):
+            (self.tmp / side).mkdir()
+            (self.tmp / side / 'x.sql').write_text('select 1', encoding='utf-8')
+        with patch('sql_compare.iter_batch_results', wraps=iter_batch_results) as spy:
+            FolderJob(str(self.tmp / 'd1'), str(self.tmp / 'd2'), jobs=2).run()
+        self.assertEqual(spy.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+
+
+class TestOutputModel(unittest.TestCase):
+    def setUp(self):
+        a = 'SELECT ' + ', '.join(f'c{i}' for i in range(60)) + ' FROM t WHERE x = 1'
+        self.result = compare_sql(a, a.replace('c30', 'z30').replace('c5,', 'z5,'))
+
+    def test_copy_text_matches_the_plain_output(self):
+        r = self.result
+        lines = ['=== SQL Compare ===', 'Whitespace-only equal: NO', 'Exact tokens equal   : NO',
+                 'Canonical equal      : NO', '', '-- Summary of differences --']
+        lines += [f'- {line}' for line in r['summary']] + ['']
+        lines += ['---- Unified Diff (Normalized) ----', r['diff_norm'], '']
+        lines += ['---- Unified Diff (Canonicalized) ----', r['diff_can'], '']
+        self.assertEqual(''.join(OutputModel(r, 'both', False).iter_text()), '\n'.join(lines))
+
+    def test_expanding_every_fold_restores_side_a(self):
+        model = OutputModel(self.result, 'exact', False)
+        self.assertIn('⋯ 18 unchanged lines ⋯', [text for text, _, _ in model.rows])
+        folds = [i for i, (_, _, fold) in enumerate(model.rows) if fold]
+        for index in reversed(folds):
+            self.assertTrue(model.expand(index))
+        self.assertFalse(model.expand(0))
+        side_a = [text[1:] for text, tag, _ in model.rows if tag in ('context', 'del')]
+        self.assertEqual(side_a, layout_sql(self.result['norm_a']).splitlines())
+
+    def test_trailing_fold_only_when_lines_remain(self):
+        a = 'SELECT ' + ', '.join(f'c{i}' for i in range(20)) + ' FROM t'
+        for b, trailing in ((a.replace('c0,', 'z0,'), True), (a.replace('FROM t', 'FROM u'), False)):
+            with self.subTest(trailing=trailing):
+                rows = OutputModel(compare_sql(a, b), 'exact', False).rows
+                folds = [fold for _, _, fold in rows if fold]
+                self.assertEqual(any(fold[2] is None for fold in folds), trailing)
+
+    def test_removed_comment_lines_are_not_headers(self):
+        result = compare_sql('-- old note\nselect a from t', '-- new note\nselect a from t')
+        rows = OutputModel(result, 'exact', True).rows
+        tags = {text: tag for text, tag, _ in rows}
+        self.assertEqual(tags['--- sql1(ws)'], 'hunk')
+        self.assertEqual(tags['--- old note select a from t'], 'del')
+        self.assertEqual(tags['+-- new note select a from t'], 'add')
+
+    def test_sections_without_differences(self):
+        result = compare_sql('select a, b from t', 'select b, a from t')
+        rows = OutputModel(result, 'canonical', True).rows
+        texts = [text for text, _, _ in rows]
+        self.assertEqual(texts.count('(no differences)'), 1)
+        self.assertIn('---- Unified Diff (Whitespace-only normalized) ----', texts)
+        self.assertNotIn('---- Unified Diff (Normalized) ----', texts)
+
+
+class TestCanonicalFingerprint(unittest.TestCase):
+    def test_equal_canonical_forms_share_a_digest(self):
+        cases = [
+            ('select a, b from t', 'SELECT b , A FROM T;'),
+            ('select * from t join b on t.id = b.id join a on t.id = a.id',
+             'SELECT * FROM t JOIN a ON t.id = a.id JOIN b ON t.id = b.id'),
+        ]
+        for a, b in cases:
+            with self.subTest(a=a):
+                self.assertEqual(canonical_fingerprint(a), canonical_fingerprint(b))
+        self.assertNotEqual(canonical_fingerprint('select a from t'), canonical_fingerprint('select b from t'))
+
+    def test_flags_are_part_of_the_key(self):
+        sql = 'select * from t left join b on t.id = b.id join a on t.id = a.id'
+        self.assertEqual(canonical_flags_key(enable_join_reorder=False), 'j0')
+        self.assertEqual(canonical_flags_key(False, True, True), 'j0')
+        self.assertNotEqual(canonical_fingerprint(sql), canonical_fingerprint(sql, enable_join_reorder=False))
+        self.assertNotEqual(canonical_fingerprint(sql), canonical_fingerprint(sql, allow_left=True))
+
+    def test_digest_size(self):
+        self.assertEqual(len(canonical_fingerprint('select 1')), 32)
+        self.assertEqual(len(canonical_fingerprint('select 1', digest_size=8)), 16)
+
+    def test_stable_across_processes(self):
+        root = Path(__file__).resolve().parents[1]
+        code = 'import sql_compare; print(sql_compare.canonical_fingerprint("select b, a from t"))'
+        for seed in ('1', '2'):
+            with self.subTest(seed=seed):
+                out = subprocess.run(
+                    [sys.executable, '-c', code], cwd=root, capture_output=True, text=True,
+                    env={**os.environ, 'PYTHONHASHSEED': seed}, check=True,
+                ).stdout.strip()
+                self.assertEqual(out, canonical_fingerprint('select b, a from t'))
+
+
+class TestStartup(unittest.TestCase):
+    DEFERRED = ('tkinter', 'difflib', 'html', 'argparse', 'sqlite3', 'concurrent.futures')
+    # Import time of sql_compare (bytecode compilation included) relative to the
+    # interpreter's own startup imports, so the budget does not depend on machine speed.
+    BUDGET_RATIO = 25
+
+    def importtime(self, *args, top_level: bool = False):
+        root = Path(__file__).resolve().parents[1]
+        err = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=root,
+                             capture_output=True, text=True).stderr
+        rows = [line.split('|') for line in err.splitlines() if line.startswith('import time:')]
+        return {name.strip(): int(cumulative) for _, cumulative, name in rows[1:]
+                if not top_level or not name.startswith('  ')}
+
+    def test_library_import_is_lean(self):
+        times = self.importtime('-c', 'import sql_compare')
+        for name in self.DEFERRED:
+            self.assertNotIn(name, times)
+        baseline = min(sum(self.importtime('-c', 'pass', top_level=True).values()) for _ in range(3))
+        cost = min([times['sql_compare']] + [self.importtime('-c', 'import sql_compare')['sql_compare'] for _ in range(2)])
+        self.assertLess(cost, self.BUDGET_RATIO * baseline)
+
+    def test_verdict_only_cli_skips_diff_and_gui(self):
+        times = self.importtime('sql_compare.py', '--check', '--mode', 'exact', '--strings', 'select 1', 'SELECT 1')
+        for name in ('tkinter', 'difflib', 'html', 'sqlite3', 'concurrent.futures'):
+            self.assertNotIn(name, times)
+
+    def test_lazy_patterns_compile_on_first_use(self):
+        import re
+        import sql_compare
+        self.assertEqual(tokenize('select 1'), ['select', '1'])
+        self.assertIsInstance(sql_compare.TOKEN_REGEX, re.Pattern)
+
+
+class TestBenchmarks(unittest.TestCase):
+    SCRIPT = Path(__file__).resolve().parents[1] / 'benchmarks' / 'bench_sql_compare.py'
+
+    def test_generator_is_deterministic(self):
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('bench_sql_compare', self.SCRIPT)
+        bench = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(bench)
+        for name in bench.WORKLOADS:
+            with self.subTest(workload=name):
+                a, b = bench.generate(name, scale=0.01)
+                self.assertEqual((a, b), bench.generate(name, scale=0.01))
+                self.assertNotEqual(a, b)
+
+    def test_results_file_covers_every_stage(self):
+        import json
+        import tempfile
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        subprocess.run([sys.executable, str(self.SCRIPT), '--scale', '0.002', '--repeat', '1',
+                        '--output', str(tmp / 'out.json')], capture_output=True, check=True)
+        doc = json.loads((tmp / 'out.json').read_text(encoding='utf-8'))
+        stages = {(r['workload'], r['stage']) for r in doc['results']}
+        self.assertEqual(len(stages), 7 * 5)
+        self.assertTrue(all(r['best_s'] >= 0 for r in doc['results']))
+
+
+class TestStageProfiler(unittest.TestCase):
+    A = 'select a, b from t join u on t.x = u.x where p = 1 and q = 2'
+    B = 'SELECT b, a FROM t JOIN u ON t.x = u.x WHERE q = 2 AND p = 1'
+
+    def setUp(self):
+        configure_memo(enabled=False)
+        self.addCleanup(configure_memo, enabled=True)
+
+    def test_records_calls_chars_and_peak_per_stage(self):
+        with StageProfiler(memory=True) as profiler:
+            result = compare_sql(self.A, self.B)
+            self.assertTrue(result['canonical_equal'])
+        stats = profiler.stats()
+        self.assertEqual(stats['normalize_sql']['calls'], 2)
+        self.assertEqual(stats['normalize_sql']['chars'], len(self.A) + len(self.B))
+        self.assertEqual(stats['canonicalize_common']['calls'], 2)
+        self.assertGreater(stats['canonicalize_common']['peak_bytes'], 0)
+        self.assertTrue(all(st['wall_s'] >= 0 for st in stats.values()))
+        self.assertIn('canonicalize_common', profiler.format_table())
+
+    def test_inactive_profiler_records_nothing(self):
+        profiler = StageProfiler()
+        compare_sql(self.A, self.B)['summary']
+        self.assertEqual(profiler.stats(), {})
+        with profiler:
+            pass
+        compare_sql(self.A, self.B)['summary']
+        self.assertEqual(profiler.stats(), {})
+
+    def test_report_embeds_profile(self):
+        with StageProfiler() as profiler:
+            result = compare_sql(self.A, self.B)
+            result['summary']
+        for fmt in ('txt', 'html'):
+            with self.subTest(fmt=fmt):
+                text = render_report(result, 'both', fmt, False, profiler.stats())
+                self.assertIn('Profile', text)
+                self.assertIn('build_difference_summary', text)
+
+    def test_cli_writes_json_profile(self):
+        import io
+        import json
+        import tempfile
+        from contextlib import redirect_stderr, redirect_stdout
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        err = io.StringIO()
+        with redirect_stdout(io.StringIO()), redirect_stderr(err), self.assertRaises(SystemExit) as cm:
+            main(['--strings', self.A, self.B, '--profile', str(tmp / 'profile.json'),
+                  '--report', str(tmp / 'r.txt'), '--report-format', 'txt'])
+        self.assertEqual(cm.exception.code, 0)
+        stages = json.loads((tmp / 'profile.json').read_text(encoding='utf-8'))['stages']
+        self.assertEqual(stages['token_ids']['calls'], 2)
+        self.assertIn('Peak KiB', err.getvalue())
+        self.assertIn('---- Profile ----', (tmp / 'r.txt').read_text(encoding='utf-8'))
+
+
+class TestTokenChangeCounts(unittest.TestCase):
+    @staticmethod
+    def lcs(a, b):
+        prev = [0] * (len(b) + 1)
+        for x in a:
+            cur = [0]
+            for j, y in enumerate(b):
+                cur.append(prev[j] + 1 if x == y else max(prev[j + 1], cur[j]))
+            prev = cur
+        return prev[-1]
+
+    def test_myers_edit_script_is_minimal(self):
+        import random
+        rnd = random.Random(7)
+        for _ in range(300):
+            a = [rnd.choice('abcd') for _ in range(rnd.randint(0, 20))]
+            b = [rnd.choice('abcd') for _ in range(rnd.randint(0, 20))]
+            matches, exact = _myers_matches(a, b, 10 ** 9)
+            self.assertTrue(exact)
+            pi = pj = 0
+            for i, j, size in matches:
+                self.assertTrue(i >= pi and j >= pj)
+                self.assertEqual(a[i:i + size], b[j:j + size])
+                pi, pj = i + size, j + size
+            self.assertEqual(sum(size for _, _, size in matches), self.lcs(a, b))
+
+    def test_algorithms_agree_on_typical_edits(self):
+        a = tokenize(normalize_sql('select a, b, c from t join u on t.id = u.id where x = 1 and y in (1, 2, 3)'))
+        b = tokenize(normalize_sql('select a, b, c, d from t join u on t.id = u.id where x = 2 and y in (1, 3)'))
+        expected = token_change_counts(a, b, algorithm='sequencematcher')
+        self.assertEqual(token_change_counts(a, b, algorithm='myers'), expected)
+        big_a, big_b = a * 400, a * 400
+        big_b[5000:5001] = ['X', 'Y']
+        self.assertEqual(token_change_counts(big_a, big_b), (0, 0, 2, True))
+
+    def test_budget_falls_back_to_an_upper_bound(self):
+        import random
+        rnd = random.Random(3)
+        a = [f'c{i}' for i in range(2000)]
+        b = a[:]
+        rnd.shuffle(b)
+        exact = token_change_counts(a, b, algorithm='myers', max_cost=10 ** 9)
+        approx = token_change_counts(a, b, algorithm='myers', max_cost=1000)
+        self.assertTrue(exact[3])
+        self.assertFalse(approx[3])
+        self.assertGreaterEqual(sum(approx[:3]), sum(exact[:3]))
+        with self.assertRaises(ValueError):
+            token_change_counts(a, b, algorithm='quadratic')
+
+    def test_summary_marks_approximate_counts(self):
+        a = [f'c{i}' for i in range(1000)]
+        b = a[::-1]
+        with patch('sql_compare.TOKEN_DIFF_MAX_COST', 100):
+            summary = build_difference_summary('', '', '', '', a, b, enable_join_reorder=False,
+                                               allow_full_outer=False, allow_left=False)
+        self.assertTrue(any(line.startswith('Token-level changes (approximate)') for line in summary))
+
+
+class TestCanonicalCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.cache = CanonicalCache(self.tmp)
+        self.addCleanup(self.cache.close)
+
+    def test_hit_skips_normalization_and_canonicalization(self):
+        first = compare_sql('select a, b from t', 'SELECT b, a FROM t', cache=self.cache)
+        self.assertTrue(first['canonical_equal'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        with patch('sql_compare.normalize_and_tokenize', side_effect=AssertionError), \
+                patch('sql_compare.normalize_and_intern', side_effect=AssertionError), \
+                patch('sql_compare.canonicalize_common', side_effect=AssertionError):
+            reopened = CanonicalCache(self.tmp)
+            self.addCleanup(reopened.close)
+            again = compare_sql('select a, b from t', 'SELECT b, a FROM t', cache=reopened)
+            self.assertEqual([again[k] for k in ('norm_a', 'tokens_b', 'can_a', 'canonical_equal')],
+                             [first[k] for k in ('norm_a', 'tokens_b', 'can_a', 'canonical_equal')])
+
+    def test_flags_are_part_of_the_key(self):
+        sql = 'select * from t join b on t.id = b.id join a on t.id = a.id'
+        compare_sql(sql, sql, cache=self.cache)['canonical_equal']
+        self.assertIsNone(self.cache.get(sql, 'j0'))
+        self.assertIsNotNone(self.cache.get(sql, 'j1f0l0'))
+
+    def test_eviction_keeps_the_store_bounded(self):
+        cache = CanonicalCache(self.tmp, max_bytes=2000)
+        for i in range(200):
+            cache.put(f'select {i}', 'j0', f'SELECT {i}', ['SELECT', str(i)], f'SELECT {i}')
+        cache.evict()
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], 2000)
+        self.assertGreater(stats['evictions'], 0)
+        self.assertIsNotNone(cache.get('select 199', 'j0'))
+        cache.close()
+
+    def test_unopenable_cache_does_not_fail_the_batch(self):
+        import io
+        root = Path(self.tmp) / 'sql'
+        for side, text in (('a', 'select a, b from t'), ('b', 'select b, a from t')):
+            for i in range(3):
+                (root / side).mkdir(parents=True, exist_ok=True)
+                (root / side / f'q{i}.sql').write_text(text, encoding='utf-8')
+        err = io.StringIO()
+        with patch('sql_compare.CanonicalCache', side_effect=RuntimeError('database is locked')) as opened, \
+                patch('sys.stderr', err):
+            res = list(iter_batch_results(pair_directories(str(root / 'a'), str(root / 'b')),
+                                          cache_dir=str(Path(self.tmp) / 'locked')))
+        self.assertEqual([r['status'] for r in res], ['equal'] * 3)
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(err.getvalue().count('[Cache] Disabled: database is locked'), 1)
+
+    def test_batch_workers_share_the_cache(self):
+        root = Path(self.tmp) / 'sql'
+        for side in ('a', 'b'):
+            (root / side).mkdir(parents=True)
+            (root / side / 'q.sql').write_text('select a, b from t' if side == 'a' else 'select b, a from t',
+                                               encoding='utf-8')
+        pairs = pair_directories(str(root / 'a'), str(root / 'b'))
+        for jobs, expected_hits in ((2, 0), (2, 2)):
+            with self.subTest(expected_hits=expected_hits):
+                res = list(iter_batch_results(pairs, jobs=jobs, cache_dir=str(Path(self.tmp) / 'cache')))
+                self.assertEqual(res[0]['status'], 'equal')
+                self.assertEqual(res[0]['cache_hits'], expected_hits)
+
+
+class TestMemoCache(unittest.TestCase):
+    def setUp(self):
+        configure_memo(max_entries=64, max_bytes=1 << 20)
+        self.addCleanup(configure_memo, max_entries=512, max_bytes=32 * 1024 * 1024)
+
+    def test_reference_query_is_normalized_once(self):
+        ref = 'select a, b from t where x = 1'
+        for cand in ('select b, a from t where x = 1', 'select a from t', 'select c from t'):
+            compare_sql(ref, cand)['canonical_equal']
+        stats = memo_stats()
+        self.assertGreaterEqual(stats['hits'], 4)
+        with patch('sql_compare._normalized_pieces', side_effect=AssertionError):
+            self.assertEqual(normalize_sql(ref), 'SELECT A, B FROM T WHERE X = 1')
+
+    def test_bounded_by_entries_and_bytes(self):
+        for max_entries, max_bytes in ((8, 1 << 20), (1000, 400)):
+            with self.subTest(max_entries=max_entries, max_bytes=max_bytes):
+                configure_memo(max_entries=max_entries, max_bytes=max_bytes)
+                for i in range(50):
+                    tokenize(f'SELECT col_{i} FROM some_table')
+                stats = memo_stats()
+                self.assertLessEqual(stats['entries'], max_entries)
+                self.assertLessEqual(stats['bytes'], max_bytes)
+                self.assertGreater(stats['evictions'], 0)
+
+    def test_cached_lists_are_not_shared(self):
+        tokens = tokenize('SELECT A')
+        tokens.append('X')
+        self.assertEqual(tokenize('SELECT A'), ['SELECT', 'A'])
+
+    def test_disable(self):
+        configure_memo(enabled=False)
+        normalize_sql('select 1'); normalize_sql('select 1')
+        self.assertEqual((memo_stats()['hits'], memo_stats()['entries']), (0, 0))
+        configure_memo(enabled=True)
+        normalize_sql('select 1'); normalize_sql('select 1')
+        self.assertEqual(memo_stats()['hits'], 1)
+
+    def test_thread_safe(self):
+        from concurrent.futures import ThreadPoolExecutor
+        configure_memo(max_entries=16)
+        queries = [f'select c{i % 40} from t' for i in range(2000)]
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(normalize_sql, queries))
+        self.assertEqual(results, [q.upper() for q in queries])
+        stats = memo_stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 2000)
+        self.assertLessEqual(stats['entries'], 16)
+
+
+class TestJsonlStream(unittest.TestCase):
+    def test_results_in_input_order(self):
+        import io
+        lines = ['{"id": "q1", "a": "select a, b from t", "b": "SELECT b, a FROM t"}', '',
+                 '{"id": 7, "a": "select a, b from t", "b": "SELECT b, a FROM t", "options": {"mode": "exact"}}',
+                 'not json', '{"id": "q3", "a": "select 1"}', '{"a": "select 1", "b": "select 1", "options": {"x": 1}}',
+                 '{"a": "select 1", "b": "' + 'x' * 200 + '"}', '{"a": "select 1", "b": "select 2"}']
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                res = list(iter_jsonl_results(io.StringIO('\n'.join(lines)), jobs=jobs, max_line_chars=120))
+                self.assertEqual([(r['id'], r['status']) for r in res], [
+                    ('q1', 'equal'), (7, 'different'), ('line 4', 'error'), ('q3', 'error'),
+                    ('line 6', 'error'), ('line 7', 'error'), ('line 8', 'different')])
+                self.assertIn('memory budget', res[5]['detail'])
+
+    def test_stream_is_consumed_lazily(self):
+        class Endless:
+            def readline(self, limit=-1):
+                return '{"a": "select 1", "b": "SELECT 1"}\n'
+        results = iter_jsonl_results(Endless())
+        self.assertEqual(next(results)['status'], 'equal')
+        results.close()
+
+    def test_cli(self):
+        import io
+        stdin = io.StringIO('{"id": 1, "a": "select 1", "b": "select 1"}\n')
+        out = io.StringIO()
+        with patch('sql_compare.sys.stdin', stdin), patch('sql_compare.sys.stdout', out):
+            with self.assertRaises(SystemExit) as cm:
+                main(['--jsonl'])
+        self.assertEqual(cm.exception.code, 0)
+        self.assertEqual(out.getvalue(), '{"id": 1, "status": "equal", "detail": "", "summary": [], "tier": "raw"}\n')
+
+
+class TestClusterQueries(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+        (self.tmp / 'dir').mkdir()
+        (self.tmp / 'dir' / '1.sql').write_text('select a, b from t', encoding='utf-8')
+        (self.tmp / 'dir' / '2.sql').write_text('SELECT b , A FROM T;', encoding='utf-8')
+        (self.tmp / 'dir' / '3.sql').write_text('select c from t', encoding='utf-8')
+        (self.tmp / 'q.jsonl').write_text(
+            '{"id": "svc", "sql": "select b, a from t"}\n\n"select d from t"\n', encoding='utf-8')
+
+    def test_collect_inputs(self):
+        items = collect_cluster_inputs([str(self.tmp / 'dir'), str(self.tmp / 'q.jsonl')])
+        self.assertEqual([i[0] for i in items][3:], ['svc', f"{self.tmp / 'q.jsonl'}:3"])
+        self.assertIsNone(items[0][2])
+        (self.tmp / 'bad.jsonl').write_text('{"sql": 1}\n', encoding='utf-8')
+        with self.assertRaises(ValueError):
+            collect_cluster_inputs([str(self.tmp / 'bad.jsonl')])
+
+    def test_classes_largest_first(self):
+        items = collect_cluster_inputs([str(self.tmp / 'dir'), str(self.tmp / 'q.jsonl'), str(self.tmp / 'missing.sql')])
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                classes, errors = cluster_queries(items, jobs=jobs)
+                self.assertEqual([len(c['members']) for c in classes], [3, 1, 1])
+                self.assertEqual(classes[0]['members'][2], 'svc')
+                self.assertEqual(classes[0]['canonical'], 'SELECT A, B FROM T')
+                self.assertEqual([e[0] for e in errors], [str(self.tmp / 'missing.sql')])
+
+    def test_cli_exit_codes(self):
+        cases = [
+            ([str(self.tmp / 'dir' / '1.sql'), str(self.tmp / 'dir' / '2.sql')], 0),
+            ([str(self.tmp / 'dir')], 1),
+            ([str(self.tmp / 'dir'), str(self.tmp / 'nope.sql')], 2),
+        ]
+        for paths, code in cases:
+            with self.subTest(paths=paths), patch('builtins.print'):
+                with self.assertRaises(SystemExit) as cm:
+                    main(['--cluster', *paths])
+                self.assertEqual(cm.exception.code, code)
+
+
+class TestScriptStatements(unittest.TestCase):
+    def test_iter_statements(self):
+        cases = [
+            ('select 1; select 2;', False, ['select 1', 'select 2']),
+            ("select ';' from t; select 2", False, ["select ';' from t", 'select 2']),
+            ('select "a;b", [c;d] from t -- x;y\n; select 2', False, ['select "a;b", [c;d] from t -- x;y', 'select 2']),
+            ('insert into t values (1;2); /* ; */', False, ['insert into t values (1;2)']),
+            ('select 1\nGO\nselect 2\ngo\n', True, ['select 1', 'select 2']),
+            ('select 1\nGO\nselect 2', False, ['select 1\nGO\nselect 2']),
+            ("select 'GO\nGO\n'", True, ["select 'GO\nGO\n'"]),
+            ("select 'unclosed; x", False, ["select 'unclosed; x"]),
+            ('', False, []),
+        ]
+        for sql, go, expected in cases:
+            with self.subTest(sql=sql, go=go):
+                self.assertEqual(list(iter_statements(sql, go_separator=go)), expected)
+
+    def test_chunked_stream_matches_whole_text(self):
+        import io
+        sql = ("-- header\nselect 'a;b' from t; insert into x values (1, ';');\n/* c; */ update y set a = 1\n"
+               "GO\nselect \"q;\" from z;\r\nselect '" + 'x' * 300 + "'; select [a]\n")
+        expected = list(iter_statements(sql, go_separator=True))
+        self.assertEqual(len(expected), 6)
+        for chunk_size in (1, 2, 3, 7, 64):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iter_statements(io.StringIO(sql), go_separator=True, chunk_size=chunk_size)),
+                                 expected)
+
+    def test_long_statement_is_read_in_growing_chunks(self):
+        import io
+        sql = 'insert into t values ' + ', '.join(f"({i}, 'v{i}')" for i in range(20000)) + '; select 1'
+        reads = []
+        stream = io.StringIO(sql)
+        source = type('Source', (), {'read': lambda self, n: reads.append(n) or stream.read(n)})()
+        self.assertEqual(list(iter_statements(source, chunk_size=64)), [sql[:sql.index(';')], 'select 1'])
+        self.assertLess(len(reads), 20)   # a fixed chunk size would take ~5,500 reads, each copying the buffer
+
+    def test_statements_are_consumed_lazily(self):
+        stream = iter_statements('select 1; select 2; select 3')
+        self.assertEqual(next(stream), 'select 1')
+
+    def test_per_statement_verdicts(self):
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                a = iter_statements('select a, b from t; select 1; select 2')
+                b = iter_statements('select b, a from t; select 9')
+                results = list(iter_script_results(a, b, jobs=jobs))
+                self.assertEqual([r['status'] for r in results], ['equal', 'different', 'missing'])
+                self.assertEqual(results[0]['label'], '#1 select a, b from t')
+
+    def test_cli(self):
+        import tempfile
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        (tmp / 'a.sql').write_text('select a, b from t;\nGO\nselect 1;', encoding='utf-8')
+        (tmp / 'b.sql').write_text('SELECT b, a FROM t\nGO\nselect 1', encoding='utf-8')
+        with self.assertRaises(SystemExit) as cm:
+            main(['--script', '--go', '--check', str(tmp / 'a.sql'), str(tmp / 'b.sql')])
+        self.assertEqual(cm.exception.code, 0)
+
+
+class TestLargeInputs(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_streamed_normalization_matches_whole_text(self):
+        sql = ("  -- header\nselect a,  b /* c\n */ from t\nwhere x = 'it''s  -- no'\n"
+               "and \"q  x\" = [b  c] -- tail\n;\n" + 'x' * 300 + " 'unclosed  ")
+        path = self.tmp / 'big.sql'
+        path.write_text(sql, encoding='utf-8')
+        expected = normalize_sql(sql)
+        for chunk_size in (1, 2, 3, 7, 64, 1 << 20):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(normalize_sql_file(str(path), chunk_size=chunk_size), expected)
+                self.assertEqual(ws_only_normalize_file(str(path), chunk_size=chunk_size), ws_only_normalize(sql))
+
+    def test_budget_streams_instead_of_refusing(self):
+        path = self.tmp / 'a.sql'
+        path.write_text('select b, a -- c\nfrom t;', encoding='utf-8')
+        self.assertNotIsInstance(read_sql_file(str(path)), PrenormalizedSQL)
+        text = read_sql_file(str(path), budget=8)
+        self.assertIsInstance(text, PrenormalizedSQL)
+        self.assertEqual(text, 'SELECT B, A FROM T')
+        self.assertEqual(normalize_sql(text), text)
+        self.assertTrue(compare_sql(text, 'select a, b from t')['canonical_equal'])
+
+    def test_streamed_inputs_give_the_same_verdicts(self):
+        pairs = [
+            ('select a\n  from t', 'select a from t'),
+            ('select a from t', 'SELECT A FROM T'),
+            ('select a from t;', 'select a from t ; '),
+            ('select 1 -- x\n, 2', 'select 1 -- x , 2'),
+            ("select 'a  b' from t", "select 'a b' from t"),
+            ('select a, b from t', 'select b, a from t'),
+            ('select a from t', 'select a from t'),
+        ]
+        for n, (a, b) in enumerate(pairs):
+            paths = []
+            for side, text in (('a', a), ('b', b)):
+                paths.append(self.tmp / f'{n}{side}.sql')
+                paths[-1].write_text(text, encoding='utf-8')
+            for streamed in ((True, False), (False, True), (True, True)):
+                texts = [read_sql_file(str(path), budget=0 if stream else None) for path, stream in zip(paths, streamed)]
+                for mode, ignore_ws in (('both', False), ('exact', False), ('exact', True), ('canonical', True)):
+                    with self.subTest(pair=n, streamed=streamed, mode=mode, ignore_ws=ignore_ws):
+                        self.assertEqual(compare_sql(*texts).decide(mode, ignore_ws)[0],
+                                         compare_sql(a, b).decide(mode, ignore_ws)[0])
+                        result, plain = compare_sql(*texts), compare_sql(a, b)
+                        for key in ('ws_equal', 'exact_equal', 'canonical_equal', 'ws_a', 'ws_b', 'diff_ws'):
+                            self.assertEqual(result[key], plain[key], key)
+
+    def test_cli_memory_budget(self):
+        (self.tmp / 'b.sql').write_text('SELECT a, b FROM t', encoding='utf-8')
+        (self.tmp / 'a.sql').write_text('select b, a /* big */ from t;', encoding='utf-8')
+        with self.assertRaises(SystemExit) as cm:
+            main(['--check', '--memory-budget-mb', '0.00001', str(self.tmp / 'a.sql'), str(self.tmp / 'b.sql')])
+        self.assertEqual(cm.exception.code, 0)
+
+
+class TestCompareDaemon(unittest.TestCase):
+    def setUp(self):
+        import threading
+        self.daemon = CompareDaemon('127.0.0.1:0')
+        threading.Thread(target=self.daemon.serve_forever, daemon=True).start()
+        self.addCleanup(self.daemon.shutdown)
+
+    def test_compare_fingerprint_and_report(self):
+        reply = daemon_call(self.daemon.addr, '/compare', {
+            'a': 'select a, b from t', 'b': 'SELECT b, a FROM t', 'mode': 'exact', 'keys': ['canonical_equal']})
+        self.assertEqual(reply, {'success': False, 'tier': 'exact', 'result': {'canonical_equal': True}})
+        reply = daemon_call(self.daemon.addr, '/fingerprint', {'sql': 'select a, b from t', 'digest_size': 8})
+        self.assertEqual(reply['fingerprint'], canonical_fingerprint('select a, b from t', digest_size=8))
+        reply = daemon_call(self.daemon.addr, '/report', {'a': 'select 1', 'b': 'select 2', 'format': 'txt'})
+        self.assertIn('Canonical equal      : NO', reply['report'])
+        self.assertIsNone(daemon_call(self.daemon.addr, '/compare', {'a': 'select 1'}))
+        self.assertEqual(self.daemon.stats()['requests'], 3)
+
+    def test_identical_requests_are_coalesced(self):
+        import threading
+        coalescer = _Coalescer()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 42
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(coalescer.run('k', slow)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(coalescer.run('k', slow))) for _ in range(3)]
+        for t in followers:
+            t.start()
+        deadline = time.monotonic() + 5
+        while coalescer.coalesced < 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        self.assertEqual(coalescer.coalesced, 3)
+        for t in [leader] + followers:
+            t.join(5)
+        self.assertEqual((results, len(calls)), ([42] * 4, 1))
+
+    def test_route_failures_get_a_json_error(self):
+        import http.client
+        with patch('sql_compare.canonical_fingerprint', side_effect=RecursionError('too deep')):
+            conn = http.client.HTTPConnection(*self.daemon.addr.rsplit(':', 1), timeout=5)
+            self.addCleanup(conn.close)
+            conn.request('POST', '/fingerprint', body=b'{"sql": "select 1"}')
+            resp = conn.getresponse()
+            self.assertEqual((resp.status, json.loads(resp.read())), (500, {'error': 'RecursionError: too deep'}))
+            self.assertIsNone(daemon_call(self.daemon.addr, '/fingerprint', {'sql': 'select 1'}))
+        self.assertIsNotNone(daemon_call(self.daemon.addr, '/fingerprint', {'sql': 'select 1'}))
+
+    def test_only_loopback_addresses_are_served(self):
+        for addr in ('0.0.0.0:0', '192.0.2.1:0', 'example.com:0'):
+            with self.subTest(addr=addr), self.assertRaises(ValueError):
+                CompareDaemon(addr)
+        with patch('sys.stderr'), self.assertRaises(SystemExit) as cm:
+            main(['--serve', '0.0.0.0:0'])
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_request_count_is_exact_under_concurrency(self):
+        import threading
+        threads = [threading.Thread(target=daemon_call, args=(self.daemon.addr, '/fingerprint', {'sql': f'select {i}'}))
+                   for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        self.assertEqual(self.daemon.stats()['requests'], 20)
+
+    def test_cli_client_falls_back_in_process(self):
+        self.daemon.shutdown()
+        with self.assertRaises(SystemExit) as cm:
+            main(['--daemon', self.daemon.addr, '--check', '--strings', 'select a, b from t', 'select b, a from t'])
+        self.assertEqual(cm.exception.code, 0)
+
+    def test_cli_client_compares_streamed_files_in_process(self):
+        import tempfile
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp)
+        (tmp / 'a.sql').write_text('select a from t', encoding='utf-8')
+        (tmp / 'b.sql').write_text('SELECT A FROM T', encoding='utf-8')
+        with self.assertRaises(SystemExit) as cm:
+            main(['--daemon', self.daemon.addr, '--mode', 'exact', '--ignore-whitespace', '--check',
+                  '--memory-budget-mb', '0.00001', str(tmp / 'a.sql'), str(tmp / 'b.sql')])
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(self.daemon.stats()['requests'], 0)
+
+    def test_cli_client_uses_daemon(self):
+        with patch('builtins.print'), self.assertRaises(SystemExit) as cm:
+            main(['--daemon', self.daemon.addr, '--mode', 'exact', '--strings', 'select a, b from t', 'select b, a from t'])
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(self.daemon.stats()['requests'], 1)
+
+
+class TestAlignScripts(unittest.TestCase):
+    def ops(self, a, b, **kw):
+        return [(r['op'], r['a'], r['b']) for r in align_scripts(a, b, **kw)]
+
+    def test_failed_statements_never_match(self):
+        import sql_compare
+        real = sql_compare.canonicalize_common
+
+        def failing(sql, **flags):
+            if 'BOOM' in sql:
+                raise ValueError('cannot canonicalize')
+            return real(sql, **flags)
+
+        with patch('sql_compare.canonicalize_common', side_effect=failing):
+            results = align_scripts(['select 1', 'select boom'], ['select 1', 'select boom'])
+        self.assertEqual([(r['op'], r['a'], r['b']) for r in results], [('unchanged', 0, 0), ('modified', 1, 1)])
+        self.assertEqual(results[1]['detail'], 'canonicalization failed: cannot canonicalize')
+
+    def test_classification(self):
+        a = ['select 1', 'select a, b from t', 'insert into x values (1)', 'drop table z', 'select 5']
+        b = ['select 5', 'select 1', 'SELECT b, a FROM t', 'insert into x values (2)', 'select 6']
+        cases = [
+            ((a, a), [('unchanged', i, i) for i in range(5)]),
+            ((a, b), [('moved', 4, 0), ('unchanged', 0, 1), ('unchanged', 1, 2),
+                      ('modified', 2, 3), ('modified', 3, 4)]),
+            ((a[:2], a[:3]), [('unchanged', 0, 0), ('unchanged', 1, 1), ('added', None, 2)]),
+            ((a[:3], [a[0], a[2]]), [('unchanged', 0, 0), ('removed', 1, None), ('unchanged', 2, 1)]),
+            (([], a[:1]), [('added', None, 0)]),
+        ]
+        for (sa, sb), expected in cases:
+            with self.subTest(a=sa, b=sb):
+                self.assertEqual(self.ops(sa, sb), expected)
+
+    def test_only_modified_pairs_get_a_detailed_compare(self):
+        a = [f'select c{i} from t' for i in range(50)]
+        b = [a[40]] + a[:40] + a[41:]
+        b[21] = 'select changed from t'
+        with patch('sql_compare.compare_sql', wraps=compare_sql) as spy:
+            res = align_scripts(a, b)
+        self.assertEqual(spy.call_count, 1)
+        modified = [r for r in res if r['op'] == 'modified']
+        self.assertEqual(len(modified), 1)
+        self.assertTrue(modified[0]['summary'])
+        self.assertTrue(all(r['op'] in ('unchanged', 'moved', 'modified') for r in res))
+
+    def test_every_statement_reported_once(self):
+        import random
+        rnd = random.Random(7)
+        a = [f'select c{i % 40} from t' for i in range(300)]
+        b = a[:]
+        for _ in range(30):
+            b.insert(rnd.randrange(len(b)), b.pop(rnd.randrange(len(b))))
+        del b[50:60]
+        b[100:100] = ['select new from t'] * 5
+        res = align_scripts(a, b, jobs=2)
+        self.assertEqual(sorted(r['a'] for r in res if r['a'] is not None), list(range(len(a))))
+        self.assertEqual([r['b'] for r in res if r['b'] is not None], list(range(len(b))))
+
+
 if __name__ == '__main__':
     unittest.main()